@@ -1,14 +1,90 @@
 import os
+import dataclasses
+from dataclasses import dataclass
+from typing import Optional
 import dotenv
 
 dotenv.load_dotenv()
 
+# 服务提供方：remote调用各云服务，local使用本地确定性占位实现（离线预览）
+PROVIDER_REMOTE = "remote"
+PROVIDER_LOCAL = "local"
+
+# 图生视频提示词的生成方式：text仅根据首尾帧的文生图提示词与场景文本，vision附带首尾帧图片
+VIDEO_PROMPT_TEXT = "text"
+VIDEO_PROMPT_VISION = "vision"
+
+
+def env_list(name: str) -> tuple:
+    """逗号分隔的环境变量列表"""
+    return tuple(item.strip() for item in os.getenv(name, "").split(",") if item.strip())
+
+
 class Config:
+    # 服务提供方
+    PROVIDER = PROVIDER_REMOTE
+    LOCAL_FONT_FILE = None  # 离线占位图使用的字体文件，未指定时使用ffmpeg默认字体
+    OFFLINE_WORKSPACE = "offline"  # 离线模式未指定--workspace时的输出目录
+    
     # 模型配置
     LLM_MODEL = "qwen3-max"
     LLM_MODEL_PROVIDER = "openai"
     LLM_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
     LLM_API_KEY = os.getenv("LLM_API_KEY")
+    LLM_API_KEYS = env_list("LLM_API_KEYS")  # 额外的LLM账号，与LLM_API_KEY组成账号池
+    LLM_PROMPT_CACHE = False  # 为消息前缀（系统提示词与章节上下文）开启显式上下文缓存
+    # 支持显式缓存（cache_control）的模型，开启缓存后仅对这些模型标记前缀，其他模型的请求保持原样
+    LLM_PROMPT_CACHE_MODELS = ("qwen3-max", "qwen-max", "qwen-plus", "qwen-flash", "qwen3-coder-plus", "qwen3-coder-flash")
+
+    # 长章节分块生成口播文案：按段落切块并行生成分段草稿，再合并为20段文案
+    VOICE_SCRIPT_MAP_REDUCE = True
+    VOICE_SCRIPT_CHUNK_CHARS = 4000  # 每块的最大字数，章节不超过该字数时仍整章一次生成
+    VOICE_SCRIPT_CHUNK_RETRIES = 2  # 单块草稿生成失败后的重试次数
+    VOICE_SCRIPT_CHUNK_CONCURRENCY = 4  # 同时生成草稿的块数
+    
+    # 豆包文生图配置
+    DOUBAO_API_KEY = os.getenv("DOUBAO_API_KEY")
+    DOUBAO_API_KEYS = env_list("DOUBAO_API_KEYS")  # 额外的方舟账号
+    ARK_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+    IMAGE_MODEL = "doubao-seedream-4-5-251128"
+    IMAGE_PROMPT_BATCH_SIZE = 10  # 单次LLM调用生成首尾帧提示词的场景数，<=1时逐场景生成
+    IMAGE_CONCURRENCY = 4  # 异步工作流中同时生成首尾帧的场景数
+
+    # 人物写真：同一人物的不同称呼按人物登记表归并为一个规范名，只生成一张写真
+    CHARACTER_ALIAS_RESOLUTION = True
+    PORTRAIT_CONCURRENCY = 4  # 同时生成的人物写真数
+
+    # 语音合成：根据口播文案为每个场景合成配音（voice/{场景}.wav），为空时沿用手动准备的配音
+    TTS_ENGINE = "cosyvoice"  # 已注册的引擎：cosyvoice、local（按语速生成静音的本地替身）
+    TTS_MODEL = "cosyvoice-v2"
+    TTS_VOICE = "longxiaochun_v2"
+    TTS_API_KEY = os.getenv("DASHSCOPE_API_KEY")  # 未设置时使用LLM_API_KEY（同为百炼凭证）
+    TTS_CONCURRENCY = 4  # 同时合成的场景数
+    TTS_CHARS_PER_SECOND = 4.5  # 朗读语速 字/秒，用于本地替身引擎与规划时估算时长
+
+    # 本地质量检查：提交即梦前检查首尾帧，接受视频前完整解码
+    QUALITY_GATE = True
+    QUALITY_MAX_RETRIES = 2  # 不合格图片的重新生成次数
+    FRAME_BLACK_LEVEL = 16  # 平均亮度低于该值视为全黑（0-255）
+    FRAME_FLAT_STD = 6.0  # 亮度标准差低于该值视为纯色
+    FRAME_MIN_HASH_DISTANCE = 5  # 首尾帧差值哈希的汉明距离低于该值视为过于相似（共64位）
+    CLIP_MIN_FRAME_RATIO = 0.9  # 视频帧数低于期望帧数的该比例视为截断
+
+    # 请求对冲：调用超过同类调用p90耗时仍未返回时再发出一个相同请求，取先成功者
+    HEDGE_BUDGET = 0.1  # 对冲请求数占调用总数的上限，0为关闭
+    HEDGE_QUANTILE = 0.9  # 发出对冲请求的耗时分位数
+    HEDGE_MIN_SAMPLES = 20  # 同类调用的耗时样本数达到该值后才开始对冲
+    IMAGE_HEDGE_BUDGET = 0.0  # 文生图的对冲预算，重复请求同样按张计费，默认关闭
+    HEDGE_MAX_WORKERS = 32  # 同步调用的对冲线程数，线程占满时新调用在调用方线程直接执行、不对冲
+    
+    # 火山引擎视觉服务（即梦）凭证
+    ACCESS_KEY_ID = os.getenv("ACCESS_KEY_ID")
+    SECRET_ACCESS_KEY = os.getenv("SECRET_ACCESS_KEY")
+    JIMENG_CREDENTIALS = tuple(tuple(pair.split(":", 1)) for pair in env_list("JIMENG_CREDENTIALS") if ":" in pair)  # 额外的即梦账号，格式AK:SK,AK:SK
+
+    # 账号池：每次调用分配给进行中调用最少的账号
+    CREDENTIAL_COOLDOWN_SECONDS = 30  # 账号被限流后暂停分配的时长 秒
+    CREDENTIAL_QUARANTINE_SECONDS = 1800  # 账号鉴权失败或额度耗尽后隔离的时长 秒
     
     # 多媒体模型配置
     VIDEO_DURATION = 5  # 视频时长 秒 -1:根据场景内容自动调整(仅1.5pro)
@@ -19,11 +95,46 @@ class Config:
     VIDEO_DIR = "video"
     MERGED_VIDEO_PATH = "merged_video.mp4"
     CHARACTER_DIR = "character"
+    HISTORY_DIR = "history"
+    VOICE_DIR = "voice"
+    PREVIEW_DIR = "preview"  # 渐进式HLS预览（index.html / index.m3u8）
+    PREVIEW_HLS_JS = None  # 本地hls.js文件路径，复制到预览目录供不支持原生HLS的浏览器离线使用；未指定时从CDN加载
+    MEDIA_STORE_DIR = "media_store"  # 全局内容寻址媒体库，跨章节/跨运行复用产物，为空时不启用
+    MEDIA_STORE_BUDGET_GB = 20  # 媒体库大小预算，超出时按LRU回收无引用的对象
+    CASSETTE_TIME_SCALE = 1.0  # 回放录制时的耗时缩放，0表示不等待，1表示按录制时的耗时回放
     
     # 小说配置
     NOVEL_FILE_PATH = "小说素材.txt"
     TARGET_CHAPTER = "第3章 闻姑娘还真是……娇气"
     
+    # 日志配置
+    LOG_FILE = "novel_video.log"  # JSON Lines格式
+    LOG_LEVEL = "INFO"
+    LOG_PAYLOAD_LIMIT = 200  # 提示词等大文本日志保留的最大字符数
+    LOG_PAYLOAD_SAMPLE_RATE = 0.01  # 大文本日志保留全文的抽样比例
+    
+    # 作业服务配置（--serve）
+    SERVER_HOST = "127.0.0.1"
+    SERVER_PORT = 8765
+    SERVER_WORKERS = 2  # 同时执行的作业数
+    SERVER_MAX_EVENTS = 2000  # 每个作业在内存中保留的进度事件数
+    SERVER_SSE_KEEPALIVE = 15  # SSE心跳间隔 秒
+    SERVER_EVENTS_RETENTION = 600  # 作业结束后内存事件的保留时长 秒，之后订阅者直接读取作业最终状态
+    JOBS_DIR = "jobs"  # 作业数据库及各作业的工作目录
+    
+    # 分布式执行配置（--queue / --worker）
+    QUEUE_URL = None  # memory:// | sqlite:///共享存储/queue.db | redis://host:6379/0
+    LEASE_SECONDS = 120  # 任务租约时长 秒
+    HEARTBEAT_SECONDS = 30  # worker续约间隔 秒
+    WORKER_POLL_INTERVAL = 5  # 队列为空时的轮询间隔 秒
+    TASK_MAX_ATTEMPTS = 3  # 场景任务最大尝试次数
+    LOCK_STALE_SECONDS = 600  # 锁文件超过此时长未刷新视为持有者已退出 秒
+
+    # 监听模式（连载小说增量处理）
+    WATCH_DIR = "watch"  # 章节索引、各章节输出目录与共享人物写真
+    WATCH_INTERVAL = 60  # 检查小说文件的间隔 秒
+    WATCH_SETTLE_SECONDS = 30  # 文件停止变化超过此时长才重新索引，避免处理写了一半的章节 秒
+    
     # 测试配置
     TEST_MODE = True
     MAX_SCENES = 1
@@ -31,9 +142,176 @@ class Config:
     # 视频生成配置
     MAX_VIDEO_RETRIES = 100
     VIDEO_POLL_INTERVAL = 8  # 视频轮询 秒 
+    VIDEO_PROMPT_MODE = VIDEO_PROMPT_TEXT  # 首尾帧提示词未知（无记录或图片已变化）或首尾帧未通过质量检查时回退到vision
     
     # Jimeng AI Configuration
     JIMENG_MODEL_NAME = "jimeng_i2v_first_tail_v30" 
     VIDEO_FRAME_RATE = 24
     VIDEO_MIN_FRAMES = 141
     VIDEO_MAX_FRAMES = 241
+    VIDEO_MIN_STRETCH_RATIO = 0.6  # 短场景音频/视频时长比不低于此值时加速视频，否则补齐静音
+    VIDEO_MAX_WORKERS = 4  # 单场景子片段并行提交数
+    VIDEO_CONCURRENCY = 4  # 每个即梦账号同时进行的视频任务上限（账号并发限制），任何账号都不会超过
+    STREAM_MUX = True  # 单子片段场景边下载边与配音合并，原始片段仅在媒体库需要时保存
+    JIMENG_QUEUE_SECONDS = 60  # 即梦任务排队耗时估计 秒
+    JIMENG_SECONDS_PER_FRAME = 0.5  # 即梦每帧生成耗时估计 秒
+    
+    # 运行规划估算配置（--plan）
+    EXPECTED_SCENES = 20  # 尚未生成文案时按口播提示词约定的段落数估算
+    LLM_SECONDS_PER_CALL = 20  # 单次LLM调用耗时估计 秒
+    IMAGE_SECONDS_PER_CALL = 15  # 单张文生图耗时估计 秒
+    LLM_COST_PER_CALL = 0.05  # 单次LLM调用费用估计 元
+    IMAGE_COST_PER_CALL = 0.25  # 单张文生图费用估计 元
+    VIDEO_COST_PER_SECOND = 0.3  # 即梦视频每秒费用估计 元
+    LLM_INPUT_COST_PER_1K_TOKENS = 0.0008  # LLM输入每千token费用 元（按响应中的用量记录实际费用）
+    LLM_OUTPUT_COST_PER_1K_TOKENS = 0.002  # LLM输出每千token费用 元
+
+    # 预算与截止时间（为None时不限制）
+    RUN_BUDGET = None  # 单次运行的费用预算 元，超出时按单位费用产出从低到高放弃场景
+    RUN_DEADLINE_SECONDS = None  # 单次运行自开始起的截止时间 秒，来不及时降级或放弃场景
+    POLL_STUCK_FACTOR = 3.0  # 有截止时间时，即梦任务轮询超过预计耗时的该倍数视为卡住并放弃
+    DEGRADED_MAX_STRETCH = 2.0  # 降级场景只生成一个子片段，帧数最少为音频所需的1/该值，再放慢对齐音频
+
+
+@dataclass(frozen=True)
+class RunConfig:
+    """
+    单次运行的不可变配置
+
+    默认值取自Config，运行时通过replace/with_workspace派生新配置，
+    并显式传入create_workflow及各服务函数，使同一进程内可并发运行多个工作流。
+    """
+    # 服务提供方
+    provider: str = Config.PROVIDER
+    local_font_file: Optional[str] = Config.LOCAL_FONT_FILE
+
+    # 模型配置
+    llm_model: str = Config.LLM_MODEL
+    llm_model_provider: str = Config.LLM_MODEL_PROVIDER
+    llm_base_url: str = Config.LLM_BASE_URL
+    llm_api_key: Optional[str] = Config.LLM_API_KEY
+    llm_api_keys: tuple = Config.LLM_API_KEYS
+    llm_prompt_cache: bool = Config.LLM_PROMPT_CACHE
+    llm_prompt_cache_models: tuple = Config.LLM_PROMPT_CACHE_MODELS
+    voice_script_map_reduce: bool = Config.VOICE_SCRIPT_MAP_REDUCE
+    voice_script_chunk_chars: int = Config.VOICE_SCRIPT_CHUNK_CHARS
+    voice_script_chunk_retries: int = Config.VOICE_SCRIPT_CHUNK_RETRIES
+    voice_script_chunk_concurrency: int = Config.VOICE_SCRIPT_CHUNK_CONCURRENCY
+
+    # 豆包文生图配置
+    doubao_api_key: Optional[str] = Config.DOUBAO_API_KEY
+    doubao_api_keys: tuple = Config.DOUBAO_API_KEYS
+    ark_base_url: str = Config.ARK_BASE_URL
+    image_model: str = Config.IMAGE_MODEL
+    image_prompt_batch_size: int = Config.IMAGE_PROMPT_BATCH_SIZE
+    image_concurrency: int = Config.IMAGE_CONCURRENCY
+    character_alias_resolution: bool = Config.CHARACTER_ALIAS_RESOLUTION
+    portrait_concurrency: int = Config.PORTRAIT_CONCURRENCY
+
+    # 语音合成
+    tts_engine: Optional[str] = Config.TTS_ENGINE
+    tts_model: str = Config.TTS_MODEL
+    tts_voice: str = Config.TTS_VOICE
+    tts_api_key: Optional[str] = Config.TTS_API_KEY
+    tts_concurrency: int = Config.TTS_CONCURRENCY
+    tts_chars_per_second: float = Config.TTS_CHARS_PER_SECOND
+
+    # 本地质量检查
+    quality_gate: bool = Config.QUALITY_GATE
+    quality_max_retries: int = Config.QUALITY_MAX_RETRIES
+    frame_black_level: float = Config.FRAME_BLACK_LEVEL
+    frame_flat_std: float = Config.FRAME_FLAT_STD
+    frame_min_hash_distance: int = Config.FRAME_MIN_HASH_DISTANCE
+    clip_min_frame_ratio: float = Config.CLIP_MIN_FRAME_RATIO
+
+    # 请求对冲
+    hedge_budget: float = Config.HEDGE_BUDGET
+    hedge_quantile: float = Config.HEDGE_QUANTILE
+    hedge_min_samples: int = Config.HEDGE_MIN_SAMPLES
+    image_hedge_budget: float = Config.IMAGE_HEDGE_BUDGET
+    hedge_max_workers: int = Config.HEDGE_MAX_WORKERS
+
+    # 火山引擎视觉服务（即梦）凭证
+    access_key_id: Optional[str] = Config.ACCESS_KEY_ID
+    secret_access_key: Optional[str] = Config.SECRET_ACCESS_KEY
+    jimeng_credentials: tuple = Config.JIMENG_CREDENTIALS
+    credential_cooldown_seconds: float = Config.CREDENTIAL_COOLDOWN_SECONDS
+    credential_quarantine_seconds: float = Config.CREDENTIAL_QUARANTINE_SECONDS
+
+    # 多媒体模型配置
+    video_duration: int = Config.VIDEO_DURATION
+    video_resolution: str = Config.VIDEO_RESOLUTION
+
+    # 工作目录配置
+    image_dir: str = Config.IMAGE_DIR
+    video_dir: str = Config.VIDEO_DIR
+    merged_video_path: str = Config.MERGED_VIDEO_PATH
+    character_dir: str = Config.CHARACTER_DIR
+    history_dir: str = Config.HISTORY_DIR
+    voice_dir: str = Config.VOICE_DIR
+    preview_dir: str = Config.PREVIEW_DIR
+    preview_hls_js: Optional[str] = Config.PREVIEW_HLS_JS
+    media_store_dir: Optional[str] = Config.MEDIA_STORE_DIR  # 全局共享，with_workspace不改变
+    media_store_budget_gb: float = Config.MEDIA_STORE_BUDGET_GB
+
+    # 小说配置
+    novel_file_path: str = Config.NOVEL_FILE_PATH
+    target_chapter: str = Config.TARGET_CHAPTER
+    watch_interval: float = Config.WATCH_INTERVAL
+    watch_settle_seconds: float = Config.WATCH_SETTLE_SECONDS
+
+    # 测试配置
+    test_mode: bool = Config.TEST_MODE
+    max_scenes: int = Config.MAX_SCENES
+
+    # 视频生成配置
+    max_video_retries: int = Config.MAX_VIDEO_RETRIES
+    video_poll_interval: float = Config.VIDEO_POLL_INTERVAL
+    video_prompt_mode: str = Config.VIDEO_PROMPT_MODE
+
+    # Jimeng AI Configuration
+    jimeng_model_name: str = Config.JIMENG_MODEL_NAME
+    video_frame_rate: int = Config.VIDEO_FRAME_RATE
+    video_min_frames: int = Config.VIDEO_MIN_FRAMES
+    video_max_frames: int = Config.VIDEO_MAX_FRAMES
+    video_min_stretch_ratio: float = Config.VIDEO_MIN_STRETCH_RATIO
+    video_max_workers: int = Config.VIDEO_MAX_WORKERS
+    video_concurrency: int = Config.VIDEO_CONCURRENCY
+    stream_mux: bool = Config.STREAM_MUX
+    jimeng_queue_seconds: float = Config.JIMENG_QUEUE_SECONDS
+    jimeng_seconds_per_frame: float = Config.JIMENG_SECONDS_PER_FRAME
+
+    # 运行规划估算配置
+    expected_scenes: int = Config.EXPECTED_SCENES
+    llm_seconds_per_call: float = Config.LLM_SECONDS_PER_CALL
+    image_seconds_per_call: float = Config.IMAGE_SECONDS_PER_CALL
+    llm_cost_per_call: float = Config.LLM_COST_PER_CALL
+    image_cost_per_call: float = Config.IMAGE_COST_PER_CALL
+    video_cost_per_second: float = Config.VIDEO_COST_PER_SECOND
+    llm_input_cost_per_1k_tokens: float = Config.LLM_INPUT_COST_PER_1K_TOKENS
+    llm_output_cost_per_1k_tokens: float = Config.LLM_OUTPUT_COST_PER_1K_TOKENS
+    budget: Optional[float] = Config.RUN_BUDGET
+    deadline_seconds: Optional[float] = Config.RUN_DEADLINE_SECONDS
+    poll_stuck_factor: float = Config.POLL_STUCK_FACTOR
+    degraded_max_stretch: float = Config.DEGRADED_MAX_STRETCH
+
+    def replace(self, **changes) -> "RunConfig":
+        """返回修改了指定字段的新配置"""
+        return dataclasses.replace(self, **changes)
+
+    def with_workspace(self, root: str) -> "RunConfig":
+        """返回将所有输出目录置于root下的新配置，用于隔离并发运行的产物"""
+        return self.replace(
+            image_dir=os.path.join(root, Config.IMAGE_DIR),
+            video_dir=os.path.join(root, Config.VIDEO_DIR),
+            merged_video_path=os.path.join(root, Config.MERGED_VIDEO_PATH),
+            character_dir=os.path.join(root, Config.CHARACTER_DIR),
+            history_dir=os.path.join(root, Config.HISTORY_DIR),
+            voice_dir=os.path.join(root, Config.VOICE_DIR),
+            preview_dir=os.path.join(root, Config.PREVIEW_DIR),
+        )
+
+
+def resolve_config(config: Optional[RunConfig] = None) -> RunConfig:
+    """未显式传入配置时使用默认配置"""
+    return config if config is not None else RunConfig()
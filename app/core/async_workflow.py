@@ -0,0 +1,280 @@
+import os
+import asyncio
+import threading
+import traceback
+from typing import Dict, List, Optional, Any
+from app.config import RunConfig, resolve_config
+from app.utils.logger import setup_logger, payload, log_context
+from app.utils.hedging import log_hedge_stats
+from app.utils.credentials import log_credential_stats
+from app.utils.budget import start_run_budget, end_run_budget, budget_exhausted, log_run_spend
+from app.utils.file_ops import image_to_base64
+from app.services.llm import agenerate_voice_script, agenerate_image_prompt, agenerate_image_prompts
+from app.services.media import agenerate_checked_image
+from app.services.tts import asynthesize_voice_script
+from app.utils.quality import quality_gate_enabled, frames_too_similar
+from app.core.character import agenerate_character_portrait_workflow, aresolve_character_identities
+from app.core.clip_planner import plan_scene_clips
+from app.core.scene_video import agenerate_scene_video_workflow
+from app.core.scheduler import scene_admission
+from app.core.workflow import (
+    load_chapter,
+    load_voice_script,
+    parse_and_save_voice_script,
+    get_scene_count,
+    collect_characters,
+    load_existing_image_result,
+    get_scene_audio_duration,
+    existing_video_result,
+    plan_video_stage,
+    restore_scene_frames,
+    save_scene_frames,
+    prepare_portrait,
+    finish_portrait,
+    check_cancelled,
+    WorkflowCancelled,
+    collect_media_garbage,
+    create_preview,
+    publish_scene,
+    mux_scene_audio,
+    merge_scene_videos,
+)
+logger = setup_logger(__name__)
+
+# 与create_workflow共用断点续传、规划与合并逻辑，仅把网络调用换成协程并发执行
+
+async def aregenerate_similar_end_frame(scene_id: str, image_prompt_end: str, save_path_start: str, save_path_end: str, characters: List[str], config: RunConfig) -> Optional[str]:
+    """regenerate_similar_end_frame的异步版本"""
+    if not quality_gate_enabled(config):
+        return None
+    image_url_end = None
+    for attempt in range(config.quality_max_retries):
+        if not await asyncio.to_thread(frames_too_similar, save_path_start, save_path_end, config):
+            return image_url_end
+        logger.warning(f"场景 {scene_id} 首尾帧过于相似，重新生成结束帧（{attempt + 1}/{config.quality_max_retries}）")
+        image_url_end = await agenerate_checked_image(image_prompt_end, save_path_end, characters=characters, config=config)
+        if image_url_end.startswith("生成图片失败"):
+            raise Exception(f"End Frame error: {image_url_end}")
+    if await asyncio.to_thread(frames_too_similar, save_path_start, save_path_end, config):
+        logger.warning(f"场景 {scene_id} 首尾帧仍过于相似，继续使用当前结束帧")
+    return image_url_end
+
+async def agenerate_single_image_workflow(scene_id: str, scene_content: str, image_dir: str, characters: List[str] = None, prompts: Dict[str, str] = None, config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """generate_single_image_workflow的异步版本，首尾帧并发生成"""
+    config = resolve_config(config)
+    logger.info(f"生成场景 {scene_id} 的图像...")
+    logger.debug("生成图像的场景描述：%s", payload(scene_content))
+
+    try:
+        prompts = prompts or await agenerate_image_prompt(scene_content, config=config)
+        if "start_frame" in prompts and prompts["start_frame"].startswith("生成失败"):
+            raise Exception(prompts["start_frame"])
+
+        image_prompt_start = prompts.get("start_frame")
+        image_prompt_end = prompts.get("end_frame")
+        save_path_start = os.path.join(image_dir, f"{scene_id}_start.jpeg")
+        save_path_end = os.path.join(image_dir, f"{scene_id}_end.jpeg")
+
+        image_url_start, image_url_end = await asyncio.gather(
+            agenerate_checked_image(image_prompt_start, save_path_start, characters=characters, config=config),
+            agenerate_checked_image(image_prompt_end, save_path_end, characters=characters, config=config),
+        )
+        if image_url_start.startswith("生成图片失败"):
+            raise Exception(f"Start Frame error: {image_url_start}")
+        if image_url_end.startswith("生成图片失败"):
+            raise Exception(f"End Frame error: {image_url_end}")
+        image_url_end = await aregenerate_similar_end_frame(scene_id, image_prompt_end, save_path_start, save_path_end, characters, config) or image_url_end
+        logger.info(f"Start/End Frame saved to {save_path_start}, {save_path_end}")
+        await asyncio.to_thread(save_scene_frames, scene_id, scene_content, characters, image_dir, config)
+
+        return {
+            "scene_id": scene_id,
+            "scene_content": scene_content,
+            "image_path_start": save_path_start,
+            "image_url_start": image_url_start,
+            "image_base64_start": await asyncio.to_thread(image_to_base64, save_path_start),
+            "image_prompt_start": image_prompt_start,
+            "image_path_end": save_path_end,
+            "image_url_end": image_url_end,
+            "image_base64_end": await asyncio.to_thread(image_to_base64, save_path_end),
+            "image_prompt_end": image_prompt_end
+        }
+    except Exception as e:
+        logger.error(f"生成场景 {scene_id} 的图像失败: {e}")
+        raise
+
+async def agenerate_portrait(character_name: str, chapter_content: str, slots: asyncio.Semaphore, config: RunConfig) -> None:
+    """generate_portrait的异步版本"""
+    portrait = await asyncio.to_thread(prepare_portrait, character_name, config)
+    if portrait is None:
+        return
+    try:
+        async with slots:
+            logger.info(f"正在生成人物{character_name}的写真...")
+            with log_context(stage="portrait"):
+                result = await agenerate_character_portrait_workflow(chapter_content, character_name, config=config)
+        await asyncio.to_thread(finish_portrait, portrait, result)
+    except Exception as e:
+        logger.error(f"生成人物{character_name}的写真时出错：{e}")
+
+async def agenerate_portraits(voice_script: Dict[str, Any], chapter_content: str, config: RunConfig, cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """generate_portraits的异步版本，写真以协程并发生成，并发数受portrait_concurrency限制"""
+    with log_context(stage="portrait"):
+        voice_script = await aresolve_character_identities(voice_script, chapter_content, config)
+    os.makedirs(config.character_dir, exist_ok=True)
+    check_cancelled(cancel_event)
+    slots = asyncio.Semaphore(max(1, config.portrait_concurrency))
+
+    async def run(character_name: str) -> None:
+        if cancel_event is None or not cancel_event.is_set():
+            await agenerate_portrait(character_name, chapter_content, slots, config)
+
+    await asyncio.gather(*(run(name) for name in collect_characters(voice_script)))
+    check_cancelled(cancel_event)
+    return voice_script
+
+async def acreate_workflow(config: Optional[RunConfig] = None, cancel_event: Optional[threading.Event] = None) -> Optional[Dict[str, Any]]:
+    """
+    create_workflow的异步版本
+
+    人物写真、场景图片与场景视频分别以协程并发执行，即梦并发由media中的异步槽位限制。
+    可在已有事件循环中await，也可通过asyncio.run(acreate_workflow(config))运行。
+
+    Args:
+        config: 本次运行的配置，默认使用Config中的默认值
+        cancel_event: 取消信号，置位后在下一个阶段/场景边界停止（已提交的即梦任务会执行完当前子片段）
+    """
+    config = resolve_config(config)
+    budget_token = start_run_budget(config)
+    voice_synthesis: Optional[asyncio.Future] = None
+    try:
+        chapter_title, chapter_content = await asyncio.to_thread(load_chapter, config)
+
+        logger.info("\n2. 生成口播文案...")
+        voice_script = await asyncio.to_thread(load_voice_script, config)
+        if not voice_script:
+            with log_context(stage="script"):
+                voice_script_str = await agenerate_voice_script(chapter_content, config=config)
+            voice_script = parse_and_save_voice_script(voice_script_str, config)
+            if not voice_script:
+                return None
+
+        scene_count = get_scene_count(voice_script, config)
+        scene_ids = [str(i) for i in range(1, scene_count + 1) if str(i) in voice_script]
+        # 配音与人物写真、场景图片并发合成，规划视频前等待完成
+        voice_synthesis = asyncio.ensure_future(asynthesize_voice_script(voice_script, scene_ids, config))
+        check_cancelled(cancel_event)
+
+        logger.info("\n3. 生成小说人物写真...")
+        voice_script = await agenerate_portraits(voice_script, chapter_content, config, cancel_event)
+
+        logger.info("\n4. 根据文案生成图片...")
+        image_dir = config.image_dir
+        os.makedirs(image_dir, exist_ok=True)
+
+        def load_or_restore(scene_id: str) -> Optional[Dict[str, Any]]:
+            restore_scene_frames(scene_id, voice_script[scene_id]['content'], voice_script[scene_id].get('character', []), image_dir, config)
+            return load_existing_image_result(scene_id, voice_script, image_dir, config)
+
+        existing_results = await asyncio.gather(*(asyncio.to_thread(load_or_restore, sid) for sid in scene_ids))
+        image_results = [r for r in existing_results if r]
+        pending_scenes = {sid: voice_script[sid]['content'] for sid, r in zip(scene_ids, existing_results) if not r}
+        if pending_scenes and budget_exhausted():
+            logger.warning(f"预算已用完或已超过截止时间，不再生成{len(pending_scenes)}个场景的图片")
+            pending_scenes = {}
+        with log_context(stage="image"):
+            scene_prompts = await agenerate_image_prompts(pending_scenes, config=config) if pending_scenes else {}
+
+        image_slots = asyncio.Semaphore(max(1, config.image_concurrency))
+
+        async def run_image(scene_id: str) -> Optional[Dict[str, Any]]:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            scene_characters = voice_script[scene_id].get('character', [])
+            try:
+                async with image_slots:
+                    with log_context(scene_id=scene_id, stage="image"):
+                        return await agenerate_single_image_workflow(scene_id, pending_scenes[scene_id], image_dir, characters=scene_characters, prompts=scene_prompts.get(scene_id), config=config)
+            except Exception:
+                logger.error(f"场景 {scene_id} 图片生成跳过 due to error")
+                return None
+
+        image_results += [r for r in await asyncio.gather(*(run_image(sid) for sid in pending_scenes)) if r]
+        logger.info(f"成功生成了{len(image_results)}张图片")
+        check_cancelled(cancel_event)
+
+        logger.info("\n5. 根据图片和文案生成视频...")
+        video_dir = config.video_dir
+        os.makedirs(video_dir, exist_ok=True)
+
+        video_results: List[Dict[str, Any]] = []
+        assembler = create_preview(image_results, chapter_title, config)
+        voice_durations = await voice_synthesis
+        pending = []
+        for scene_info in image_results:
+            scene_id = scene_info["scene_id"]
+            # 已有视频需完整解码检查，放到线程中执行
+            existing = await asyncio.to_thread(existing_video_result, scene_id, video_dir, config)
+            if existing:
+                video_results.append(existing)
+                await asyncio.to_thread(publish_scene, scene_id, assembler, config)
+                continue
+            audio_duration = voice_durations.get(scene_id) or get_scene_audio_duration(scene_id, config)
+            pending.append((scene_info, plan_scene_clips(scene_id, audio_duration, config)))
+
+        plans = plan_video_stage(pending, config)
+        scene_infos = {scene_info["scene_id"]: scene_info for scene_info, _ in pending}
+
+        async def run_scene(plan: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            scene_id = plan["scene_id"]
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            scene_characters = voice_script.get(scene_id, {}).get('character', [])
+            try:
+                with log_context(scene_id=scene_id, stage="video"), scene_admission(plan, config) as plan:
+                    if plan is None:
+                        return None
+                    result = await agenerate_scene_video_workflow(scene_infos[scene_id], video_dir, audio_duration=plan["audio_duration"], characters=scene_characters, plan=plan, config=config)
+                    await asyncio.to_thread(publish_scene, scene_id, assembler, config)
+                    return result
+            except Exception as e:
+                logger.error(f"场景 {scene_id} 视频生成失败: {e}")
+                return None
+
+        # 协程按LPT顺序创建，异步信号量按FIFO唤醒，长场景先占用槽位
+        video_results += [r for r in await asyncio.gather(*(run_scene(plan) for plan in plans)) if r]
+        logger.info(f"成功生成了{len(video_results)}个视频")
+        check_cancelled(cancel_event)
+
+        logger.info("合并视频与音频")
+        await asyncio.gather(*(asyncio.to_thread(mux_scene_audio, result["scene_id"], config) for result in video_results))
+        assembler.finish()
+
+        logger.info("\n6. 合并所有生成的视频...")
+        merged_video_path = await asyncio.to_thread(merge_scene_videos, video_results, config)
+        await asyncio.to_thread(collect_media_garbage, config)
+
+        log_hedge_stats()
+        log_credential_stats()
+        log_run_spend()
+        logger.info("\n✅ 任务完成！")
+        return {
+            "voice_script": voice_script,
+            "image_results": image_results,
+            "video_results": video_results,
+            "merged_video_path": merged_video_path
+        }
+
+    except WorkflowCancelled:
+        logger.warning("\n⏹ 任务已取消")
+        return None
+    except Exception as e:
+        logger.error(f"\n❌ 任务失败：{e}")
+        logger.debug(traceback.format_exc())
+        return None
+    finally:
+        # 前面的阶段失败或取消时不再等待配音结果，取消仍在进行的合成（已在线程中执行的场景会完成）
+        if voice_synthesis is not None and not voice_synthesis.done():
+            voice_synthesis.cancel()
+            await asyncio.gather(voice_synthesis, return_exceptions=True)
+        end_run_budget(budget_token)
@@ -1,51 +1,181 @@
 import os
-import logging
-from typing import Optional
-from app.config import Config
-from app.services.llm import extract_character_appearance, generate_image_prompt
-from app.services.media import generate_image
+import json
+from typing import Any, Dict, List, Optional
+from app.config import RunConfig, resolve_config
+from app.services.llm import extract_character_appearance, generate_image_prompt, aextract_character_appearance, agenerate_image_prompt
+from app.services.llm import resolve_character_aliases, aresolve_character_aliases
+from app.services.media import generate_image, agenerate_image
+from app.utils.file_ops import atomic_output, file_lock
+from app.utils.logger import setup_logger, payload
 
-# Reuse central logger
-logger = logging.getLogger("app.core.character")
+logger = setup_logger(__name__)
 
-def generate_character_portrait_workflow(novel_text: str, character_name: str) -> Optional[str]:
+# 人物登记表：{规范名: [称呼, ...]}，与人物写真一同保存，监听模式下各章节共用
+REGISTRY_FILE = "characters.json"
+
+def get_registry_path(config: RunConfig) -> str:
+    return os.path.join(config.character_dir, REGISTRY_FILE)
+
+def load_character_registry(path: str) -> Dict[str, List[str]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("characters", {})
+
+def save_character_registry(path: str, registry: Dict[str, List[str]]) -> None:
+    with atomic_output(path) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"characters": registry}, f, ensure_ascii=False, indent=2)
+
+def alias_index(registry: Dict[str, List[str]]) -> Dict[str, str]:
+    """{称呼: 规范名}，规范名本身也是自己的称呼"""
+    index = {}
+    for canonical, aliases in registry.items():
+        index[canonical] = canonical
+        index.update(dict.fromkeys(aliases, canonical))
+    return index
+
+def merge_aliases(registry: Dict[str, List[str]], mapping: Dict[str, str]) -> None:
+    """
+    将{称呼: 规范名}并入登记表
+
+    已登记的称呼保持原有归属；规范名本身是已登记称呼时归入其所属人物；A→B、B→C的链式结果归并到C。
+    """
+    def follow(name: str) -> str:
+        seen = {name}
+        while mapping.get(name, name) not in seen:
+            name = mapping[name]
+            seen.add(name)
+        return name
+
+    index = alias_index(registry)
+    for alias in mapping:
+        if alias in index:
+            continue
+        target = follow(alias)
+        canonical = index.get(target, target)
+        aliases = registry.setdefault(canonical, [canonical])
+        for name in (target, alias):
+            if name not in aliases:
+                aliases.append(name)
+            index[name] = canonical
+
+def script_characters(voice_script: Dict[str, Any]) -> List[str]:
+    """口播文案中出现的所有人物称呼（按首次出现顺序去重）"""
+    names: Dict[str, None] = {}
+    for scene_data in voice_script.values():
+        if isinstance(scene_data, dict) and isinstance(scene_data.get("character"), list):
+            names.update(dict.fromkeys(scene_data["character"]))
+    return list(names)
+
+def canonicalize_script(voice_script: Dict[str, Any], index: Dict[str, str]) -> Dict[str, Any]:
+    """将各场景的人物称呼替换为规范名（同一场景内去重）"""
+    for alias in script_characters(voice_script):
+        if index.get(alias, alias) != alias:
+            logger.info(f"人物称呼归并：{alias} → {index[alias]}")
+    for scene_data in voice_script.values():
+        if isinstance(scene_data, dict) and isinstance(scene_data.get("character"), list):
+            scene_data["character"] = list(dict.fromkeys(index.get(name, name) for name in scene_data["character"]))
+    return voice_script
+
+def find_unknown_characters(voice_script: Dict[str, Any], config: RunConfig) -> List[str]:
+    """登记表中没有的称呼；只有一个人物且登记表为空时无需归并"""
+    registry = load_character_registry(get_registry_path(config))
+    index = alias_index(registry)
+    unknown = [name for name in script_characters(voice_script) if name not in index]
+    if len(unknown) + len(registry) < 2:
+        return []
+    return unknown
+
+def register_aliases(mapping: Dict[str, str], config: RunConfig) -> Dict[str, str]:
+    """并入归并结果并返回最新的称呼索引（加锁读改写，其他章节或机器可能同时更新）"""
+    path = get_registry_path(config)
+    with file_lock(path):
+        registry = load_character_registry(path)
+        merge_aliases(registry, mapping)
+        save_character_registry(path, registry)
+    return alias_index(registry)
+
+def resolve_character_identities(voice_script: Dict[str, Any], novel_text: str, config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """
+    人物身份归并：将口播文案中同一人物的不同称呼（全名、小名、称号）替换为规范名
+
+    已登记的称呼直接查表，只有新出现的称呼才调用一次LLM判断，结果写入人物登记表供后续章节复用。
+    直接修改并返回voice_script。
+    """
+    config = resolve_config(config)
+    if not config.character_alias_resolution:
+        return voice_script
+    unknown = find_unknown_characters(voice_script, config)
+    if unknown:
+        known = list(load_character_registry(get_registry_path(config)))
+        mapping = resolve_character_aliases(novel_text, unknown, known, config=config)
+        index = register_aliases(mapping, config) if mapping else alias_index(load_character_registry(get_registry_path(config)))
+    else:
+        index = alias_index(load_character_registry(get_registry_path(config)))
+    return canonicalize_script(voice_script, index)
+
+async def aresolve_character_identities(voice_script: Dict[str, Any], novel_text: str, config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """resolve_character_identities的异步版本"""
+    config = resolve_config(config)
+    if not config.character_alias_resolution:
+        return voice_script
+    unknown = find_unknown_characters(voice_script, config)
+    if unknown:
+        known = list(load_character_registry(get_registry_path(config)))
+        mapping = await aresolve_character_aliases(novel_text, unknown, known, config=config)
+        index = register_aliases(mapping, config) if mapping else alias_index(load_character_registry(get_registry_path(config)))
+    else:
+        index = alias_index(load_character_registry(get_registry_path(config)))
+    return canonicalize_script(voice_script, index)
+
+def get_portrait_prompt(prompts: Dict[str, str]) -> Optional[str]:
+    """从首尾帧提示词中取出用于人物写真的提示词（写真为静态图，取起始帧）"""
+    prompt = prompts.get("start_frame") if isinstance(prompts, dict) else prompts
+    if not prompt or prompt.startswith("生成失败"):
+        return None
+    return prompt
+
+def generate_character_portrait_workflow(novel_text: str, character_name: str, config: Optional[RunConfig] = None) -> Optional[str]:
     """
     生成人物写真工作流
     
     Args:
         novel_text: 小说文本
         character_name: 人物名称
+        config: 运行配置
     
     Returns:
         生成的图像保存路径，或None（如果失败）
     """
+    config = resolve_config(config)
     logger.info(f"开始处理人物: {character_name}")
     
     # 1. 提取人物外貌特征
     logger.info("1. 正在从小说中提取人物外貌特征...")
-    appearance_features = extract_character_appearance(novel_text, character_name)
+    appearance_features = extract_character_appearance(novel_text, character_name, config=config)
     if not appearance_features:
         logger.error("无法提取人物外貌特征")
         return None
-    logger.info(f"提取到的外貌特征: {appearance_features}")
+    logger.info("提取到的外貌特征: %s", payload(appearance_features))
     
     # 2. 生成文生图提示词
     logger.info("2. 正在生成文生图提示词...")
     scene_content = f"人物{character_name}的外貌特征：{appearance_features}"
-    prompt = generate_image_prompt(scene_content)
+    prompt = get_portrait_prompt(generate_image_prompt(scene_content, config=config))
     if not prompt:
         logger.error("无法生成文生图提示词")
         return None
-    logger.info(f"生成的提示词: {prompt}")
+    logger.info("生成的提示词: %s", payload(prompt))
     
     # 3. 生成人物写真并保存
     logger.info("3. 正在生成人物写真...")
-    os.makedirs(Config.CHARACTER_DIR, exist_ok=True)
-    save_path = os.path.join(Config.CHARACTER_DIR, f"{character_name}.png")
+    os.makedirs(config.character_dir, exist_ok=True)
+    save_path = os.path.join(config.character_dir, f"{character_name}.png")
     
     # Note: Character portraits don't use reference images themselves usually, 
     # but the function signature supports it. Here we just generate base based on text.
-    image_url = generate_image(prompt, size="1440x2560", save_path=save_path)
+    image_url = generate_image(prompt, size="1440x2560", save_path=save_path, config=config)
     
     if image_url and not image_url.startswith("生成图片失败"):
         logger.info(f"人物{character_name}的写真生成完成！")
@@ -53,3 +183,32 @@ def generate_character_portrait_workflow(novel_text: str, character_name: str) -
     else:
         logger.error(f"人物{character_name}的写真生成失败")
         return None
+
+async def agenerate_character_portrait_workflow(novel_text: str, character_name: str, config: Optional[RunConfig] = None) -> Optional[str]:
+    """generate_character_portrait_workflow的异步版本"""
+    config = resolve_config(config)
+    logger.info(f"开始处理人物: {character_name}")
+
+    appearance_features = await aextract_character_appearance(novel_text, character_name, config=config)
+    if not appearance_features:
+        logger.error("无法提取人物外貌特征")
+        return None
+    logger.info("提取到的外貌特征: %s", payload(appearance_features))
+
+    scene_content = f"人物{character_name}的外貌特征：{appearance_features}"
+    prompt = get_portrait_prompt(await agenerate_image_prompt(scene_content, config=config))
+    if not prompt:
+        logger.error("无法生成文生图提示词")
+        return None
+    logger.info("生成的提示词: %s", payload(prompt))
+
+    os.makedirs(config.character_dir, exist_ok=True)
+    save_path = os.path.join(config.character_dir, f"{character_name}.png")
+    image_url = await agenerate_image(prompt, size="1440x2560", save_path=save_path, config=config)
+
+    if image_url and not image_url.startswith("生成图片失败"):
+        logger.info(f"人物{character_name}的写真生成完成！")
+        return save_path
+    else:
+        logger.error(f"人物{character_name}的写真生成失败")
+        return None
@@ -0,0 +1,110 @@
+import math
+from typing import Any, Dict, List, Optional
+from app.config import RunConfig, resolve_config
+
+# 场景时长适配方式
+FIT_NONE = "none"        # 视频时长与音频一致，无需处理
+FIT_STRETCH = "stretch"  # 调整视频速度对齐音频（音频略短于最小帧数时加速，降级场景放慢）
+FIT_PAD = "pad"          # 音频远短于最小帧数，用静音补齐音频
+
+
+def duration_to_frames(duration: float, frame_rate: int) -> int:
+    """将时长（秒）换算为即梦视频帧数（首帧 + duration * fps）"""
+    return int(math.ceil(duration * frame_rate)) + 1
+
+
+def frames_to_duration(frames: int, frame_rate: int) -> float:
+    """将帧数换算为时长（秒）"""
+    return max(frames - 1, 0) / frame_rate
+
+
+def stretch_action(plan: Dict[str, Any], audio_duration: float) -> str:
+    """FIT_STRETCH规划对齐音频时是加速还是放慢视频：生成的片段比音频长时加速，否则放慢"""
+    clip_duration = sum(c["duration"] for c in plan["clips"])
+    return "加速" if clip_duration > audio_duration else "放慢"
+
+
+def plan_scene_clips(scene_id: str, audio_duration: Optional[float], config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """
+    根据场景音频时长规划子片段
+
+    即梦单次生成的帧数必须落在[VIDEO_MIN_FRAMES, VIDEO_MAX_FRAMES]内。
+    长音频被均分为多个子片段（相邻子片段之间以中间关键帧衔接），
+    短音频则生成最小帧数的片段，再按比例加速视频或补齐静音。
+
+    Args:
+        scene_id: 场景ID
+        audio_duration: 音频时长（秒），None或<=0表示无音频
+        config: 运行配置
+
+    Returns:
+        场景规划，包含子片段列表clips和时长适配方式fit
+    """
+    config = resolve_config(config)
+    min_frames = config.video_min_frames
+    max_frames = config.video_max_frames
+    frame_rate = config.video_frame_rate
+
+    if not audio_duration or audio_duration <= 0:
+        # 无音频时使用默认时长，并限制在允许范围内
+        frames = config.video_duration * frame_rate
+        frames = min(max(frames, min_frames), max_frames)
+        return {
+            "scene_id": scene_id,
+            "audio_duration": None,
+            "total_frames": frames,
+            "clips": [{"index": 0, "frames": frames, "duration": frames_to_duration(frames, frame_rate)}],
+            "fit": FIT_NONE,
+        }
+
+    total_frames = duration_to_frames(audio_duration, frame_rate)
+    fit = FIT_NONE
+    if total_frames < min_frames:
+        # 短场景：生成最小帧数后再对齐音频
+        ratio = audio_duration / frames_to_duration(min_frames, frame_rate)
+        fit = FIT_STRETCH if ratio >= config.video_min_stretch_ratio else FIT_PAD
+        clip_frames = [min_frames]
+    else:
+        # 长场景：按最大帧数切分，再均分使每段尽量等长
+        clip_count = int(math.ceil(total_frames / max_frames))
+        per_clip = int(math.ceil(total_frames / clip_count))
+        per_clip = max(per_clip, min_frames)
+        clip_frames = [per_clip] * clip_count
+
+    clips: List[Dict[str, Any]] = [
+        {"index": i, "frames": frames, "duration": frames_to_duration(frames, frame_rate)}
+        for i, frames in enumerate(clip_frames)
+    ]
+    return {
+        "scene_id": scene_id,
+        "audio_duration": audio_duration,
+        "total_frames": sum(c["frames"] for c in clips),
+        "clips": clips,
+        "fit": fit,
+    }
+
+
+def degrade_scene_plan(plan: Dict[str, Any], config: Optional[RunConfig] = None) -> Optional[Dict[str, Any]]:
+    """
+    降级规划：只生成一个子片段（无需中间关键帧），帧数减少到音频所需的1/degraded_max_stretch（不少于最小帧数），
+    再放慢视频对齐音频
+
+    用于截止时间或预算不足时减少即梦帧数与关键路径耗时；无音频、单个子片段放慢后仍超出倍数限制
+    或已无法更便宜时返回None。
+    """
+    config = resolve_config(config)
+    audio_duration = plan.get("audio_duration")
+    if not audio_duration or plan.get("degraded"):
+        return None
+    needed = duration_to_frames(audio_duration, config.video_frame_rate)
+    frames = max(int(math.ceil(needed / max(config.degraded_max_stretch, 1.0))), config.video_min_frames)
+    if frames > config.video_max_frames or (frames >= plan["total_frames"] and len(plan["clips"]) == 1):
+        return None
+    return {
+        "scene_id": plan["scene_id"],
+        "audio_duration": audio_duration,
+        "total_frames": frames,
+        "clips": [{"index": 0, "frames": frames, "duration": frames_to_duration(frames, config.video_frame_rate)}],
+        "fit": FIT_STRETCH,
+        "degraded": True,
+    }
@@ -0,0 +1,297 @@
+import os
+import socket
+import hashlib
+import threading
+import dataclasses
+from typing import Any, Dict, List, Optional
+from app.config import Config, RunConfig, resolve_config
+from app.utils.logger import setup_logger, log_context
+from app.utils.hedging import log_hedge_stats
+from app.utils.credentials import get_video_capacity, log_credential_stats
+from app.utils.budget import start_run_budget, end_run_budget, get_run_budget, log_run_spend
+from app.utils.file_ops import file_lock
+from app.services.llm import generate_voice_script, generate_image_prompts
+from app.core.clip_planner import plan_scene_clips, degrade_scene_plan
+from app.core.scheduler import estimate_scene_cost, fit_to_limits
+from app.core.lease_queue import LeaseQueue, MemoryLeaseQueue, TASK_PENDING, TASK_LEASED, TASK_DONE
+from app.core.workflow import (
+    WorkflowCancelled,
+    check_cancelled,
+    load_chapter,
+    load_voice_script,
+    parse_and_save_voice_script,
+    get_scene_count,
+    generate_portraits,
+    generate_single_image_workflow,
+    restore_scene_frames,
+    load_existing_image_result,
+    get_scene_audio_duration,
+    existing_video_result,
+    mux_scene_audio,
+    merge_scene_videos,
+    collect_media_garbage,
+    start_voice_synthesis,
+)
+from app.core.scene_video import generate_scene_video_workflow
+
+logger = setup_logger(__name__)
+
+# 凭证不随任务下发，各worker使用本机环境中的账号，以便在多个账号之间分摊配额
+CREDENTIAL_FIELDS = ("llm_api_key", "llm_api_keys", "doubao_api_key", "doubao_api_keys", "access_key_id", "secret_access_key", "jimeng_credentials", "tts_api_key")
+
+
+def config_to_payload(config: RunConfig) -> Dict[str, Any]:
+    """将运行配置转为可下发给worker的字典（不含凭证）"""
+    return {k: v for k, v in dataclasses.asdict(config).items() if k not in CREDENTIAL_FIELDS}
+
+
+def config_from_payload(payload: Dict[str, Any], base_config: RunConfig) -> RunConfig:
+    """在worker本机配置的基础上应用任务中的运行配置，忽略本机版本不认识的字段"""
+    fields = {f.name for f in dataclasses.fields(RunConfig)} - set(CREDENTIAL_FIELDS)
+    return base_config.replace(**{k: v for k, v in payload.items() if k in fields})
+
+
+def get_task_group(config: RunConfig) -> str:
+    """同一章节、同一输出目录的场景任务属于同一分组"""
+    key = f"{config.target_chapter}@{os.path.abspath(config.video_dir)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def run_scene_task(payload: Dict[str, Any], config: RunConfig) -> Dict[str, Any]:
+    """
+    执行单个场景任务：首尾帧、视频、配音合并
+
+    场景级文件锁保证同一场景在多台机器上不会被同时生成（租约过期后被重新领取时，
+    旧worker仍可能在运行）；各产物以原子重命名写入，已存在的产物直接复用。
+    """
+    scene_id = payload["scene_id"]
+    scene_content = payload["scene_content"]
+    characters = payload.get("characters", [])
+    # 预算由协调者在分发时控制，worker只按整体截止时间放弃无望的轮询
+    budget_token = start_run_budget(config.replace(budget=None, deadline_seconds=None), payload.get("deadline_at"))
+    try:
+        os.makedirs(config.image_dir, exist_ok=True)
+        os.makedirs(config.video_dir, exist_ok=True)
+
+        with file_lock(os.path.join(config.video_dir, scene_id), stale_seconds=Config.LOCK_STALE_SECONDS):
+            with log_context(scene_id=scene_id, stage="image"):
+                restore_scene_frames(scene_id, scene_content, characters, config.image_dir, config)
+                scene_info = load_existing_image_result(scene_id, {scene_id: {"content": scene_content}}, config.image_dir, config)
+                if scene_info is None:
+                    scene_info = generate_single_image_workflow(scene_id, scene_content, config.image_dir, characters=characters, prompts=payload.get("prompts"), config=config)
+
+            with log_context(scene_id=scene_id, stage="video"):
+                video_result = existing_video_result(scene_id, config.video_dir, config)
+                if video_result is None:
+                    audio_duration = get_scene_audio_duration(scene_id, config)
+                    plan = plan_scene_clips(scene_id, audio_duration, config)
+                    if payload.get("degraded"):
+                        plan = degrade_scene_plan(plan, config) or plan
+                    video_result = generate_scene_video_workflow(scene_info, config.video_dir, audio_duration=audio_duration, characters=characters, plan=plan, config=config)
+                voice_path = mux_scene_audio(scene_id, config)
+
+        return {"scene_id": scene_id, "video_path": video_result["video_path"], "voice_path": voice_path}
+    finally:
+        end_run_budget(budget_token)
+
+
+def run_worker(queue: LeaseQueue, base_config: Optional[RunConfig] = None, worker_id: Optional[str] = None, stop_event: Optional[threading.Event] = None, exit_when_idle: bool = False) -> None:
+    """
+    worker主循环：领取场景任务、定期续约、完成或失败后上报
+
+    Args:
+        queue: 任务队列
+        base_config: 本机配置（凭证等），任务中的运行配置在其基础上覆盖
+        worker_id: worker标识，默认为主机名与进程号
+        stop_event: 停止信号
+        exit_when_idle: 队列为空时退出（本地worker线程使用）
+    """
+    base_config = resolve_config(base_config)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+    stop_event = stop_event or threading.Event()
+    logger.info(f"worker {worker_id} 已启动")
+
+    while not stop_event.is_set():
+        task = queue.lease(worker_id, Config.LEASE_SECONDS)
+        if task is None:
+            if exit_when_idle:
+                break
+            stop_event.wait(Config.WORKER_POLL_INTERVAL)
+            continue
+
+        task_id = task["id"]
+        payload = task["payload"]
+        logger.info(f"worker {worker_id} 领取任务 {task_id}（第{task['attempts']}次尝试）")
+
+        # 后台线程续约，租约失效说明任务已被其他worker接管
+        finished = threading.Event()
+
+        def heartbeat() -> None:
+            while not finished.wait(Config.HEARTBEAT_SECONDS):
+                if not queue.heartbeat(task_id, worker_id, Config.LEASE_SECONDS):
+                    logger.warning(f"任务 {task_id} 的租约已失效")
+                    return
+
+        heartbeat_thread = threading.Thread(target=heartbeat, name=f"lease-{task_id}", daemon=True)
+        heartbeat_thread.start()
+        try:
+            config = config_from_payload(payload["config"], base_config)
+            result = run_scene_task(payload, config)
+            if not queue.complete(task_id, worker_id, result):
+                logger.warning(f"任务 {task_id} 已完成，但租约已被接管，结果未上报")
+        except Exception as e:
+            logger.error(f"任务 {task_id} 执行失败：{e}", exc_info=True)
+            queue.fail(task_id, worker_id, str(e))
+        finally:
+            finished.set()
+            heartbeat_thread.join()
+
+    logger.info(f"worker {worker_id} 已退出")
+
+
+def create_distributed_workflow(config: Optional[RunConfig] = None, queue: Optional[LeaseQueue] = None, cancel_event: Optional[threading.Event] = None) -> Optional[Dict[str, Any]]:
+    """
+    分布式工作流（协调者）
+
+    在本机完成文案、人物写真与批量首尾帧提示词，将各场景的图片/视频/配音合并作为任务放入共享队列，
+    按LPT估算耗时设置优先级（长场景先被领取），等待所有worker完成后合并最终视频。
+    输出目录需位于所有worker可访问的共享存储上，且各机器的路径一致。
+
+    Args:
+        config: 本次运行的配置
+        queue: 任务队列，进程内队列时在本机启动与即梦总并发数相同的worker线程
+        cancel_event: 取消信号
+    """
+    config = resolve_config(config)
+    queue = queue or MemoryLeaseQueue()
+    budget_token = start_run_budget(config)
+    budget = get_run_budget()
+    group = None
+    local_workers: List[threading.Thread] = []
+    stop_event = threading.Event()
+    try:
+        chapter_title, chapter_content = load_chapter(config)
+
+        logger.info("\n2. 生成口播文案...")
+        voice_script = load_voice_script(config)
+        if not voice_script:
+            with log_context(stage="script"):
+                voice_script_str = generate_voice_script(chapter_content, config=config)
+            voice_script = parse_and_save_voice_script(voice_script_str, config)
+            if not voice_script:
+                return None
+        scene_count = get_scene_count(voice_script, config)
+        scene_ids = [str(i) for i in range(1, scene_count + 1) if str(i) in voice_script]
+        # 配音决定各场景的视频时长与任务优先级，由协调者在生成写真的同时合成
+        voice_synthesis = start_voice_synthesis(voice_script, scene_ids, config)
+        check_cancelled(cancel_event)
+
+        # 人物写真被所有场景引用，由协调者先行生成
+        logger.info("\n3. 生成小说人物写真...")
+        voice_script = generate_portraits(voice_script, chapter_content, config, cancel_event)
+
+        logger.info("\n4. 分发场景任务...")
+        voice_durations = voice_synthesis.result()
+        pending_scenes = {}
+        for sid in scene_ids:
+            restore_scene_frames(sid, voice_script[sid]['content'], voice_script[sid].get('character', []), config.image_dir, config)
+            if not load_existing_image_result(sid, voice_script, config.image_dir, config):
+                pending_scenes[sid] = voice_script[sid]['content']
+        with log_context(stage="image"):
+            scene_prompts = generate_image_prompts(pending_scenes, config=config) if pending_scenes else {}
+
+        group = get_task_group(config)
+        config_payload = config_to_payload(config)
+        plans = {sid: plan_scene_clips(sid, voice_durations.get(sid) or get_scene_audio_duration(sid, config), config) for sid in scene_ids}
+        # 已有视频的场景不再花费，只对其余场景按预算与截止时间降级或放弃
+        to_generate = [plans[sid] for sid in scene_ids if existing_video_result(sid, config.video_dir, config) is None]
+        admitted, skipped = fit_to_limits(to_generate, budget, config)
+        plans.update({plan["scene_id"]: plan for plan in admitted})
+        skipped_ids = {plan["scene_id"] for plan in skipped}
+        scene_ids = [sid for sid in scene_ids if sid not in skipped_ids]
+        task_ids = {f"{group}:{scene_id}" for scene_id in scene_ids}
+        for scene_id in scene_ids:
+            plan = plans[scene_id]
+            queue.put(
+                f"{group}:{scene_id}",
+                group,
+                {
+                    "scene_id": scene_id,
+                    "scene_content": voice_script[scene_id]['content'],
+                    "characters": voice_script[scene_id].get('character', []),
+                    "prompts": scene_prompts.get(scene_id),
+                    "config": config_payload,
+                    "degraded": bool(plan.get("degraded")),
+                    "deadline_at": budget.deadline_at,
+                },
+                priority=estimate_scene_cost(plan, config)["critical"],
+            )
+        logger.info(f"已分发{len(scene_ids)}个场景任务，分组：{group}")
+
+        if isinstance(queue, MemoryLeaseQueue):
+            for i in range(get_video_capacity(config)):
+                worker = threading.Thread(
+                    target=run_worker,
+                    kwargs=dict(queue=queue, base_config=config, worker_id=f"local-{i}", stop_event=stop_event, exit_when_idle=True),
+                    name=f"scene-worker-{i}",
+                    daemon=True,
+                )
+                worker.start()
+                local_workers.append(worker)
+
+        tasks = wait_for_group(queue, group, cancel_event, task_ids)
+        stop_worker_threads(stop_event, local_workers)
+
+        video_results = [t["result"] for t in tasks if t["status"] == TASK_DONE and t["result"]]
+        for task in tasks:
+            if task["status"] != TASK_DONE:
+                logger.error(f"任务 {task['id']} 失败：{task['error']}")
+        logger.info(f"成功生成了{len(video_results)}个视频")
+
+        logger.info("\n5. 合并所有生成的视频...")
+        merged_video_path = merge_scene_videos(video_results, config)
+        collect_media_garbage(config)
+        log_hedge_stats()
+        log_credential_stats()
+        log_run_spend()
+        logger.info("\n✅ 任务完成！")
+        return {
+            "voice_script": voice_script,
+            "video_results": video_results,
+            "merged_video_path": merged_video_path,
+        }
+    except WorkflowCancelled:
+        if group is not None:
+            # 共享队列上尚未领取的任务不再被其他机器的worker执行
+            logger.info(f"已取消分组 {group} 中{queue.cancel(group)}个未完成的场景任务")
+        logger.warning("\n⏹ 任务已取消")
+        return None
+    except Exception as e:
+        logger.error(f"\n❌ 任务失败：{e}", exc_info=True)
+        return None
+    finally:
+        stop_worker_threads(stop_event, local_workers)
+        end_run_budget(budget_token)
+
+
+def stop_worker_threads(stop_event: threading.Event, workers: List[threading.Thread]) -> None:
+    """通知本机worker线程不再领取新任务，并等待正在执行的任务结束"""
+    stop_event.set()
+    for worker in workers:
+        worker.join()
+
+
+def wait_for_group(queue: LeaseQueue, group: str, cancel_event: Optional[threading.Event] = None, task_ids: Optional[set] = None) -> List[Dict[str, Any]]:
+    """等待分组内所有任务（指定task_ids时只等待本次分发的任务）结束（完成或最终失败），返回任务列表"""
+    last_progress = None
+    while True:
+        check_cancelled(cancel_event)
+        tasks = [t for t in queue.tasks(group) if task_ids is None or t["id"] in task_ids]
+        active = [t for t in tasks if t["status"] in (TASK_PENDING, TASK_LEASED)]
+        progress = (len(tasks) - len(active), len(tasks))
+        if progress != last_progress:
+            logger.info(f"场景任务进度：{progress[0]}/{progress[1]}")
+            last_progress = progress
+        if not active:
+            return tasks
+        (cancel_event or threading.Event()).wait(Config.WORKER_POLL_INTERVAL)
@@ -0,0 +1,414 @@
+import os
+import json
+import math
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from app.config import Config, RunConfig
+from app.utils.logger import setup_logger, log_context, get_log_context
+from app.utils.file_ops import load_novel
+
+logger = setup_logger(__name__)
+
+# 作业状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+TERMINAL_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobStore:
+    """
+    基于SQLite的持久化作业队列
+
+    作业按priority降序、提交时间升序出队；进程重启时运行中的作业重新入队。
+    """
+
+    def __init__(self, db_path: str):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+            recovered = self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?", (JOB_QUEUED, JOB_RUNNING)
+            ).rowcount
+        if recovered:
+            logger.info(f"{recovered}个未完成的作业已重新入队")
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def create(self, params: Dict[str, Any], priority: int = 0) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, priority, json.dumps(params, ensure_ascii=False), time.time()),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM jobs"
+        args: tuple = ()
+        if status:
+            query += " WHERE status = ?"
+            args = (status,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created_at DESC", args).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """取出优先级最高的排队作业并标记为运行中"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY priority DESC, created_at ASC LIMIT 1", (JOB_QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?", (JOB_RUNNING, time.time(), row["id"])
+            )
+        return self.get(row["id"])
+
+    def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), job_id),
+            )
+
+    def cancel_queued(self, job_id: str) -> bool:
+        """取消尚未开始的作业"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (JOB_CANCELLED, time.time(), job_id, JOB_QUEUED),
+            ).rowcount > 0
+
+    def set_priority(self, job_id: str, priority: int) -> bool:
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET priority = ? WHERE id = ? AND status = ?", (priority, job_id, JOB_QUEUED)
+            ).rowcount > 0
+
+
+class JobEvents:
+    """
+    作业进度事件
+
+    每个作业保留最近的事件，供SSE订阅者按序号续读；新事件到达时唤醒等待的订阅者。
+    作业进入终态retention秒后丢弃其事件，订阅者此时从作业存储读取最终状态。
+    """
+
+    def __init__(self, max_events: int = Config.SERVER_MAX_EVENTS, retention: float = Config.SERVER_EVENTS_RETENTION):
+        self.max_events = max_events
+        self.retention = retention
+        self._events: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._seq: Dict[str, int] = {}
+        self._finished: Dict[str, float] = {}
+        self._cond = threading.Condition()
+
+    def publish(self, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        with self._cond:
+            self._prune()
+            seq = self._seq.get(job_id, 0) + 1
+            self._seq[job_id] = seq
+            self._events.setdefault(job_id, deque(maxlen=self.max_events)).append(
+                {"id": seq, "event": event, "data": data}
+            )
+            if event == "status" and data.get("status") in TERMINAL_STATES:
+                self._finished[job_id] = time.monotonic()
+            self._cond.notify_all()
+
+    def _prune(self) -> None:
+        """丢弃结束超过retention秒的作业事件，调用方持有锁"""
+        cutoff = time.monotonic() - self.retention
+        for job_id in [j for j, finished_at in self._finished.items() if finished_at <= cutoff]:
+            del self._finished[job_id]
+            self._events.pop(job_id, None)
+            self._seq.pop(job_id, None)
+
+    def read(self, job_id: str, after: int = 0, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """返回序号大于after的事件，没有新事件时最多等待timeout秒"""
+        with self._cond:
+            events = [e for e in self._events.get(job_id, ()) if e["id"] > after]
+            if not events and timeout:
+                self._cond.wait(timeout)
+                events = [e for e in self._events.get(job_id, ()) if e["id"] > after]
+            return events
+
+
+class JobLogHandler(logging.Handler):
+    """将带job_id上下文的应用日志转为作业进度事件"""
+
+    def __init__(self, events: JobEvents):
+        super().__init__(logging.INFO)
+        self.events = events
+
+    def emit(self, record: logging.LogRecord) -> None:
+        context = get_log_context()
+        job_id = context.get("job_id")
+        if not job_id:
+            return
+        try:
+            data = {"ts": record.created, "level": record.levelname, "msg": record.getMessage().strip()}
+            data.update({k: v for k, v in context.items() if k != "job_id" and v is not None})
+            self.events.publish(job_id, "log", data)
+        except Exception:
+            self.handleError(record)
+
+
+def resolve_chapters(params: Dict[str, Any], novel_file_path: str) -> List[str]:
+    """
+    根据作业参数确定要生成的章节
+
+    支持chapters（章节标题列表）、chapter_range（[起, 止]，从1开始且包含两端）或chapter（单个章节）。
+    """
+    if params.get("chapters"):
+        return list(params["chapters"])
+    if params.get("chapter_range"):
+        start, end = params["chapter_range"]
+        titles = list(load_novel(novel_file_path).keys())
+        return titles[max(1, int(start)) - 1:int(end)]
+    return [params.get("chapter") or Config.TARGET_CHAPTER]
+
+
+def _parse_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("1", "true", "yes", "on", "0", "false", "no", "off", ""):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    raise ValueError(f"无法解析为布尔值：{value!r}")
+
+
+def _parse_number(value: Any, cast: type) -> Any:
+    # bool是int的子类，True/False不应被当作1/0接受
+    if isinstance(value, bool):
+        raise ValueError(f"无法解析为数值：{value!r}")
+    number = cast(value)
+    if cast is int and isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"无法解析为整数：{value!r}")
+    return number
+
+
+def parse_job_options(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    校验并转换作业参数中的运行选项
+
+    Returns:
+        可直接传给RunConfig.replace的选项
+
+    Raises:
+        ValueError: 选项类型或取值不合法
+    """
+    options: Dict[str, Any] = {}
+    for key in ("test_mode", "max_scenes", "budget", "deadline_seconds"):
+        if key not in params:
+            continue
+        value = params[key]
+        try:
+            if key == "test_mode":
+                options[key] = _parse_bool(value)
+            elif key == "max_scenes":
+                options[key] = _parse_number(value, int)
+                if options[key] <= 0:
+                    raise ValueError("必须为正整数")
+            elif value is None:
+                # 预算与截止时间为None表示不限制
+                options[key] = None
+            else:
+                options[key] = _parse_number(value, float)
+                if not math.isfinite(options[key]) or options[key] < 0 or (key == "deadline_seconds" and options[key] == 0):
+                    raise ValueError("必须为正数" if key == "deadline_seconds" else "必须为非负数")
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"作业参数{key}不合法：{e}") from None
+    return options
+
+
+class JobManager:
+    """
+    作业调度：固定数量的工作线程在同一进程中依次执行作业
+
+    服务商客户端、模型缓存与即梦并发槽位都是进程级的，在作业之间保持复用，
+    多个作业的视频任务共享同一账号的并发上限。
+    """
+
+    def __init__(self, jobs_dir: str = Config.JOBS_DIR, workers: int = Config.SERVER_WORKERS, base_config: Optional[RunConfig] = None):
+        self.jobs_dir = jobs_dir
+        self.workers = max(1, workers)
+        self.base_config = base_config or RunConfig()
+        self.store = JobStore(os.path.join(jobs_dir, "jobs.db"))
+        self.events = JobEvents()
+        self._cancel_events: Dict[str, threading.Event] = {}
+        # 出队登记取消信号与cancel互斥，作业刚被标记为运行中时的取消请求不会丢失
+        self._cancel_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._log_handler = JobLogHandler(self.events)
+
+    def start(self) -> None:
+        # 应用日志器均为app.*的子日志器，挂在父日志器上即可收到全部作业日志
+        logging.getLogger("app").addHandler(self._log_handler)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"作业调度已启动，工作线程数：{self.workers}")
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for cancel_event in list(self._cancel_events.values()):
+            cancel_event.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        logging.getLogger("app").removeHandler(self._log_handler)
+
+    def submit(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        提交作业，params包含novel_file或novel_text、章节选择及运行选项
+
+        Raises:
+            ValueError: 优先级或运行选项不合法
+        """
+        params = dict(params)
+        try:
+            priority = int(params.pop("priority", 0))
+        except (TypeError, ValueError):
+            raise ValueError("作业参数priority必须为整数") from None
+        params.update(parse_job_options(params))
+        if not params.get("novel_file") and not params.get("novel_text"):
+            params["novel_file"] = self.base_config.novel_file_path
+        job = self.store.create(params, priority)
+        self.events.publish(job["id"], "status", {"status": JOB_QUEUED})
+        with self._wakeup:
+            self._wakeup.notify()
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._cancel_lock:
+            if self.store.cancel_queued(job_id):
+                self.events.publish(job_id, "status", {"status": JOB_CANCELLED})
+            elif job_id in self._cancel_events:
+                # 运行中的作业在下一个阶段/场景边界停止
+                self._cancel_events[job_id].set()
+        return self.store.get(job_id)
+
+    def set_priority(self, job_id: str, priority: int) -> Optional[Dict[str, Any]]:
+        if self.store.set_priority(job_id, priority):
+            with self._wakeup:
+                self._wakeup.notify()
+        return self.store.get(job_id)
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """取出下一个作业，并在标记为运行中的同时登记其取消信号"""
+        with self._cancel_lock:
+            job = self.store.claim()
+            if job is not None:
+                self._cancel_events[job["id"]] = threading.Event()
+        return job
+
+    def _worker_loop(self) -> None:
+        while not self._stopping.is_set():
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            self._run_job(job)
+
+    def _build_configs(self, job: Dict[str, Any]) -> List[RunConfig]:
+        """为作业中的每个章节构建独立工作目录的运行配置，同一作业内共享人物写真"""
+        params = job["params"]
+        job_dir = os.path.join(self.jobs_dir, job["id"])
+        os.makedirs(job_dir, exist_ok=True)
+        novel_file = params.get("novel_file")
+        if params.get("novel_text"):
+            novel_file = os.path.join(job_dir, "novel.txt")
+            with open(novel_file, "w", encoding="utf-8") as f:
+                f.write(params["novel_text"])
+
+        options = parse_job_options(params)
+        configs = []
+        for index, chapter in enumerate(resolve_chapters(params, novel_file), start=1):
+            config = self.base_config.replace(novel_file_path=novel_file, target_chapter=chapter, **options)
+            config = config.with_workspace(os.path.join(job_dir, f"chapter_{index}"))
+            configs.append(config.replace(character_dir=os.path.join(job_dir, Config.CHARACTER_DIR)))
+        return configs
+
+    def _run_job(self, job: Dict[str, Any]) -> None:
+        # 延迟导入工作流，服务启动时不加载服务商SDK
+        from app.core.workflow import create_workflow
+
+        job_id = job["id"]
+        cancel_event = self._cancel_events[job_id]
+        self.events.publish(job_id, "status", {"status": JOB_RUNNING})
+        results: List[Dict[str, Any]] = []
+        status, error = JOB_DONE, None
+        with log_context(job_id=job_id):
+            try:
+                configs = self._build_configs(job)
+                if not configs:
+                    raise ValueError("没有匹配的章节")
+                for config in configs:
+                    if cancel_event.is_set():
+                        break
+                    self.events.publish(job_id, "chapter", {"chapter": config.target_chapter, "status": JOB_RUNNING})
+                    result = create_workflow(config, cancel_event=cancel_event)
+                    chapter_result = {
+                        "chapter": config.target_chapter,
+                        "ok": result is not None,
+                        "merged_video_path": result["merged_video_path"] if result else None,
+                        "preview": os.path.join(config.preview_dir, "index.html"),
+                    }
+                    results.append(chapter_result)
+                    self.events.publish(job_id, "chapter", dict(chapter_result, status=JOB_DONE if result else JOB_FAILED))
+                if cancel_event.is_set():
+                    status = JOB_CANCELLED
+                elif not any(r["ok"] for r in results):
+                    status, error = JOB_FAILED, "所有章节均生成失败"
+            except Exception as e:
+                logger.error(f"作业 {job_id} 执行失败：{e}", exc_info=True)
+                status, error = JOB_FAILED, str(e)
+            finally:
+                with self._cancel_lock:
+                    self._cancel_events.pop(job_id, None)
+        self.store.finish(job_id, status, result=results, error=error)
+        self.events.publish(job_id, "status", {"status": status, "error": error})
@@ -0,0 +1,421 @@
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+from app.config import Config
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 任务状态
+TASK_PENDING = "pending"
+TASK_LEASED = "leased"
+TASK_DONE = "done"
+TASK_FAILED = "failed"
+TASK_FINISHED = (TASK_DONE, TASK_FAILED)
+TASK_CANCELLED_ERROR = "已取消"
+
+
+class LeaseQueue(ABC):
+    """
+    带租约的任务队列
+
+    worker通过lease领取任务并在租约到期前heartbeat续约；租约过期（worker崩溃或断网）的任务
+    会被重新领取，超过max_attempts次后标记为失败。任务按priority降序领取。
+    同一task_id重复put时，尚未结束（待领取或已领取）的任务保持不变；已完成或已失败的任务
+    以新的payload重新排队，尝试次数清零（重新运行时重试上次失败的场景）。
+    """
+    max_attempts: int = Config.TASK_MAX_ATTEMPTS
+
+    @abstractmethod
+    def put(self, task_id: str, group: str, payload: Dict[str, Any], priority: float = 0) -> None:
+        """放入任务，已结束的同名任务重新排队"""
+
+    @abstractmethod
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """领取一个任务，返回{id, group, payload, attempts}，没有可领取的任务时返回None"""
+
+    @abstractmethod
+    def heartbeat(self, task_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """续约，返回False表示租约已失效（任务已被他人领取），worker应放弃该任务"""
+
+    @abstractmethod
+    def complete(self, task_id: str, worker_id: str, result: Any) -> bool:
+        """任务完成，返回False表示租约已失效，结果未记录"""
+
+    @abstractmethod
+    def fail(self, task_id: str, worker_id: str, error: str) -> bool:
+        """任务失败：未达最大尝试次数时重新排队，否则标记为失败"""
+
+    @abstractmethod
+    def tasks(self, group: str) -> List[Dict[str, Any]]:
+        """返回分组内所有任务的状态、结果与错误信息"""
+
+    @abstractmethod
+    def cancel(self, group: str) -> int:
+        """
+        取消分组内尚未结束的任务，返回取消的任务数
+
+        待领取的任务不再被领取，运行中的任务续约与上报结果均失效；取消的任务标记为失败，
+        之后重新put时会重新排队。
+        """
+
+
+class MemoryLeaseQueue(LeaseQueue):
+    """进程内队列，用于单机运行与测试"""
+
+    def __init__(self):
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, task_id: str, group: str, payload: Dict[str, Any], priority: float = 0) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task["status"] in TASK_FINISHED:
+                self._tasks[task_id] = {
+                    "id": task_id, "group": group, "payload": payload, "priority": priority,
+                    "status": TASK_PENDING, "attempts": 0, "worker": None, "lease_until": 0.0,
+                    "result": None, "error": None,
+                }
+
+    def _expire(self, now: float) -> None:
+        for task in self._tasks.values():
+            if task["status"] == TASK_LEASED and task["lease_until"] < now:
+                task["status"] = TASK_PENDING if task["attempts"] < self.max_attempts else TASK_FAILED
+                task["error"] = task["error"] or "租约过期"
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            pending = [t for t in self._tasks.values() if t["status"] == TASK_PENDING]
+            if not pending:
+                return None
+            task = max(pending, key=lambda t: t["priority"])
+            task.update(status=TASK_LEASED, worker=worker_id, lease_until=now + lease_seconds, attempts=task["attempts"] + 1)
+            return {k: task[k] for k in ("id", "group", "payload", "attempts")}
+
+    def _owned(self, task_id: str, worker_id: str) -> Optional[Dict[str, Any]]:
+        task = self._tasks.get(task_id)
+        if task and task["status"] == TASK_LEASED and task["worker"] == worker_id:
+            return task
+        return None
+
+    def heartbeat(self, task_id: str, worker_id: str, lease_seconds: float) -> bool:
+        with self._lock:
+            task = self._owned(task_id, worker_id)
+            if task:
+                task["lease_until"] = time.time() + lease_seconds
+            return task is not None
+
+    def complete(self, task_id: str, worker_id: str, result: Any) -> bool:
+        with self._lock:
+            task = self._owned(task_id, worker_id)
+            if task:
+                task.update(status=TASK_DONE, result=result, error=None)
+            return task is not None
+
+    def fail(self, task_id: str, worker_id: str, error: str) -> bool:
+        with self._lock:
+            task = self._owned(task_id, worker_id)
+            if task:
+                task.update(status=TASK_PENDING if task["attempts"] < self.max_attempts else TASK_FAILED, error=error)
+            return task is not None
+
+    def tasks(self, group: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._expire(time.time())
+            return [
+                {k: t[k] for k in ("id", "status", "attempts", "worker", "result", "error")}
+                for t in self._tasks.values() if t["group"] == group
+            ]
+
+    def cancel(self, group: str) -> int:
+        with self._lock:
+            cancelled = [t for t in self._tasks.values() if t["group"] == group and t["status"] in (TASK_PENDING, TASK_LEASED)]
+            for task in cancelled:
+                task.update(status=TASK_FAILED, error=TASK_CANCELLED_ERROR)
+            return len(cancelled)
+
+
+class SQLiteLeaseQueue(LeaseQueue):
+    """
+    基于SQLite的队列，数据库文件可放在多台机器共享的存储上
+
+    每次操作使用独立连接与BEGIN IMMEDIATE事务，依赖SQLite文件锁保证领取的原子性。
+    注意部分网络文件系统的锁实现不可靠，此时应改用Redis。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id TEXT PRIMARY KEY,
+                    grp TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority REAL NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, priority)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _transaction(self, fn) -> Any:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _expire(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            "UPDATE tasks SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, error = COALESCE(error, '租约过期') "
+            "WHERE status = ? AND lease_until < ?",
+            (self.max_attempts, TASK_PENDING, TASK_FAILED, TASK_LEASED, now),
+        )
+
+    def put(self, task_id: str, group: str, payload: Dict[str, Any], priority: float = 0) -> None:
+        def fn(conn: sqlite3.Connection) -> None:
+            payload_json = json.dumps(payload, ensure_ascii=False)
+            conn.execute(
+                "UPDATE tasks SET grp = ?, payload = ?, priority = ?, status = ?, attempts = 0, worker = NULL, "
+                "lease_until = 0, result = NULL, error = NULL WHERE id = ? AND status IN (?, ?)",
+                (group, payload_json, priority, TASK_PENDING, task_id) + TASK_FINISHED,
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO tasks (id, grp, payload, priority, status) VALUES (?, ?, ?, ?, ?)",
+                (task_id, group, payload_json, priority, TASK_PENDING),
+            )
+        self._transaction(fn)
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        def fn(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            now = time.time()
+            self._expire(conn, now)
+            row = conn.execute(
+                "SELECT * FROM tasks WHERE status = ? ORDER BY priority DESC LIMIT 1", (TASK_PENDING,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (TASK_LEASED, worker_id, now + lease_seconds, row["id"]),
+            )
+            return {"id": row["id"], "group": row["grp"], "payload": json.loads(row["payload"]), "attempts": row["attempts"] + 1}
+        return self._transaction(fn)
+
+    def _update_owned(self, task_id: str, worker_id: str, assignments: str, args: tuple) -> bool:
+        return self._transaction(lambda conn: conn.execute(
+            f"UPDATE tasks SET {assignments} WHERE id = ? AND worker = ? AND status = ?",
+            args + (task_id, worker_id, TASK_LEASED),
+        ).rowcount > 0)
+
+    def heartbeat(self, task_id: str, worker_id: str, lease_seconds: float) -> bool:
+        return self._update_owned(task_id, worker_id, "lease_until = ?", (time.time() + lease_seconds,))
+
+    def complete(self, task_id: str, worker_id: str, result: Any) -> bool:
+        return self._update_owned(task_id, worker_id, "status = ?, result = ?, error = NULL", (TASK_DONE, json.dumps(result, ensure_ascii=False)))
+
+    def fail(self, task_id: str, worker_id: str, error: str) -> bool:
+        return self._update_owned(
+            task_id, worker_id,
+            "status = CASE WHEN attempts < ? THEN ? ELSE ? END, error = ?",
+            (self.max_attempts, TASK_PENDING, TASK_FAILED, error),
+        )
+
+    def tasks(self, group: str) -> List[Dict[str, Any]]:
+        def fn(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+            self._expire(conn, time.time())
+            rows = conn.execute("SELECT id, status, attempts, worker, result, error FROM tasks WHERE grp = ?", (group,)).fetchall()
+            return [dict(row, result=json.loads(row["result"]) if row["result"] else None) for row in rows]
+        return self._transaction(fn)
+
+    def cancel(self, group: str) -> int:
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE tasks SET status = ?, error = ? WHERE grp = ? AND status IN (?, ?)",
+            (TASK_FAILED, TASK_CANCELLED_ERROR, group, TASK_PENDING, TASK_LEASED),
+        ).rowcount)
+
+
+# Redis实现：任务存于哈希nv:task:{id}，待领取任务在有序集合nv:pending（分数为优先级），
+# 租约在有序集合nv:leases（分数为到期时间），分组成员在集合nv:group:{group}；领取与续约用Lua脚本保证原子性
+_REDIS_EXPIRE = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    local key = 'nv:task:' .. id
+    if tonumber(redis.call('HGET', key, 'attempts')) < tonumber(ARGV[2]) then
+        redis.call('HSET', key, 'status', 'pending')
+        redis.call('ZADD', KEYS[1], redis.call('HGET', key, 'priority'), id)
+    else
+        redis.call('HSET', key, 'status', 'failed')
+    end
+    if not redis.call('HGET', key, 'error') then
+        redis.call('HSET', key, 'error', '租约过期')
+    end
+end
+"""
+
+_REDIS_LEASE = _REDIS_EXPIRE + """
+local popped = redis.call('ZPOPMAX', KEYS[1])
+if #popped == 0 then return nil end
+local id = popped[1]
+local key = 'nv:task:' .. id
+redis.call('HSET', key, 'status', 'leased', 'worker', ARGV[3])
+redis.call('HINCRBY', key, 'attempts', 1)
+redis.call('ZADD', KEYS[2], ARGV[1] + ARGV[4], id)
+return id
+"""
+
+_REDIS_PUT = """
+local key = 'nv:task:' .. ARGV[1]
+local status = redis.call('HGET', key, 'status')
+if status and status ~= 'done' and status ~= 'failed' then return 0 end
+redis.call('DEL', key)
+redis.call('HSET', key, 'status', 'pending', 'group', ARGV[2], 'payload', ARGV[3], 'priority', ARGV[4], 'attempts', 0)
+redis.call('SADD', 'nv:group:' .. ARGV[2], ARGV[1])
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+return 1
+"""
+
+_REDIS_HEARTBEAT = """
+local key = 'nv:task:' .. ARGV[1]
+if redis.call('HGET', key, 'status') ~= 'leased' or redis.call('HGET', key, 'worker') ~= ARGV[2] then return 0 end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+
+_REDIS_FINISH = """
+local key = 'nv:task:' .. ARGV[1]
+if redis.call('HGET', key, 'status') ~= 'leased' or redis.call('HGET', key, 'worker') ~= ARGV[2] then return 0 end
+redis.call('ZREM', KEYS[2], ARGV[1])
+local status = ARGV[3]
+if status == 'retry' then
+    if tonumber(redis.call('HGET', key, 'attempts')) < tonumber(ARGV[5]) then
+        status = 'pending'
+        redis.call('ZADD', KEYS[1], redis.call('HGET', key, 'priority'), ARGV[1])
+    else
+        status = 'failed'
+    end
+    redis.call('HSET', key, 'status', status, 'error', ARGV[4])
+else
+    redis.call('HSET', key, 'status', status, 'result', ARGV[4])
+    redis.call('HDEL', key, 'error')
+end
+return 1
+"""
+
+_REDIS_CANCEL = """
+local cancelled = 0
+for _, id in ipairs(redis.call('SMEMBERS', 'nv:group:' .. ARGV[1])) do
+    local key = 'nv:task:' .. id
+    local status = redis.call('HGET', key, 'status')
+    if status == 'pending' or status == 'leased' then
+        redis.call('ZREM', KEYS[1], id)
+        redis.call('ZREM', KEYS[2], id)
+        redis.call('HSET', key, 'status', 'failed', 'error', ARGV[2])
+        cancelled = cancelled + 1
+    end
+end
+return cancelled
+"""
+
+
+class RedisLeaseQueue(LeaseQueue):
+    """基于Redis（或兼容存储）的队列，需要安装redis包"""
+    PENDING_KEY = "nv:pending"
+    LEASES_KEY = "nv:leases"
+
+    def __init__(self, url: str):
+        # 延迟导入，仅使用Redis队列时需要
+        import redis
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._lease_script = self._redis.register_script(_REDIS_LEASE)
+        self._expire_script = self._redis.register_script(_REDIS_EXPIRE)
+        self._put_script = self._redis.register_script(_REDIS_PUT)
+        self._heartbeat_script = self._redis.register_script(_REDIS_HEARTBEAT)
+        self._finish_script = self._redis.register_script(_REDIS_FINISH)
+        self._cancel_script = self._redis.register_script(_REDIS_CANCEL)
+
+    def put(self, task_id: str, group: str, payload: Dict[str, Any], priority: float = 0) -> None:
+        self._put_script(keys=[self.PENDING_KEY], args=[task_id, group, json.dumps(payload, ensure_ascii=False), priority])
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        task_id = self._lease_script(
+            keys=[self.PENDING_KEY, self.LEASES_KEY],
+            args=[time.time(), self.max_attempts, worker_id, lease_seconds],
+        )
+        if not task_id:
+            return None
+        task = self._redis.hgetall(f"nv:task:{task_id}")
+        return {"id": task_id, "group": task["group"], "payload": json.loads(task["payload"]), "attempts": int(task["attempts"])}
+
+    def heartbeat(self, task_id: str, worker_id: str, lease_seconds: float) -> bool:
+        return bool(self._heartbeat_script(keys=[self.LEASES_KEY], args=[task_id, worker_id, time.time() + lease_seconds]))
+
+    def complete(self, task_id: str, worker_id: str, result: Any) -> bool:
+        return bool(self._finish_script(
+            keys=[self.PENDING_KEY, self.LEASES_KEY],
+            args=[task_id, worker_id, TASK_DONE, json.dumps(result, ensure_ascii=False), self.max_attempts],
+        ))
+
+    def fail(self, task_id: str, worker_id: str, error: str) -> bool:
+        return bool(self._finish_script(
+            keys=[self.PENDING_KEY, self.LEASES_KEY],
+            args=[task_id, worker_id, "retry", error, self.max_attempts],
+        ))
+
+    def tasks(self, group: str) -> List[Dict[str, Any]]:
+        self._expire_script(keys=[self.PENDING_KEY, self.LEASES_KEY], args=[time.time(), self.max_attempts])
+        tasks = []
+        for task_id in sorted(self._redis.smembers(f"nv:group:{group}")):
+            task = self._redis.hgetall(f"nv:task:{task_id}")
+            tasks.append({
+                "id": task_id,
+                "status": task.get("status"),
+                "attempts": int(task.get("attempts", 0)),
+                "worker": task.get("worker"),
+                "result": json.loads(task["result"]) if task.get("result") else None,
+                "error": task.get("error"),
+            })
+        return tasks
+
+    def cancel(self, group: str) -> int:
+        return int(self._cancel_script(keys=[self.PENDING_KEY, self.LEASES_KEY], args=[group, TASK_CANCELLED_ERROR]))
+
+
+def open_queue(url: str) -> LeaseQueue:
+    """
+    根据URL打开队列
+
+    支持memory://（进程内）、sqlite:///path/to/queue.db（共享存储）与redis://host:port/db。
+    memory://每次调用返回一个新的空队列，只在持有该对象的调用方之间共享。
+    """
+    if url.startswith("memory://"):
+        return MemoryLeaseQueue()
+    if url.startswith("sqlite:///"):
+        return SQLiteLeaseQueue(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisLeaseQueue(url)
+    raise ValueError(f"不支持的队列地址：{url}")
@@ -0,0 +1,175 @@
+import os
+import json
+import math
+from typing import Any, Dict, List, Optional
+from app.config import RunConfig, resolve_config
+from app.core.clip_planner import plan_scene_clips, frames_to_duration
+from app.core.scheduler import order_lpt, estimate_makespan
+from app.utils.file_ops import load_novel, split_chapter
+from app.utils.video_ops import get_audio_duration
+from app.services.tts import estimate_narration_duration
+from app.utils.credentials import get_video_capacity
+
+# 规划仅使用本地信息（章节索引、已有产物、音频时长），不导入任何服务商SDK
+
+
+def build_run_plan(config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """
+    估算一次运行将发起的LLM、文生图、视频调用次数及耗时与费用
+
+    Args:
+        config: 运行配置
+
+    Returns:
+        运行规划，包含各阶段调用次数、预计耗时（秒）和预计费用（元）
+    """
+    config = resolve_config(config)
+    plan: Dict[str, Any] = {
+        "chapter": config.target_chapter,
+        "chapter_found": False,
+        "stages": [],
+        "warnings": [],
+    }
+
+    chapters = load_novel(config.novel_file_path)
+    if config.target_chapter not in chapters:
+        plan["warnings"].append(f"未找到章节：{config.target_chapter}")
+        plan["available_chapters"] = list(chapters.keys())
+        return _summarize(plan)
+    plan["chapter_found"] = True
+
+    # 1. 口播文案
+    voice_script = None
+    script_file = os.path.join(config.history_dir, "voice_script.json")
+    if os.path.exists(script_file):
+        try:
+            with open(script_file, 'r', encoding='utf-8') as f:
+                voice_script = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            plan["warnings"].append(f"文案文件无法解析，将重新生成: {e}")
+    script_calls = 0
+    if not voice_script:
+        # 长章节分块生成：每块一次草稿调用，另加一次合并调用
+        chapter_content = chapters[config.target_chapter]
+        chunk_count = 1
+        if config.voice_script_map_reduce and len(chapter_content) > config.voice_script_chunk_chars:
+            chunk_count = len(split_chapter(chapter_content, config.voice_script_chunk_chars))
+        script_calls = chunk_count + 1 if chunk_count > 1 else 1
+    plan["stages"].append(_stage("口播文案", llm_calls=script_calls, config=config))
+
+    if voice_script:
+        scene_ids = list(voice_script.keys())
+    else:
+        scene_ids = [str(i) for i in range(1, config.expected_scenes + 1)]
+        plan["warnings"].append(f"尚未生成文案，按{config.expected_scenes}个场景估算")
+    if config.test_mode:
+        scene_ids = scene_ids[:config.max_scenes]
+    plan["scene_count"] = len(scene_ids)
+
+    # 2. 人物写真（每人：外貌提取 + 提示词 + 文生图）
+    missing_portraits: List[str] = []
+    if voice_script:
+        characters = set()
+        for scene_data in voice_script.values():
+            if isinstance(scene_data, dict) and isinstance(scene_data.get("character"), list):
+                characters.update(scene_data["character"])
+        missing_portraits = sorted(c for c in characters if not os.path.exists(os.path.join(config.character_dir, f"{c}.png")))
+    else:
+        plan["warnings"].append("人物写真数量需生成文案后确定")
+    plan["stages"].append(_stage("人物写真", llm_calls=2 * len(missing_portraits), image_calls=len(missing_portraits), config=config))
+
+    # 3. 场景首尾帧（提示词按批生成 + 每场景两张文生图）
+    missing_images = [
+        sid for sid in scene_ids
+        if not (os.path.exists(os.path.join(config.image_dir, f"{sid}_start.jpeg"))
+                and os.path.exists(os.path.join(config.image_dir, f"{sid}_end.jpeg")))
+    ]
+    batch_size = max(1, config.image_prompt_batch_size)
+    prompt_calls = math.ceil(len(missing_images) / batch_size)
+    plan["stages"].append(_stage("场景图片", llm_calls=prompt_calls, image_calls=2 * len(missing_images), config=config))
+
+    # 4. 场景视频（每子片段：视频提示词 + 即梦任务；多子片段场景额外生成中间关键帧）
+    clip_plans = []
+    missing_audio = 0
+    for sid in scene_ids:
+        if os.path.exists(os.path.join(config.video_dir, f"{sid}.mp4")) or os.path.exists(os.path.join(config.video_dir, f"{sid}_voice.mp4")):
+            continue
+        audio_path = os.path.join(config.voice_dir, f"{sid}.wav")
+        audio_duration = get_audio_duration(audio_path) if os.path.exists(audio_path) else None
+        if audio_duration is None:
+            missing_audio += 1
+            # 尚未配音的场景按文案长度估算朗读时长
+            if voice_script and config.tts_engine:
+                audio_duration = estimate_narration_duration(voice_script[sid]["content"], config)
+        clip_plans.append(plan_scene_clips(sid, audio_duration, config))
+    if missing_audio:
+        estimate = "按文案长度估算时长" if voice_script and config.tts_engine else "按默认时长估算"
+        plan["warnings"].append(f"{missing_audio}个场景尚无配音，{estimate}")
+
+    clip_count = sum(len(p["clips"]) for p in clip_plans)
+    keyframe_scenes = [p for p in clip_plans if len(p["clips"]) > 1]
+    video_seconds = sum(frames_to_duration(c["frames"], config.video_frame_rate) for p in clip_plans for c in p["clips"])
+    video_stage = _stage(
+        "场景视频",
+        llm_calls=clip_count + len(keyframe_scenes),
+        image_calls=sum(len(p["clips"]) - 1 for p in keyframe_scenes),
+        config=config,
+    )
+    video_stage["video_calls"] = clip_count
+    video_stage["video_seconds"] = video_seconds
+    video_stage["cost"] += video_seconds * config.video_cost_per_second
+    # 视频阶段按LPT顺序在并发槽位上执行
+    video_stage["seconds"] = estimate_makespan(order_lpt(clip_plans, config), get_video_capacity(config), config) if clip_plans else 0.0
+    plan["stages"].append(video_stage)
+    plan["video_plans"] = clip_plans
+
+    plan = _summarize(plan)
+    totals = plan["totals"]
+    if config.budget is not None and totals["cost"] > config.budget:
+        plan["warnings"].append(f"预计费用{totals['cost']:.2f}元超出预算{config.budget:.2f}元，运行时将降级或放弃部分场景")
+    if config.deadline_seconds and totals["seconds"] > config.deadline_seconds:
+        plan["warnings"].append(f"预计耗时{totals['seconds']:.0f}s超出截止时间{config.deadline_seconds:.0f}s，运行时将降级或放弃部分场景")
+    return plan
+
+
+def _stage(name: str, llm_calls: int = 0, image_calls: int = 0, config: RunConfig = None) -> Dict[str, Any]:
+    """按调用次数估算串行阶段的耗时与费用"""
+    return {
+        "name": name,
+        "llm_calls": llm_calls,
+        "image_calls": image_calls,
+        "video_calls": 0,
+        "seconds": llm_calls * config.llm_seconds_per_call + image_calls * config.image_seconds_per_call,
+        "cost": llm_calls * config.llm_cost_per_call + image_calls * config.image_cost_per_call,
+    }
+
+
+def _summarize(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """汇总各阶段的调用次数、耗时与费用"""
+    stages = plan["stages"]
+    plan["totals"] = {
+        "llm_calls": sum(s["llm_calls"] for s in stages),
+        "image_calls": sum(s["image_calls"] for s in stages),
+        "video_calls": sum(s["video_calls"] for s in stages),
+        "seconds": sum(s["seconds"] for s in stages),
+        "cost": sum(s["cost"] for s in stages),
+    }
+    return plan
+
+
+def format_run_plan(plan: Dict[str, Any]) -> str:
+    """将运行规划格式化为可读文本"""
+    lines = [f"章节：{plan['chapter']}"]
+    if not plan["chapter_found"]:
+        lines.append(f"⚠ 未找到章节，可选章节：{', '.join(plan.get('available_chapters', [])) or '无'}")
+        return "\n".join(lines)
+    lines.append(f"场景数：{plan['scene_count']}")
+    lines.append(f"{'阶段':<8}{'LLM':>6}{'图片':>6}{'视频':>6}{'耗时(s)':>10}{'费用(元)':>10}")
+    for stage in plan["stages"] + [dict(plan["totals"], name="合计")]:
+        lines.append(
+            f"{stage['name']:<8}{stage['llm_calls']:>6}{stage['image_calls']:>6}{stage['video_calls']:>6}"
+            f"{stage['seconds']:>10.0f}{stage['cost']:>10.2f}"
+        )
+    for warning in plan["warnings"]:
+        lines.append(f"⚠ {warning}")
+    return "\n".join(lines)
@@ -0,0 +1,227 @@
+import os
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import RunConfig, resolve_config
+from app.core.clip_planner import plan_scene_clips, stretch_action, FIT_STRETCH, FIT_PAD
+from app.services.llm import generate_keyframe_prompts, agenerate_keyframe_prompts
+from app.services.media import generate_checked_image, generate_single_video, agenerate_checked_image, agenerate_single_video, load_frame_prompt
+from app.utils.file_ops import image_to_base64
+from app.utils.logger import setup_logger
+from app.utils.video_ops import merge_videos, fit_video_duration
+
+logger = setup_logger(__name__)
+
+def plan_stream_mux(scene_id: str, video_dir: str, plan: Dict[str, Any], config: RunConfig) -> Optional[Dict[str, Any]]:
+    """
+    单子片段且无需变速的场景，下载即梦视频时直接合并配音，返回合并参数；不适用时返回None
+
+    多子片段需先拼接、变速需重新编码，这些场景仍先下载原始片段。
+    """
+    if not config.stream_mux or len(plan["clips"]) != 1 or plan["fit"] == FIT_STRETCH:
+        return None
+    audio_path = os.path.join(config.voice_dir, f"{scene_id}.wav")
+    if not os.path.exists(audio_path):
+        return None
+    return {
+        "audio_path": audio_path,
+        "output_path": os.path.join(video_dir, f"{scene_id}_voice.mp4"),
+        "pad_audio": plan["fit"] == FIT_PAD,
+    }
+
+def generate_keyframes(scene_info: Dict[str, Any], count: int, characters: List[str] = None, config: Optional[RunConfig] = None) -> List[Dict[str, str]]:
+    """
+    生成场景的中间关键帧图片
+
+    Returns:
+        按时间顺序排列的关键帧列表，每项包含path、prompt、base64
+    """
+    scene_id = scene_info["scene_id"]
+    image_dir = os.path.dirname(scene_info["image_path_start"])
+    prompts = generate_keyframe_prompts(
+        scene_info.get("scene_content", ""),
+        scene_info.get("image_prompt_start", ""),
+        scene_info.get("image_prompt_end", ""),
+        count,
+        config=config
+    )
+
+    keyframes = []
+    for i, prompt in enumerate(prompts, start=1):
+        save_path = os.path.join(image_dir, f"{scene_id}_key{i}.jpeg")
+        if not os.path.exists(save_path):
+            image_url = generate_checked_image(prompt, save_path, characters=characters, config=config)
+            if image_url.startswith("生成图片失败"):
+                raise Exception(f"场景 {scene_id} 第{i}个中间关键帧生成失败: {image_url}")
+        else:
+            logger.info(f"场景 {scene_id} 第{i}个中间关键帧已存在，跳过生成")
+            # 已有关键帧由之前生成的提示词得到，与本次提示词不一定一致
+            prompt = load_frame_prompt(save_path) or ""
+        keyframes.append({"path": save_path, "prompt": prompt, "base64": image_to_base64(save_path)})
+    return keyframes
+
+def prepare_scene_video(scene_info: Dict[str, Any], video_dir: str, audio_duration: Optional[float], plan: Optional[Dict[str, Any]], config: RunConfig) -> Dict[str, Any]:
+    """规划场景子片段并确定输出路径，同步与异步工作流共用"""
+    scene_id = scene_info["scene_id"]
+    plan = plan or plan_scene_clips(scene_id, audio_duration, config)
+    logger.info(f"场景 {scene_id} 规划为{len(plan['clips'])}个子片段，共{plan['total_frames']}帧，时长适配：{plan['fit']}")
+
+    os.makedirs(video_dir, exist_ok=True)
+    final_path = os.path.join(video_dir, f"{scene_id}.mp4")
+    return {
+        "scene_id": scene_id,
+        "video_dir": video_dir,
+        "plan": plan,
+        "final_path": final_path,
+        "raw_path": os.path.join(video_dir, f"{scene_id}_raw.mp4") if plan["fit"] == FIT_STRETCH else final_path,
+        "mux": plan_stream_mux(scene_id, video_dir, plan, config),
+    }
+
+def scene_frames(scene_info: Dict[str, Any], keyframes: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """首帧、中间关键帧、尾帧依次排列，相邻两帧构成一个子片段"""
+    start = {"path": scene_info["image_path_start"], "prompt": scene_info.get("image_prompt_start", ""), "base64": scene_info["image_base64_start"]}
+    end = {"path": scene_info["image_path_end"], "prompt": scene_info.get("image_prompt_end", ""), "base64": scene_info["image_base64_end"]}
+    return [start, *keyframes, end]
+
+def prepare_clip(scene: Dict[str, Any], scene_info: Dict[str, Any], frames: List[Dict[str, str]], clip: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], str]:
+    """
+    确定子片段的输出路径与生成参数
+
+    Returns:
+        (已存在时的结果, 需要生成时的clip_info, 输出路径)，前两项有且只有一项不为None
+    """
+    scene_id = scene["scene_id"]
+    index = clip["index"]
+    single = len(scene["plan"]["clips"]) == 1
+    part_path = scene["raw_path"] if single else os.path.join(scene["video_dir"], f"{scene_id}_part{index}.mp4")
+    mux = scene["mux"]
+    if os.path.exists(part_path) or (mux and os.path.exists(mux["output_path"])):
+        logger.info(f"场景 {scene_id} 子片段{index}已存在，跳过生成")
+        return {"scene_id": scene_id, "video_url": None, "video_path": part_path}, None, part_path
+    clip_info = {
+        "scene_id": scene_id if single else f"{scene_id}_part{index}",
+        "scene_content": scene_info.get("scene_content", ""),
+        "image_path_start": frames[index]["path"],
+        "image_prompt_start": frames[index]["prompt"],
+        "image_base64_start": frames[index]["base64"],
+        "image_path_end": frames[index + 1]["path"],
+        "image_prompt_end": frames[index + 1]["prompt"],
+        "image_base64_end": frames[index + 1]["base64"],
+    }
+    return None, clip_info, part_path
+
+def check_merged(scene: Dict[str, Any], merge_result: Any) -> None:
+    if not os.path.exists(scene["raw_path"]):
+        raise Exception(f"场景 {scene['scene_id']} 子片段拼接失败：{merge_result}")
+
+def log_stretch(scene: Dict[str, Any], audio_duration: float) -> None:
+    logger.info(f"场景 {scene['scene_id']} 视频{stretch_action(scene['plan'], audio_duration)}对齐音频时长 {audio_duration}s")
+
+def check_fitted(scene: Dict[str, Any], fitted: bool) -> None:
+    if not fitted:
+        raise Exception(f"场景 {scene['scene_id']} 视频时长调整失败")
+
+def scene_video_result(scene: Dict[str, Any], clip_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "scene_id": scene["scene_id"],
+        "video_url": clip_results[0].get("video_url") if len(clip_results) == 1 else None,
+        "video_path": scene["final_path"],
+        "narration": clip_results[0].get("narration"),
+        "clip_count": len(clip_results),
+        "fit": scene["plan"]["fit"],
+    }
+
+def generate_scene_video_workflow(scene_info: Dict[str, Any], video_dir: str, audio_duration: Optional[float] = None, characters: List[str] = None, plan: Dict[str, Any] = None, config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """
+    生成单个场景的完整视频
+
+    根据音频时长规划子片段：长场景拆分为多个子片段并行提交即梦生成后拼接，
+    短场景生成最小帧数片段后加速对齐音频（或在合成音频时补齐静音）。
+
+    Args:
+        scene_info: 场景图片信息（generate_single_image_workflow的返回值）
+        video_dir: 视频保存目录
+        audio_duration: 场景音频时长（秒）
+        characters: 场景中的人物，用于生成中间关键帧时保持形象一致
+        plan: 预先计算的子片段规划，默认根据audio_duration计算
+        config: 运行配置
+
+    Returns:
+        视频结果，包含video_path和时长适配方式fit
+    """
+    config = resolve_config(config)
+    scene = prepare_scene_video(scene_info, video_dir, audio_duration, plan, config)
+    clips = scene["plan"]["clips"]
+
+    keyframes = generate_keyframes(scene_info, len(clips) - 1, characters=characters, config=config) if len(clips) > 1 else []
+    frames = scene_frames(scene_info, keyframes)
+
+    def generate_clip(clip: Dict[str, Any]) -> Dict[str, Any]:
+        existing, clip_info, part_path = prepare_clip(scene, scene_info, frames, clip)
+        if existing:
+            return existing
+        return generate_single_video(clip_info, video_dir, frames=clip["frames"], save_path=part_path, mux=scene["mux"], config=config)
+
+    # 子片段并行提交，场景耗时约等于单个子片段的耗时
+    with ThreadPoolExecutor(max_workers=max(1, min(config.video_max_workers, len(clips)))) as executor:
+        # 复制上下文，使子片段日志保留场景ID等字段
+        futures = [executor.submit(contextvars.copy_context().run, generate_clip, clip) for clip in clips]
+        clip_results = [future.result() for future in futures]
+
+    if len(clips) > 1:
+        check_merged(scene, merge_videos([r["video_path"] for r in clip_results], scene["raw_path"]))
+    if scene["plan"]["fit"] == FIT_STRETCH:
+        log_stretch(scene, audio_duration)
+        check_fitted(scene, fit_video_duration(scene["raw_path"], audio_duration, scene["final_path"]))
+    return scene_video_result(scene, clip_results)
+
+async def agenerate_keyframes(scene_info: Dict[str, Any], count: int, characters: List[str] = None, config: Optional[RunConfig] = None) -> List[Dict[str, str]]:
+    """generate_keyframes的异步版本，各中间关键帧并发生成"""
+    scene_id = scene_info["scene_id"]
+    image_dir = os.path.dirname(scene_info["image_path_start"])
+    prompts = await agenerate_keyframe_prompts(
+        scene_info.get("scene_content", ""),
+        scene_info.get("image_prompt_start", ""),
+        scene_info.get("image_prompt_end", ""),
+        count,
+        config=config
+    )
+
+    async def generate_one(i: int, prompt: str) -> Dict[str, str]:
+        save_path = os.path.join(image_dir, f"{scene_id}_key{i}.jpeg")
+        if not os.path.exists(save_path):
+            image_url = await agenerate_checked_image(prompt, save_path, characters=characters, config=config)
+            if image_url.startswith("生成图片失败"):
+                raise Exception(f"场景 {scene_id} 第{i}个中间关键帧生成失败: {image_url}")
+        else:
+            logger.info(f"场景 {scene_id} 第{i}个中间关键帧已存在，跳过生成")
+            prompt = load_frame_prompt(save_path) or ""
+        return {"path": save_path, "prompt": prompt, "base64": image_to_base64(save_path)}
+
+    return list(await asyncio.gather(*(generate_one(i, prompt) for i, prompt in enumerate(prompts, start=1))))
+
+async def agenerate_scene_video_workflow(scene_info: Dict[str, Any], video_dir: str, audio_duration: Optional[float] = None, characters: List[str] = None, plan: Dict[str, Any] = None, config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """generate_scene_video_workflow的异步版本，子片段以协程并发提交，ffmpeg处理放到线程中执行"""
+    config = resolve_config(config)
+    scene = prepare_scene_video(scene_info, video_dir, audio_duration, plan, config)
+    clips = scene["plan"]["clips"]
+
+    keyframes = await agenerate_keyframes(scene_info, len(clips) - 1, characters=characters, config=config) if len(clips) > 1 else []
+    frames = scene_frames(scene_info, keyframes)
+
+    async def generate_clip(clip: Dict[str, Any]) -> Dict[str, Any]:
+        existing, clip_info, part_path = prepare_clip(scene, scene_info, frames, clip)
+        if existing:
+            return existing
+        return await agenerate_single_video(clip_info, video_dir, frames=clip["frames"], save_path=part_path, mux=scene["mux"], config=config)
+
+    # 并发受即梦账号的并发上限限制
+    clip_results = list(await asyncio.gather(*(generate_clip(clip) for clip in clips)))
+
+    if len(clips) > 1:
+        check_merged(scene, await asyncio.to_thread(merge_videos, [r["video_path"] for r in clip_results], scene["raw_path"]))
+    if scene["plan"]["fit"] == FIT_STRETCH:
+        log_stretch(scene, audio_duration)
+        check_fitted(scene, await asyncio.to_thread(fit_video_duration, scene["raw_path"], audio_duration, scene["final_path"]))
+    return scene_video_result(scene, clip_results)
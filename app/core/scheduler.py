@@ -0,0 +1,180 @@
+import heapq
+import contextlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from app.config import RunConfig, resolve_config
+from app.core.clip_planner import degrade_scene_plan, frames_to_duration
+from app.utils.budget import RunBudget, get_run_budget, video_cost, estimate_clip_seconds
+from app.utils.credentials import get_video_capacity
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def estimate_scene_cost(plan: Dict[str, Any], config: Optional[RunConfig] = None) -> Dict[str, float]:
+    """
+    估算场景视频任务的开销
+
+    Returns:
+        work: 场景所有子片段的总耗时（占用并发槽位的总量）
+        critical: 关键路径耗时（子片段并行时由最长子片段决定）
+    """
+    clip_seconds = [estimate_clip_seconds(clip["frames"], config) for clip in plan["clips"]]
+    return {"work": sum(clip_seconds), "critical": max(clip_seconds) if clip_seconds else 0.0}
+
+
+def order_lpt(plans: List[Dict[str, Any]], config: Optional[RunConfig] = None) -> List[Dict[str, Any]]:
+    """按最长处理时间优先（LPT）排序场景规划：关键路径长的先提交，其次总工作量大的先提交"""
+    def sort_key(plan: Dict[str, Any]):
+        cost = estimate_scene_cost(plan, config)
+        return (-cost["critical"], -cost["work"], int(plan["scene_id"]) if str(plan["scene_id"]).isdigit() else 0)
+    return sorted(plans, key=sort_key)
+
+
+def estimate_makespan(plans: List[Dict[str, Any]], workers: int, config: Optional[RunConfig] = None) -> float:
+    """
+    按给定提交顺序模拟列表调度，估算所有子片段在workers个并发槽位上的完成时间
+
+    每个子片段在有空闲槽位时立即开始，场景内子片段按顺序依次入队。
+    """
+    workers = max(1, workers)
+    slots = [0.0] * workers
+    heapq.heapify(slots)
+    makespan = 0.0
+    for plan in plans:
+        for clip in plan["clips"]:
+            start = heapq.heappop(slots)
+            end = start + estimate_clip_seconds(clip["frames"], config)
+            heapq.heappush(slots, end)
+            makespan = max(makespan, end)
+    return makespan
+
+
+def estimate_scene_spend(plan: Dict[str, Any], config: Optional[RunConfig] = None) -> float:
+    """估算场景视频阶段的费用：即梦按帧数计费，每个子片段一次视频提示词调用，多子片段场景另需中间关键帧及其提示词"""
+    config = resolve_config(config)
+    clip_count = len(plan["clips"])
+    keyframes = clip_count - 1
+    llm_calls = clip_count + (1 if keyframes else 0)
+    return (
+        sum(video_cost(clip["frames"], config) for clip in plan["clips"])
+        + keyframes * config.image_cost_per_call
+        + llm_calls * config.llm_cost_per_call
+    )
+
+
+def scene_output_seconds(plan: Dict[str, Any], config: RunConfig) -> float:
+    """场景完成后产出的成片时长"""
+    return plan.get("audio_duration") or frames_to_duration(plan["total_frames"], config.video_frame_rate)
+
+
+def degrade_first(plans: List[Dict[str, Any]], key, config: RunConfig) -> bool:
+    """将key最大的可降级场景替换为降级规划，没有可降级的场景时返回False"""
+    candidates = [(i, degraded) for i, degraded in enumerate(degrade_scene_plan(p, config) for p in plans) if degraded]
+    if not candidates:
+        return False
+    i, degraded = max(candidates, key=lambda c: key(plans[c[0]], c[1]))
+    logger.info(f"场景 {plans[i]['scene_id']} 降级为单个{degraded['total_frames']}帧子片段")
+    plans[i] = degraded
+    return True
+
+
+def fit_to_limits(plans: List[Dict[str, Any]], budget: Optional[RunBudget], config: Optional[RunConfig] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    在剩余预算与截止时间内选择场景，尽量多地完成成片时长
+
+    1. 预计完成时间超出截止时间时，依次降级关键路径最长的场景，直到来得及或无可降级；
+    2. 预计费用超出剩余预算时，先降级节省最多的场景，仍超出时按每元产出的成片时长从低到高放弃场景；
+    3. 按LPT顺序模拟调度，放弃预计完成时间仍晚于截止时间的场景。
+
+    Returns:
+        (按LPT排序的放行规划, 放弃的规划)
+    """
+    config = resolve_config(config)
+    plans = list(plans)
+    if budget is None or not plans:
+        return order_lpt(plans, config), []
+    capacity = get_video_capacity(config)
+    skipped: List[Dict[str, Any]] = []
+
+    remaining_seconds = budget.remaining_seconds()
+    if remaining_seconds is not None:
+        while estimate_makespan(order_lpt(plans, config), capacity, config) > remaining_seconds:
+            if not degrade_first(plans, lambda plan, _: estimate_scene_cost(plan, config)["critical"], config):
+                break
+
+    remaining_money = budget.remaining_money()
+    if remaining_money is not None:
+        while sum(estimate_scene_spend(p, config) for p in plans) > remaining_money:
+            if not degrade_first(plans, lambda plan, degraded: estimate_scene_spend(plan, config) - estimate_scene_spend(degraded, config), config):
+                break
+        admitted, total = [], 0.0
+        for plan in sorted(plans, key=lambda p: scene_output_seconds(p, config) / max(estimate_scene_spend(p, config), 1e-9), reverse=True):
+            spend = estimate_scene_spend(plan, config)
+            if total + spend <= remaining_money:
+                admitted.append(plan)
+                total += spend
+            else:
+                skipped.append(plan)
+        plans = admitted
+
+    ordered = order_lpt(plans, config)
+    if remaining_seconds is not None:
+        slots = [0.0] * max(1, capacity)
+        heapq.heapify(slots)
+        admitted = []
+        for plan in ordered:
+            trial = list(slots)
+            finish = 0.0
+            for clip in plan["clips"]:
+                start = heapq.heappop(trial)
+                end = start + estimate_clip_seconds(clip["frames"], config)
+                heapq.heappush(trial, end)
+                finish = max(finish, end)
+            if finish <= remaining_seconds:
+                slots = trial
+                admitted.append(plan)
+            else:
+                skipped.append(plan)
+        ordered = admitted
+
+    for plan in skipped:
+        logger.warning(f"场景 {plan['scene_id']} 超出预算或截止时间，放弃生成")
+    return ordered, skipped
+
+
+@contextlib.contextmanager
+def scene_admission(plan: Dict[str, Any], config: Optional[RunConfig] = None) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    场景开始生成前按实际花费与剩余时间复核，返回放行的规划（可能已降级），不放行时返回None
+
+    剩余时间不足以完成关键路径时降级，降级后仍来不及则放弃；放行的场景预留预计费用，
+    剩余预算不足时尝试降级，代码块结束后释放预留（实际费用已由各次调用记账）。
+    """
+    config = resolve_config(config)
+    budget = get_run_budget()
+    if budget is None:
+        yield plan
+        return
+    scene_id = plan["scene_id"]
+    remaining_seconds = budget.remaining_seconds()
+    if remaining_seconds is not None and estimate_scene_cost(plan, config)["critical"] > remaining_seconds:
+        degraded = degrade_scene_plan(plan, config)
+        if degraded is None or estimate_scene_cost(degraded, config)["critical"] > remaining_seconds:
+            logger.warning(f"场景 {scene_id} 剩余{max(remaining_seconds, 0):.0f}s内无法完成，放弃生成")
+            yield None
+            return
+        logger.info(f"场景 {scene_id} 剩余时间不足，降级为单个{degraded['total_frames']}帧子片段")
+        plan = degraded
+    spend = estimate_scene_spend(plan, config)
+    if not budget.reserve(spend):
+        degraded = degrade_scene_plan(plan, config)
+        if degraded is None or not budget.reserve(estimate_scene_spend(degraded, config)):
+            logger.warning(f"场景 {scene_id} 预计费用{spend:.2f}元超出剩余预算{budget.remaining_money():.2f}元，放弃生成")
+            yield None
+            return
+        logger.info(f"场景 {scene_id} 剩余预算不足，降级为单个{degraded['total_frames']}帧子片段")
+        plan, spend = degraded, estimate_scene_spend(degraded, config)
+    try:
+        yield plan
+    finally:
+        budget.release(spend)
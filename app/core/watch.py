@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, Optional
+from app.config import Config, RunConfig, resolve_config
+from app.utils.logger import setup_logger, log_context
+from app.utils.file_ops import load_novel, atomic_output
+
+logger = setup_logger(__name__)
+
+# 章节索引中的处理状态
+CHAPTER_BASELINE = "baseline"  # 首次监听时已存在的章节，只记录不处理
+CHAPTER_DONE = "done"
+CHAPTER_FAILED = "failed"
+
+INDEX_FILE = "novel_index.json"
+
+
+def chapter_digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def index_chapters(novel_file_path: str) -> List[Dict[str, str]]:
+    """按出现顺序返回各章节的标题与内容哈希"""
+    return [
+        {"title": title, "digest": chapter_digest(content)}
+        for title, content in load_novel(novel_file_path).items()
+    ]
+
+
+def chapter_workspace(root: str, position: int, digest: str) -> str:
+    """
+    章节输出目录：章节序号 + 内容哈希前缀
+
+    章节被修改后使用新目录重新生成，旧产物保持不变；未修改的场景通过媒体库复用。
+    """
+    return os.path.join(root, f"chapter_{position:04d}_{digest[:8]}")
+
+
+def load_index(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_index(path: str, index: Dict[str, Any]) -> None:
+    with atomic_output(path) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+
+
+def diff_chapters(chapters: List[Dict[str, str]], known: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """返回新增、内容变化或上次处理失败的章节（带从1开始的序号）"""
+    changed = []
+    for position, chapter in enumerate(chapters, start=1):
+        entry = known.get(chapter["title"])
+        if entry is None or entry["digest"] != chapter["digest"] or entry["status"] == CHAPTER_FAILED:
+            changed.append({**chapter, "position": position, "previous": entry})
+    return changed
+
+
+class NovelWatcher:
+    """
+    监听连载小说文件，只处理新增或修改过的章节
+
+    按文件大小与修改时间判断是否需要重新索引；文件在watch_settle_seconds内没有再变化
+    （写入完成）后才重新索引，避免处理写了一半的章节。每个章节处理完成后立即写入索引，
+    进程中断后从未完成的章节继续。
+    """
+
+    def __init__(self, root: str, base_config: RunConfig, run_chapter: Callable[[RunConfig], Optional[Dict[str, Any]]]):
+        self.root = root
+        self.base_config = base_config
+        self.run_chapter = run_chapter
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self.index = load_index(self.index_path)
+        self._pending_stat: Optional[tuple] = None
+        self._pending_since = 0.0
+
+    def file_stat(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.base_config.novel_file_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def file_settled(self, stat: tuple) -> bool:
+        """文件相对索引有变化，且已在watch_settle_seconds内保持不变"""
+        if stat == tuple(self.index.get("file_stat") or ()):
+            return False
+        if stat != self._pending_stat:
+            self._pending_stat = stat
+            self._pending_since = time.monotonic()
+        return time.monotonic() - self._pending_since >= self.base_config.watch_settle_seconds
+
+    def poll(self, force: bool = False) -> int:
+        """检查一次小说文件，处理变化的章节，返回本次处理的章节数"""
+        stat = self.file_stat()
+        if stat is None:
+            logger.warning(f"小说文件不存在：{self.base_config.novel_file_path}")
+            return 0
+        if not force and not self.file_settled(stat):
+            return 0
+
+        chapters = index_chapters(self.base_config.novel_file_path)
+        known = self.index.setdefault("chapters", {})
+        if not known:
+            # 首次监听：已有章节作为基线，只处理此后新增或修改的章节
+            for chapter in chapters:
+                known[chapter["title"]] = {"digest": chapter["digest"], "status": CHAPTER_BASELINE, "workspace": None}
+            logger.info(f"首次监听，已记录{len(chapters)}个已有章节作为基线，之后只处理新增或修改的章节")
+            self.commit_index(stat)
+            return 0
+
+        changed = diff_chapters(chapters, known)
+        if changed:
+            logger.info(f"发现{len(changed)}个新增或修改的章节：{', '.join(c['title'] for c in changed)}")
+        for chapter in changed:
+            self.process(chapter)
+        self.commit_index(stat)
+        return len(changed)
+
+    def process(self, chapter: Dict[str, Any]) -> None:
+        title = chapter["title"]
+        workspace = chapter_workspace(self.root, chapter["position"], chapter["digest"])
+        config = self.base_config.with_workspace(workspace).replace(
+            target_chapter=title,
+            character_dir=os.path.join(self.root, Config.CHARACTER_DIR),
+        )
+        action = "新增" if chapter["previous"] is None else "重新生成"
+        logger.info(f"\n{action}章节：{title} → {workspace}")
+        with log_context(stage="watch"):
+            result = self.run_chapter(config)
+        self.index["chapters"][title] = {
+            "digest": chapter["digest"],
+            "status": CHAPTER_DONE if result else CHAPTER_FAILED,
+            "workspace": workspace,
+            "updated_at": time.time(),
+        }
+        save_index(self.index_path, self.index)
+
+    def commit_index(self, stat: tuple) -> None:
+        self.index["novel_file"] = os.path.abspath(self.base_config.novel_file_path)
+        self.index["file_stat"] = list(stat)
+        os.makedirs(self.root, exist_ok=True)
+        save_index(self.index_path, self.index)
+
+
+def watch_novel(root: str, base_config: Optional[RunConfig] = None, run_chapter: Optional[Callable[[RunConfig], Optional[Dict[str, Any]]]] = None, stop_event: Optional[threading.Event] = None) -> None:
+    """
+    监听模式主循环
+
+    Args:
+        root: 监听输出根目录，包含章节索引、各章节输出目录与共享的人物写真
+        base_config: 基础运行配置（test_mode、max_scenes等）
+        run_chapter: 处理单个章节的函数，默认为create_workflow
+        stop_event: 停止信号
+    """
+    base_config = resolve_config(base_config)
+    if run_chapter is None:
+        from app.core.workflow import create_workflow
+        run_chapter = create_workflow
+    stop_event = stop_event or threading.Event()
+    watcher = NovelWatcher(root, base_config, run_chapter)
+    logger.info(f"开始监听 {base_config.novel_file_path}，每{base_config.watch_interval}秒检查一次，输出目录：{root}")
+
+    # 启动时立即检查一次，重试上次失败或中断的章节；这次检查失败时下一轮继续强制检查
+    force = True
+    while True:
+        try:
+            watcher.poll(force=force)
+            force = False
+        except Exception as e:
+            logger.error(f"检查小说更新失败：{e}", exc_info=True)
+        if stop_event.wait(base_config.watch_interval):
+            break
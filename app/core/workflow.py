@@ -1,25 +1,80 @@
 import os
 import json
+import threading
 import traceback
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from typing import Dict, List, Optional, Any
-from app.config import Config
-from app.utils.logger import setup_logger
-from app.utils.file_ops import load_novel, image_to_base64
-from app.utils.video_ops import merge_videos, get_media_duration, merge_video_audio
-from app.services.llm import generate_voice_script, generate_image_prompt
-from app.services.media import generate_image, generate_single_video
-from app.core.character import generate_character_portrait_workflow 
+from app.config import RunConfig, resolve_config
+from app.utils.logger import setup_logger, payload, log_context
+from app.utils.hedging import log_hedge_stats
+from app.utils.credentials import get_video_capacity, log_credential_stats
+from app.utils.budget import start_run_budget, end_run_budget, get_run_budget, budget_exhausted, log_run_spend
+from app.utils.file_ops import load_novel, image_to_base64, atomic_output
+from app.utils.video_ops import merge_videos, get_audio_duration, merge_video_audio, ProgressiveAssembler
+from app.utils.media_store import get_media_store, media_key, file_digest
+from app.utils.quality import quality_gate_enabled, check_frame, frames_too_similar, probe_clip
+from app.services.llm import generate_voice_script, generate_image_prompt, generate_image_prompts
+from app.services.media import generate_checked_image, load_frame_prompt
+from app.services.tts import synthesize_voice_script
+from app.core.character import generate_character_portrait_workflow, resolve_character_identities
+from app.core.clip_planner import plan_scene_clips, FIT_PAD
+from app.core.scene_video import generate_scene_video_workflow
+from app.core.scheduler import estimate_makespan, fit_to_limits, scene_admission
 logger = setup_logger(__name__)
 
-def generate_single_image_workflow(scene_id: str, scene_content: str, image_dir: str, characters: List[str] = None) -> Dict[str, Any]:
-    """生成单个场景的图片（首尾帧）"""
+def scene_frame_keys(scene_content: str, characters: List[str], config: RunConfig) -> Any:
+    """场景首尾帧的媒体库键：由场景内容、人物写真与文生图模型决定"""
+    refs = [file_digest(os.path.join(config.character_dir, f"{c}.png")) for c in characters or []]
+    return tuple(
+        media_key("scene_frame", model=config.image_model, content=scene_content, refs=refs, frame=frame)
+        for frame in ("start", "end")
+    )
+
+def restore_scene_frames(scene_id: str, scene_content: str, characters: List[str], image_dir: str, config: RunConfig) -> bool:
+    """从媒体库恢复场景首尾帧，两帧均命中时返回True"""
+    store = get_media_store(config)
+    if store is None:
+        return False
+    start_key, end_key = scene_frame_keys(scene_content, characters, config)
+    return store.fetch(start_key, os.path.join(image_dir, f"{scene_id}_start.jpeg")) and \
+        store.fetch(end_key, os.path.join(image_dir, f"{scene_id}_end.jpeg"))
+
+def save_scene_frames(scene_id: str, scene_content: str, characters: List[str], image_dir: str, config: RunConfig) -> None:
+    """将新生成的场景首尾帧收入媒体库"""
+    store = get_media_store(config)
+    if store is None:
+        return
+    start_key, end_key = scene_frame_keys(scene_content, characters, config)
+    store.save(start_key, os.path.join(image_dir, f"{scene_id}_start.jpeg"))
+    store.save(end_key, os.path.join(image_dir, f"{scene_id}_end.jpeg"))
+
+def regenerate_similar_end_frame(scene_id: str, image_prompt_end: str, save_path_start: str, save_path_end: str, characters: List[str], config: RunConfig) -> Optional[str]:
+    """首尾帧几乎相同时重新生成结束帧（最多quality_max_retries次），返回新的结束帧URL，未重新生成时返回None"""
+    if not quality_gate_enabled(config):
+        return None
+    image_url_end = None
+    for attempt in range(config.quality_max_retries):
+        if not frames_too_similar(save_path_start, save_path_end, config):
+            return image_url_end
+        logger.warning(f"场景 {scene_id} 首尾帧过于相似，重新生成结束帧（{attempt + 1}/{config.quality_max_retries}）")
+        image_url_end = generate_checked_image(image_prompt_end, save_path_end, characters=characters, config=config)
+        if image_url_end.startswith("生成图片失败"):
+            raise Exception(f"End Frame error: {image_url_end}")
+    if frames_too_similar(save_path_start, save_path_end, config):
+        logger.warning(f"场景 {scene_id} 首尾帧仍过于相似，继续使用当前结束帧")
+    return image_url_end
+
+def generate_single_image_workflow(scene_id: str, scene_content: str, image_dir: str, characters: List[str] = None, prompts: Dict[str, str] = None, config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """生成单个场景的图片（首尾帧），prompts为批量生成的首尾帧提示词，未提供时单独生成"""
+    config = resolve_config(config)
     logger.info(f"生成场景 {scene_id} 的图像...")
-    logger.debug(f"生成图像的场景描述：{scene_content}")
+    logger.debug("生成图像的场景描述：%s", payload(scene_content))
     logger.debug(f"场景中的人物：{characters}")
     
     try:
         # 生成文生图提示词（包含首尾帧）
-        prompts = generate_image_prompt(scene_content)
+        prompts = prompts or generate_image_prompt(scene_content, config=config)
         # Check for error
         if "start_frame" in prompts and prompts["start_frame"].startswith("生成失败"):
              raise Exception(prompts["start_frame"])
@@ -27,12 +82,12 @@ def generate_single_image_workflow(scene_id: str, scene_content: str, image_dir:
         image_prompt_start = prompts.get("start_frame")
         image_prompt_end = prompts.get("end_frame")
         
-        logger.debug(f"场景 {scene_id} Start Prompt: {image_prompt_start}")
-        logger.debug(f"场景 {scene_id} End Prompt: {image_prompt_end}")
+        logger.debug("场景 %s Start Prompt: %s", scene_id, payload(image_prompt_start))
+        logger.debug("场景 %s End Prompt: %s", scene_id, payload(image_prompt_end))
         
         # 1. 生成 Start Frame
         save_path_start = os.path.join(image_dir, f"{scene_id}_start.jpeg")
-        image_url_start = generate_image(image_prompt_start, save_path=save_path_start, characters=characters)
+        image_url_start = generate_checked_image(image_prompt_start, save_path_start, characters=characters, config=config)
         if image_url_start.startswith("生成图片失败"):
              raise Exception(f"Start Frame error: {image_url_start}")
         image_base64_start = image_to_base64(save_path_start)
@@ -40,11 +95,13 @@ def generate_single_image_workflow(scene_id: str, scene_content: str, image_dir:
 
         # 2. 生成 End Frame
         save_path_end = os.path.join(image_dir, f"{scene_id}_end.jpeg")
-        image_url_end = generate_image(image_prompt_end, save_path=save_path_end, characters=characters)
+        image_url_end = generate_checked_image(image_prompt_end, save_path_end, characters=characters, config=config)
         if image_url_end.startswith("生成图片失败"):
              raise Exception(f"End Frame error: {image_url_end}")
+        image_url_end = regenerate_similar_end_frame(scene_id, image_prompt_end, save_path_start, save_path_end, characters, config) or image_url_end
         image_base64_end = image_to_base64(save_path_end)
         logger.info(f"End Frame saved to {save_path_end}")
+        save_scene_frames(scene_id, scene_content, characters, image_dir, config)
         
         return {
             "scene_id": scene_id,
@@ -62,193 +119,402 @@ def generate_single_image_workflow(scene_id: str, scene_content: str, image_dir:
         logger.error(f"生成场景 {scene_id} 的图像失败: {e}")
         raise
 
-def create_workflow() -> Optional[Dict[str, Any]]:
-    """手动编排工作流"""
+class WorkflowCancelled(Exception):
+    """工作流被取消（服务模式下的取消请求）"""
+
+def check_cancelled(cancel_event: Optional[threading.Event]) -> None:
+    """在阶段/场景之间检查取消请求，已取消时抛出WorkflowCancelled"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise WorkflowCancelled("任务已取消")
+
+def load_chapter(config: RunConfig) -> Any:
+    """加载小说并返回(章节标题, 章节内容)，未找到章节时抛出异常"""
+    logger.info(f"1. 加载{config.novel_file_path}...")
+    chapters = load_novel(config.novel_file_path)
+    
+    chapter_title = config.target_chapter
+    if chapter_title not in chapters:
+        logger.error(f"未找到章节：{chapter_title}")
+        raise Exception(f"未找到章节：{chapter_title}")
+    
+    logger.info(f"已加载{chapter_title}")
+    return chapter_title, chapters[chapter_title]
+
+def get_script_file(config: RunConfig) -> str:
+    """口播文案文件路径"""
+    return os.path.join(config.history_dir, "voice_script.json")
+
+def load_voice_script(config: RunConfig) -> Optional[Dict[str, Any]]:
+    """加载已有的口播文案，不存在或无法解析时返回None"""
+    script_file = get_script_file(config)
+    os.makedirs(config.history_dir, exist_ok=True)
+    if os.path.exists(script_file):
+        logger.info(f"发现已有文案文件 {script_file}，直接加载...")
+        try:
+            with open(script_file, 'r', encoding='utf-8') as f:
+                voice_script = json.load(f)
+            logger.info(f"成功加载{len(voice_script)}段口播文案")
+            return voice_script
+        except Exception as e:
+            logger.warning(f"加载文案文件失败: {e}，将重新生成")
+    return None
+
+def parse_and_save_voice_script(voice_script_str: str, config: RunConfig) -> Optional[Dict[str, Any]]:
+    """解析生成的JSON格式文案并保存，解析失败返回None"""
     try:
-        TEST_MODE = Config.TEST_MODE
-        MAX_SCENES = Config.MAX_SCENES
-        
-        logger.info(f"1. 加载{Config.NOVEL_FILE_PATH}...")
-        chapters = load_novel(Config.NOVEL_FILE_PATH)
-        
-        chapter_title = Config.TARGET_CHAPTER
-        if chapter_title not in chapters:
-            logger.error(f"未找到章节：{chapter_title}")
-            raise Exception(f"未找到章节：{chapter_title}")
-        
-        chapter_content = chapters[chapter_title]
-        logger.info(f"已加载{chapter_title}")
+        voice_script = json.loads(voice_script_str)
+        logger.info(f"生成了{len(voice_script)}段口播文案")
+        # 保存文案
+        with atomic_output(get_script_file(config)) as tmp_path, open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(voice_script, f, ensure_ascii=False, indent=2)
+        return voice_script
+    except json.JSONDecodeError:
+        logger.warning(f"生成的文案不是标准JSON格式，无法进行多场景生成")
+        logger.debug("文案内容：%s", payload(voice_script_str, limit=100))
+        return None
+
+def get_scene_count(voice_script: Dict[str, Any], config: RunConfig) -> int:
+    """确定要生成的场景数量"""
+    scene_count = len(voice_script)
+    if config.test_mode:
+        scene_count = min(scene_count, config.max_scenes)
+        logger.info(f"测试模式：仅生成前{scene_count}个场景的视频")
+    return scene_count
+
+def collect_characters(voice_script: Dict[str, Any]) -> List[str]:
+    """从口播文案中收集所有人物（按首次出现顺序去重）"""
+    all_characters: Dict[str, None] = {}
+    for scene_id, scene_data in voice_script.items():
+        if isinstance(scene_data, dict) and "character" in scene_data:
+            characters = scene_data["character"]
+            if isinstance(characters, list):
+                all_characters.update(dict.fromkeys(characters))
+    logger.info(f"从口播文案中提取到{len(all_characters)}个唯一人物：{', '.join(all_characters)}")
+    return list(all_characters)
+
+def load_existing_image_result(scene_id: str, voice_script: Dict[str, Any], image_dir: str, config: Optional[RunConfig] = None) -> Optional[Dict[str, Any]]:
+    """首尾帧均已存在且通过质量检查时返回断点续传用的图片信息，否则返回None"""
+    config = resolve_config(config)
+    save_path_start = os.path.join(image_dir, f"{scene_id}_start.jpeg")
+    save_path_end = os.path.join(image_dir, f"{scene_id}_end.jpeg")
+    if not (os.path.exists(save_path_start) and os.path.exists(save_path_end)):
+        return None
+    if quality_gate_enabled(config):
+        for path in (save_path_start, save_path_end):
+            problem = check_frame(path, config)
+            if problem:
+                logger.warning(f"场景 {scene_id} 已有图片 {path} 未通过质量检查：{problem}，重新生成")
+                return None
+    logger.info(f"场景 {scene_id} 图片(Start/End)已存在，跳过生成")
+    return {
+        "scene_id": scene_id,
+        "scene_content": voice_script[scene_id]['content'],
+        "image_path_start": save_path_start,
+        "image_url_start": None, # Should define/load if needed, but not critical for resume unless needed for video gen url
+        "image_base64_start": image_to_base64(save_path_start), # Load base64 for video gen context
+        "image_prompt_start": load_frame_prompt(save_path_start) or "",  # 无记录时为空，视频提示词改用首尾帧图片生成
+        "image_path_end": save_path_end,
+        "image_url_end": None,
+        "image_base64_end": image_to_base64(save_path_end),
+        "image_prompt_end": load_frame_prompt(save_path_end) or ""
+    }
+
+def get_scene_audio_duration(scene_id: str, config: RunConfig) -> Optional[float]:
+    """获取场景配音时长，无音频或读取失败返回None"""
+    audio_path = os.path.join(config.voice_dir, f"{scene_id}.wav")
+    if not os.path.exists(audio_path):
+        return None
+    logger.info(f"发现场景 {scene_id} 的音频文件：{audio_path}")
+    audio_duration = get_audio_duration(audio_path)
+    if audio_duration > 0:
+        logger.info(f"场景 {scene_id} 音频时长：{audio_duration}s")
+        return audio_duration
+    logger.warning(f"场景 {scene_id} 音频时长获取失败或为0")
+    return None
+
+def start_voice_synthesis(voice_script: Dict[str, Any], scene_ids: List[str], config: RunConfig) -> Future:
+    """在后台并发合成各场景配音（与人物写真、场景图片并行），返回结果为{scene_id: 音频时长}的Future"""
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+    future = executor.submit(contextvars.copy_context().run, synthesize_voice_script, voice_script, scene_ids, config)
+    executor.shutdown(wait=False)
+    return future
+
+def existing_video_result(scene_id: str, video_dir: str, config: Optional[RunConfig] = None) -> Optional[Dict[str, Any]]:
+    """场景视频已存在且可完整解码时返回断点续传用的视频信息"""
+    config = resolve_config(config)
+    video_path = os.path.join(video_dir, f"{scene_id}.mp4")
+    # 下载时直接合并配音的场景只保留合并后的视频
+    existing_path = video_path if os.path.exists(video_path) else os.path.join(video_dir, f"{scene_id}_voice.mp4")
+    if os.path.exists(existing_path):
+        problem = probe_clip(existing_path, config) if quality_gate_enabled(config) else None
+        if problem:
+            logger.warning(f"场景 {scene_id} 已有视频未通过检查：{problem}，重新生成")
+            return None
+        logger.info(f"场景 {scene_id} 视频已存在，跳过生成")
+        return {
+            "scene_id": scene_id,
+            "video_url": None,
+            "video_path": video_path
+        }
+    return None
+
+def plan_video_stage(pending: List[Any], config: RunConfig) -> List[Dict[str, Any]]:
+    """根据各场景的子片段规划确定LPT提交顺序并记录预计耗时，设置了预算或截止时间时先降级或放弃超出的场景"""
+    plans, _ = fit_to_limits([plan for _, plan in pending], get_run_budget(), config)
+    if plans:
+        fifo_makespan = estimate_makespan([plan for _, plan in pending], get_video_capacity(config), config)
+        lpt_makespan = estimate_makespan(plans, get_video_capacity(config), config)
+        logger.info(f"视频提交顺序(LPT)：{', '.join(p['scene_id'] for p in plans)}")
+        logger.info(f"预计视频阶段耗时：LPT {lpt_makespan:.0f}s，顺序提交 {fifo_makespan:.0f}s")
+    return plans
+
+def mux_scene_audio(scene_id: str, config: RunConfig) -> Optional[str]:
+    """合并场景视频与配音，返回合并后的视频路径"""
+    video_path = os.path.join(config.video_dir, f"{scene_id}.mp4")
+    audio_path = os.path.join(config.voice_dir, f"{scene_id}.wav")
+    output_path = os.path.join(config.video_dir, f"{scene_id}_voice.mp4")
+    
+    if os.path.exists(output_path):
+        logger.info(f"场景 {scene_id} 合并后的视频已存在，跳过合并")
+        return output_path
+    
+    if os.path.exists(video_path) and os.path.exists(audio_path):
+        # 短场景音频不足最小帧数时补齐静音
+        plan = plan_scene_clips(scene_id, get_audio_duration(audio_path), config)
+        pad_audio = plan["fit"] == FIT_PAD
+        store = get_media_store(config)
+        key = media_key("voice_mux", video=file_digest(video_path), audio=file_digest(audio_path), pad=pad_audio)
+        if store and store.fetch(key, output_path):
+            return output_path
+        logger.info(f"正在合并场景 {scene_id} 的视频与音频...")
+        if merge_video_audio(video_path, audio_path, output_path, pad_audio=pad_audio):
+            if store:
+                store.save(key, output_path)
+            return output_path
+    return None
+
+def prepare_portrait(character_name: str, config: RunConfig) -> Optional[Dict[str, Any]]:
+    """
+    检查人物写真是否需要生成，同步与异步工作流共用
+
+    写真已存在或可从媒体库恢复时返回None，否则返回生成后存入媒体库所需的信息。
+    """
+    portrait_path = os.path.join(config.character_dir, f"{character_name}.png")
+    if os.path.exists(portrait_path):
+        logger.info(f"人物{character_name}的写真已存在，跳过生成")
+        return None
+    # 同一部小说中的同名人物在各章节共用写真
+    store = get_media_store(config)
+    key = media_key("portrait", model=config.image_model, novel=file_digest(config.novel_file_path), name=character_name)
+    if store and store.fetch(key, portrait_path):
+        return None
+    return {"name": character_name, "path": portrait_path, "store": store, "key": key}
+
+def finish_portrait(portrait: Dict[str, Any], result: Optional[str]) -> None:
+    """记录写真生成结果，成功时存入媒体库"""
+    if not result:
+        logger.error(f"人物{portrait['name']}的写真生成失败")
+        return
+    logger.info(f"人物{portrait['name']}的写真生成成功，保存至：{result}")
+    if portrait["store"]:
+        portrait["store"].save(portrait["key"], portrait["path"])
+
+def generate_portrait(character_name: str, chapter_content: str, config: RunConfig) -> None:
+    """生成单个人物的写真，已存在或可从媒体库恢复时跳过"""
+    portrait = prepare_portrait(character_name, config)
+    if portrait is None:
+        return
+
+    logger.info(f"正在生成人物{character_name}的写真...")
+    try:
+        with log_context(stage="portrait"):
+            result = generate_character_portrait_workflow(chapter_content, character_name, config=config)
+        finish_portrait(portrait, result)
+    except Exception as e:
+        logger.error(f"生成人物{character_name}的写真时出错：{e}")
+
+def generate_portraits(voice_script: Dict[str, Any], chapter_content: str, config: RunConfig, cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """
+    归并人物称呼后并发生成文案中所有人物的写真，已存在的跳过
+
+    直接修改并返回voice_script，各场景的人物替换为规范名以引用对应的写真。
+    """
+    with log_context(stage="portrait"):
+        voice_script = resolve_character_identities(voice_script, chapter_content, config)
+    all_characters = collect_characters(voice_script)
+    os.makedirs(config.character_dir, exist_ok=True)
+    check_cancelled(cancel_event)
+
+    def run(character_name: str) -> None:
+        if cancel_event is None or not cancel_event.is_set():
+            generate_portrait(character_name, chapter_content, config)
+
+    # 写真之间互不依赖，阶段耗时约为单张写真的耗时
+    with ThreadPoolExecutor(max_workers=max(1, config.portrait_concurrency)) as executor:
+        list(executor.map(lambda name: contextvars.copy_context().run(run, name), all_characters))
+    check_cancelled(cancel_event)
+    return voice_script
+
+def create_preview(image_results: List[Dict[str, Any]], chapter_title: str, config: RunConfig) -> ProgressiveAssembler:
+    """创建按场景顺序排列的渐进式预览"""
+    scene_ids = sorted((r["scene_id"] for r in image_results), key=int)
+    assembler = ProgressiveAssembler(config.preview_dir, scene_ids, title=chapter_title, hls_js=config.preview_hls_js)
+    logger.info(f"渐进式预览：{os.path.join(config.preview_dir, ProgressiveAssembler.PAGE_NAME)}")
+    return assembler
+
+def publish_scene(scene_id: str, assembler: ProgressiveAssembler, config: RunConfig) -> Optional[str]:
+    """合并场景配音后立即加入预览播放列表"""
+    output_path = mux_scene_audio(scene_id, config)
+    if output_path:
+        assembler.add_scene(scene_id, output_path)
+    return output_path
+
+def collect_media_garbage(config: RunConfig) -> None:
+    """运行结束后按预算回收媒体库中无引用的对象"""
+    store = get_media_store(config)
+    if store is not None:
+        store.gc()
+
+def merge_scene_videos(video_results: List[Dict[str, Any]], config: RunConfig) -> str:
+    """按场景顺序合并所有已配音的场景视频"""
+    video_paths = sorted(
+        [result["video_path"].replace(".mp4", "_voice.mp4") for result in video_results if os.path.exists(result["video_path"].replace(".mp4", "_voice.mp4"))],
+        key=lambda x: int(os.path.basename(x).split('_')[0])
+    )
+    
+    merge_result = merge_videos(video_paths, config.merged_video_path)
+    logger.info(f"{merge_result}")
+    return config.merged_video_path
+
+def create_workflow(config: Optional[RunConfig] = None, cancel_event: Optional[threading.Event] = None) -> Optional[Dict[str, Any]]:
+    """
+    手动编排工作流
+
+    Args:
+        config: 本次运行的配置，包含目标章节、输出目录与服务商设置，默认使用Config中的默认值
+        cancel_event: 取消信号，置位后在下一个阶段/场景边界停止（已提交的即梦任务会执行完当前子片段）
+    """
+    config = resolve_config(config)
+    # 记录本次运行各调用的费用，设置了预算或截止时间时据此降级或放弃场景
+    budget_token = start_run_budget(config)
+    try:
+        chapter_title, chapter_content = load_chapter(config)
         
         logger.info("\n2. 生成口播文案...")
-        script_file = os.path.join("history", "voice_script.json")
-        os.makedirs("history", exist_ok=True)
-        
-        voice_script = None
-        if os.path.exists(script_file):
-            logger.info(f"发现已有文案文件 {script_file}，直接加载...")
-            try:
-                with open(script_file, 'r', encoding='utf-8') as f:
-                    voice_script = json.load(f)
-                logger.info(f"成功加载{len(voice_script)}段口播文案")
-            except Exception as e:
-                logger.warning(f"加载文案文件失败: {e}，将重新生成")
-        
+        voice_script = load_voice_script(config)
         if not voice_script:
-            voice_script_str = generate_voice_script(chapter_content)
-            
-            # 解析生成的JSON格式文案
-            try:
-                voice_script = json.loads(voice_script_str)
-                logger.info(f"生成了{len(voice_script)}段口播文案")
-                # 保存文案
-                with open(script_file, 'w', encoding='utf-8') as f:
-                    json.dump(voice_script, f, ensure_ascii=False, indent=2)
-            except json.JSONDecodeError:
-                logger.warning(f"生成的文案不是标准JSON格式，无法进行多场景生成")
-                logger.debug(f"文案内容：{voice_script_str[:100]}...")
+            with log_context(stage="script"):
+                voice_script_str = generate_voice_script(chapter_content, config=config)
+            voice_script = parse_and_save_voice_script(voice_script_str, config)
+            if not voice_script:
                 return None
         
-        # 确定要生成的场景数量
-        scene_count = len(voice_script)
-        if TEST_MODE:
-            scene_count = min(scene_count, MAX_SCENES)
-            logger.info(f"测试模式：仅生成前{scene_count}个场景的视频")
+        scene_count = get_scene_count(voice_script, config)
+        voice_synthesis = start_voice_synthesis(voice_script, [str(i) for i in range(1, scene_count + 1) if str(i) in voice_script], config)
+        check_cancelled(cancel_event)
         
         # 3. 生成所有小说人物的写真
         logger.info("\n3. 生成小说人物写真...")
-        all_characters = set()
-        for scene_id, scene_data in voice_script.items():
-            if isinstance(scene_data, dict) and "character" in scene_data:
-                characters = scene_data["character"]
-                if isinstance(characters, list):
-                    all_characters.update(characters)
-        
-        logger.info(f"从口播文案中提取到{len(all_characters)}个唯一人物：{', '.join(all_characters)}")
-        
-        # 生成每个人物的写真
-        os.makedirs(Config.CHARACTER_DIR, exist_ok=True)
-        for character_name in all_characters:
-            portrait_path = os.path.join(Config.CHARACTER_DIR, f"{character_name}.png")
-            if os.path.exists(portrait_path):
-                logger.info(f"人物{character_name}的写真已存在，跳过生成")
-                continue
-            
-            logger.info(f"正在生成人物{character_name}的写真...")
-            try:
-                result = generate_character_portrait_workflow(chapter_content, character_name)
-                if result:
-                    logger.info(f"人物{character_name}的写真生成成功，保存至：{result}")
-                else:
-                    logger.error(f"人物{character_name}的写真生成失败")
-            except Exception as e:
-                logger.error(f"生成人物{character_name}的写真时出错：{e}")
+        voice_script = generate_portraits(voice_script, chapter_content, config, cancel_event)
         
         logger.info("\n4. 根据文案生成图片...")
-        image_dir = Config.IMAGE_DIR
+        image_dir = config.image_dir
         os.makedirs(image_dir, exist_ok=True)
         
         image_results: List[Dict[str, Any]] = []
+        pending_scenes: Dict[str, str] = {}
         for i in range(1, scene_count + 1):
             scene_id = str(i)
-            # 检查图片是否存在
-            # 检查图片是否存在 (Start and End)
-            # 检查图片是否存在 (Start and End)
-            save_path_start = os.path.join(image_dir, f"{scene_id}_start.jpeg")
-            save_path_end = os.path.join(image_dir, f"{scene_id}_end.jpeg")
-            
-            if os.path.exists(save_path_start) and os.path.exists(save_path_end):
-                logger.info(f"场景 {scene_id} 图片(Start/End)已存在，跳过生成")
-                if scene_id in voice_script:
-                    image_results.append({
-                        "scene_id": scene_id,
-                        "scene_content": voice_script[scene_id]['content'],
-                        "image_path_start": save_path_start,
-                        "image_url_start": None, # Should define/load if needed, but not critical for resume unless needed for video gen url
-                        "image_base64_start": image_to_base64(save_path_start), # Load base64 for video gen context
-                        "image_prompt_start": "Loaded from file",
-                        "image_path_end": save_path_end,
-                        "image_url_end": None,
-                        "image_base64_end": image_to_base64(save_path_end),
-                        "image_prompt_end": "Loaded from file"
-                    })
+            if scene_id not in voice_script:
+                continue
+            # 检查图片是否存在 (Start and End)，不存在时尝试从媒体库恢复
+            restore_scene_frames(scene_id, voice_script[scene_id]['content'], voice_script[scene_id].get('character', []), image_dir, config)
+            existing = load_existing_image_result(scene_id, voice_script, image_dir, config)
+            if existing:
+                image_results.append(existing)
                 continue
+            pending_scenes[scene_id] = voice_script[scene_id]['content']
 
-            if scene_id in voice_script:
-                scene_content = voice_script[scene_id]['content']
-                scene_characters = voice_script[scene_id].get('character', [])
-                try:
-                    image_result = generate_single_image_workflow(scene_id, scene_content, image_dir, characters=scene_characters)
-                    image_results.append(image_result)
-                except Exception as e:
-                    logger.error(f"场景 {scene_id} 图片生成跳过 due to error")
+        # 所有待生成场景的首尾帧提示词分批一次生成，共享章节上下文
+        with log_context(stage="image"):
+            scene_prompts = generate_image_prompts(pending_scenes, config=config) if pending_scenes else {}
+
+        for scene_id, scene_content in pending_scenes.items():
+            check_cancelled(cancel_event)
+            if budget_exhausted():
+                logger.warning(f"预算已用完或已超过截止时间，不再生成场景 {scene_id} 及之后的图片")
+                break
+            scene_characters = voice_script[scene_id].get('character', [])
+            try:
+                with log_context(scene_id=scene_id, stage="image"):
+                    image_result = generate_single_image_workflow(scene_id, scene_content, image_dir, characters=scene_characters, prompts=scene_prompts.get(scene_id), config=config)
+                image_results.append(image_result)
+            except Exception as e:
+                logger.error(f"场景 {scene_id} 图片生成跳过 due to error")
         
         logger.info(f"成功生成了{len(image_results)}张图片")
         
         logger.info("\n5. 根据图片和文案生成视频...")
-        video_dir = Config.VIDEO_DIR
+        video_dir = config.video_dir
         os.makedirs(video_dir, exist_ok=True)
         
         video_results: List[Dict[str, Any]] = []
+        assembler = create_preview(image_results, chapter_title, config)
+        # 先根据音频时长规划所有场景，再按LPT顺序提交
+        voice_durations = voice_synthesis.result()
+        pending = []
         for scene_info in image_results:
             # 检查视频是否存在
             scene_id = scene_info["scene_id"]
-            video_path = os.path.join(video_dir, f"{scene_id}.mp4")
-            if os.path.exists(video_path):
-                logger.info(f"场景 {scene_id} 视频已存在，跳过生成")
-                video_results.append({
-                    "scene_id": scene_id,
-                    "video_url": None,
-                    "video_path": video_path
-                })
+            existing = existing_video_result(scene_id, video_dir, config)
+            if existing:
+                video_results.append(existing)
+                publish_scene(scene_id, assembler, config)
                 continue
-                
-            try:
-                # Calculate Duration
-                audio_path = os.path.join("voice", f"{scene_id}.wav")
-                video_duration = None
-                if os.path.exists(audio_path):
-                     logger.info(f"发现场景 {scene_id} 的音频文件：{audio_path}")
-                     audio_duration = get_media_duration(audio_path)
-                     if audio_duration > 0:
-                         video_duration = min(audio_duration, 13.0)
-                         logger.info(f"场景 {scene_id} 音频时长：{audio_duration}s，设置视频时长：{video_duration}s")
-                     else:
-                         logger.warning(f"场景 {scene_id} 音频时长获取失败或为0")
-                
-                video_result = generate_single_video(scene_info, video_dir, duration=video_duration)
-                video_results.append(video_result)
-            except Exception as e:
-                logger.error(f"场景 {scene_info.get('scene_id')} 视频生成失败: {e}")
+            audio_duration = voice_durations.get(scene_id) or get_scene_audio_duration(scene_id, config)
+            pending.append((scene_info, plan_scene_clips(scene_id, audio_duration, config)))
+
+        plans = plan_video_stage(pending, config)
+        scene_infos = {scene_info["scene_id"]: scene_info for scene_info, _ in pending}
+
+        def run_scene(plan: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            check_cancelled(cancel_event)
+            scene_id = plan["scene_id"]
+            scene_characters = voice_script.get(scene_id, {}).get('character', [])
+            with log_context(scene_id=scene_id, stage="video"), scene_admission(plan, config) as plan:
+                if plan is None:
+                    return None
+                result = generate_scene_video_workflow(scene_infos[scene_id], video_dir, audio_duration=plan["audio_duration"], characters=scene_characters, plan=plan, config=config)
+                # 场景完成即配音并加入预览，无需等待最慢的场景
+                publish_scene(scene_id, assembler, config)
+                return result
+
+        # 线程池按提交顺序取任务，即梦并发由media中的槽位统一限制
+        with ThreadPoolExecutor(max_workers=get_video_capacity(config)) as executor:
+            futures = {executor.submit(contextvars.copy_context().run, run_scene, plan): plan["scene_id"] for plan in plans}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                    if result:
+                        video_results.append(result)
+                except Exception as e:
+                    logger.error(f"场景 {futures[future]} 视频生成失败: {e}")
         
         logger.info(f"成功生成了{len(video_results)}个视频")
+        check_cancelled(cancel_event)
 
         logger.info("合并视频与音频")
-
-        scene_count = len(video_results)
-        for i in range(1, scene_count + 1):
-            scene_id = str(i)
-            video_path = os.path.join(video_dir, f"{scene_id}.mp4")
-            audio_path = os.path.join("voice", f"{scene_id}.wav")
-            output_path = os.path.join(video_dir, f"{scene_id}_voice.mp4")
-            
-            if os.path.exists(output_path):
-                logger.info(f"场景 {scene_id} 合并后的视频已存在，跳过合并")
-                continue
-            
-            if os.path.exists(video_path) and os.path.exists(audio_path):
-                logger.info(f"正在合并场景 {scene_id} 的视频与音频...")
-                merge_video_audio(video_path, audio_path, output_path)
+        for result in video_results:
+            mux_scene_audio(result["scene_id"], config)  # 已在场景完成时合并的会直接跳过
+        assembler.finish()
         
         logger.info("\n6. 合并所有生成的视频...")
-        video_paths = sorted(
-            [result["video_path"].replace(".mp4", "_voice.mp4") for result in video_results if os.path.exists(result["video_path"].replace(".mp4", "_voice.mp4"))],
-            key=lambda x: int(os.path.basename(x).split('_')[0])
-        )
-        
-        merged_video_path = Config.MERGED_VIDEO_PATH
-        merge_result = merge_videos(video_paths, merged_video_path)
-        logger.info(f"{merge_result}")
+        merged_video_path = merge_scene_videos(video_results, config)
+        collect_media_garbage(config)
         
+        log_hedge_stats()
+        log_credential_stats()
+        log_run_spend()
         logger.info("\n✅ 任务完成！")
         return {
             "voice_script": voice_script,
@@ -257,7 +523,12 @@ def create_workflow() -> Optional[Dict[str, Any]]:
             "merged_video_path": merged_video_path
         }
         
+    except WorkflowCancelled:
+        logger.warning("\n⏹ 任务已取消")
+        return None
     except Exception as e:
         logger.error(f"\n❌ 任务失败：{e}")
         logger.debug(traceback.format_exc())
         return None
+    finally:
+        end_run_budget(budget_token)
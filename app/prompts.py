@@ -48,6 +48,24 @@ PORTAL_PROMPT = """
 ```
 """
 
+# 长章节分块生成口播文案：单块分段草稿（在口播文案规则基础上覆盖段落结构）
+VOICE_DRAFT_PROMPT = PORTAL_PROMPT + """
+## 分段草稿模式（覆盖上述段落结构与数量要求）
+- 输入为章节中按原文顺序截取的一部分，不是完整章节；只根据这一部分生成草稿，不补写其前后的情节；
+- 按原文时间线生成请求中指定数量的顺叙段落，每段**45-60**字，不生成高潮切入与悬念过渡段落；
+- 人称转换、短句适配、对话处理、角色名字与敏感词替换规则不变；
+- 输出格式与上述示例相同，键从"1"开始连续编号。
+"""
+
+# 长章节分块生成口播文案：将各块草稿合并为完整文案
+VOICE_MERGE_PROMPT = PORTAL_PROMPT + """
+## 合并模式（以分段草稿代替【小说内容】）
+- 输入为按原文顺序排列的分段草稿，已完成人称转换与敏感词替换，各段文字视为原文；
+- 按上述段落结构生成**20段**文案：段落1从全部草稿中截取最具冲突性的短句，段落2简述冲突起因，段落3-20按顺序合并、精简相邻草稿，不得遗漏主要情节；
+- 只复用草稿中的文字，不新增草稿中没有的内容；`"character"`字段按合并后的`content`重新提取；
+- 输出格式与上述示例相同，键为"1"到"20"。
+"""
+
 # 文生图提示词生成提示词
 IMAGE_PROMPT = """
 # 角色
@@ -86,6 +104,20 @@ IMAGE_PROMPT = """
 ```
 """
 
+# 批量文生图提示词生成提示词（在单场景规则基础上一次处理多个场景）
+IMAGE_BATCH_PROMPT = IMAGE_PROMPT + """
+## 批量模式（覆盖上述单场景输出格式）
+- 输入为按场景编号排列的多个连续场景，需为**每个场景**分别生成`start_frame`和`end_frame`；
+- 相邻场景出现的同一人物，外貌与服饰描述保持一致；同一地点的场景，环境元素与色彩基调保持一致，保证全章画面连贯；
+- 输出必须为纯JSON，键为输入中的场景编号，值为包含`start_frame`和`end_frame`的对象，不得遗漏场景：
+```json
+{
+    "1": {"start_frame": "场景1起始帧提示词", "end_frame": "场景1结束帧提示词"},
+    "2": {"start_frame": "场景2起始帧提示词", "end_frame": "场景2结束帧提示词"}
+}
+```
+"""
+
 # 图生视频提示词生成提示词
 VIDEO_PROMPT = """
 # 角色
@@ -134,4 +166,41 @@ VIDEO_PROMPT = """
     "video_prompt": "Film grain, cinematic atmosphere, soft focus. 【光影色彩】极高饱和度的暖金光晕与深红阴影交错，色彩如油画般浓郁化开。 【主体动作】谢拾安的手臂带着自然的动态模糊划过画面，动作连贯流畅，最终轻轻落在闻星落头顶。 【环境细节】四周环境拥挤且热闹，背景中充满着无数模糊的光斑和飞舞的尘埃，窗外柳树的摇曳呈现出梦幻的虚焦效果，画面虽不锐利但视觉信息极其丰富。",
     "narration": "无需旁白"
 }
-"""
\ No newline at end of file
+"""
+# 中间关键帧提示词生成提示词
+KEYFRAME_PROMPT = """
+# 角色
+你是经验丰富的古风插画提示词工程师。当前场景的口播较长，需要拆分为多段视频依次播放，核心任务：在已知的【起始帧提示词】和【结束帧提示词】之间，补全指定数量的**中间关键帧**提示词，使整个场景的动作按时间顺序平滑演进。
+
+## 生成规则（强制执行）
+1. 中间关键帧按时间先后排列，动作/状态从起始帧逐步过渡到结束帧，相邻关键帧之间的变化幅度大致相同；
+2. 人物外貌、服饰、背景构图、光影基调、色彩饱和度、场景复杂度元素必须与首尾帧完全一致，仅动态描述部分不同；
+3. 每条提示词沿用首尾帧的结构：[主体描述]，[环境描述]，[服饰细节]，[氛围情感]，[风格指定]，[构图建议]，中文+英文关键词。
+
+## 输出要求
+- 输出必须为纯JSON格式，仅包含一个字段`keyframes`，其值为按时间顺序排列的提示词字符串数组，数组长度必须等于要求的数量。
+```json
+{
+    "keyframes": ["第1个中间关键帧提示词", "第2个中间关键帧提示词"]
+}
+```
+"""
+# 人物别名归并提示词
+CHARACTER_ALIAS_PROMPT = """
+# 角色
+你是严谨的小说人物关系分析助手。口播文案中同一个人物可能以全名、小名、称号、尊称或身份（如"少主"、"师父"）等不同称呼出现，核心任务：根据小说文本，判断给定的每个称呼指的是哪一个人物，并为其给出统一的规范名。
+
+## 判断规则（强制执行）
+1. 规范名优先使用人物的全名；已登记人物列表中的人物必须沿用列表中的名字作为规范名；
+2. 只有在小说文本能明确确认指向同一人物时才归并，无法确认的称呼以其自身作为规范名；
+3. 不同人物绝不能归并为同一个规范名，泛指的群体称呼（如"众人"、"士兵们"）以其自身作为规范名。
+
+## 输出要求
+- 输出必须为纯JSON格式，键为给定的每个称呼，值为该称呼对应的规范名，必须包含所有给定的称呼。
+```json
+{
+    "称呼1": "规范名",
+    "称呼2": "规范名"
+}
+```
+"""
@@ -0,0 +1,149 @@
+import re
+import json
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from app.config import Config, RunConfig
+from app.core.jobs import JobManager, TERMINAL_STATES
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 路由：POST /jobs、GET /jobs、GET /jobs/{id}、GET /jobs/{id}/events、
+#       POST /jobs/{id}/cancel、POST /jobs/{id}/priority
+JOB_PATH = re.compile(r"^/jobs/(?P<job_id>[0-9a-f]+)(?:/(?P<action>events|cancel|priority))?/?$")
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """作业服务的HTTP接口，请求与响应均为JSON，进度通过Server-Sent Events推送"""
+    manager: JobManager = None  # 由serve注入
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, body: Any) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        body = json.loads(self.rfile.read(length).decode("utf-8"))
+        if not isinstance(body, dict):
+            raise ValueError("请求体必须为JSON对象")
+        return body
+
+    def _match(self) -> Optional[re.Match]:
+        return JOB_PATH.match(self.path.split("?", 1)[0])
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/jobs":
+            self._send_json(HTTPStatus.OK, self.manager.store.list())
+            return
+        match = self._match()
+        if not match or match["action"] not in (None, "events"):
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        job = self.manager.store.get(match["job_id"])
+        if job is None:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "job not found"})
+        elif match["action"] == "events":
+            self._stream_events(match["job_id"])
+        else:
+            self._send_json(HTTPStatus.OK, job)
+
+    def do_POST(self) -> None:
+        try:
+            body = self._read_json()
+        except ValueError as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": f"invalid JSON: {e}"})
+            return
+
+        if self.path.split("?", 1)[0].rstrip("/") == "/jobs":
+            try:
+                job = self.manager.submit(body)
+            except ValueError as e:
+                self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                return
+            self._send_json(HTTPStatus.CREATED, job)
+            return
+        match = self._match()
+        if not match or match["action"] not in ("cancel", "priority"):
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        if match["action"] == "cancel":
+            job = self.manager.cancel(match["job_id"])
+        else:
+            try:
+                job = self.manager.set_priority(match["job_id"], int(body["priority"]))
+            except (KeyError, TypeError, ValueError):
+                self._send_json(HTTPStatus.BAD_REQUEST, {"error": "priority must be an integer"})
+                return
+        if job is None:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "job not found"})
+        else:
+            self._send_json(HTTPStatus.OK, job)
+
+    def _stream_events(self, job_id: str) -> None:
+        """推送作业事件直到作业结束，支持Last-Event-ID断线续传"""
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        last_id = int(self.headers.get("Last-Event-ID") or 0)
+        try:
+            while True:
+                events = self.manager.events.read(job_id, after=last_id, timeout=Config.SERVER_SSE_KEEPALIVE)
+                finished = False
+                if not events:
+                    job = self.manager.store.get(job_id)
+                    if job and job["status"] in TERMINAL_STATES:
+                        # 服务重启前已结束的作业没有内存事件，直接返回最终状态
+                        events = [{"id": last_id + 1, "event": "status", "data": {"status": job["status"], "error": job["error"]}}]
+                    else:
+                        self.wfile.write(b": keepalive\n\n")
+                for event in events:
+                    last_id = event["id"]
+                    data = json.dumps(event["data"], ensure_ascii=False)
+                    self.wfile.write(f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n".encode("utf-8"))
+                    finished = event["event"] == "status" and event["data"].get("status") in TERMINAL_STATES
+                self.wfile.flush()
+                if finished:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug(f"作业 {job_id} 的事件订阅已断开")
+
+
+def serve(host: str = Config.SERVER_HOST, port: int = Config.SERVER_PORT, workers: int = Config.SERVER_WORKERS, base_config: Optional[RunConfig] = None) -> None:
+    """
+    启动本地作业服务
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        workers: 并行执行作业的工作线程数
+        base_config: 作业的默认运行配置，作业参数在其基础上覆盖
+    """
+    manager = JobManager(Config.JOBS_DIR, workers=workers, base_config=base_config)
+    manager.start()
+    handler = type("BoundJobRequestHandler", (JobRequestHandler,), {"manager": manager})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    logger.info(f"作业服务已启动：http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("正在停止作业服务...")
+    finally:
+        server.server_close()
+        manager.stop()
@@ -1,133 +1,606 @@
+import re
 import json
-from typing import Any, Dict
-from langchain.chat_models import init_chat_model
-from app.config import Config
-from app.prompts import PORTAL_PROMPT, IMAGE_PROMPT, VIDEO_PROMPT
-from app.utils.logger import setup_logger
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from app.config import RunConfig, resolve_config, PROVIDER_LOCAL
+from app.prompts import PORTAL_PROMPT, VOICE_DRAFT_PROMPT, VOICE_MERGE_PROMPT, IMAGE_PROMPT, IMAGE_BATCH_PROMPT, VIDEO_PROMPT, KEYFRAME_PROMPT, CHARACTER_ALIAS_PROMPT
+from app.utils.logger import setup_logger, payload
+from app.utils.hedging import hedged_call, ahedged_call
+from app.utils.credentials import get_credential_pool, PROVIDER_LLM
+from app.utils.cassette import cassette_call, acassette_call, cassette_sleep, acassette_sleep
+from app.utils.file_ops import split_chapter
+from app.utils.budget import charge_llm
 
 logger = setup_logger(__name__)
 
-def initialize_chat_model() -> Any:
-    """初始化聊天模型"""
-    return init_chat_model(
-        model=Config.LLM_MODEL,
-        model_provider=Config.LLM_MODEL_PROVIDER,
-        api_key=Config.DASHSCOPE_API_KEY,
-        base_url=Config.LLM_BASE_URL
+# 按模型与凭证缓存聊天模型，同进程内的多个工作流共享底层连接池
+_chat_models: Dict[tuple, Any] = {}
+_chat_models_lock = threading.Lock()
+
+def initialize_chat_model(config: Optional[RunConfig] = None, api_key: Optional[str] = None) -> Any:
+    """初始化聊天模型，api_key为账号池分配的凭证，未传入时使用config.llm_api_key"""
+    config = resolve_config(config)
+    api_key = api_key or config.llm_api_key
+    key = (config.llm_model, config.llm_model_provider, api_key, config.llm_base_url)
+    with _chat_models_lock:
+        if key not in _chat_models:
+            # 延迟导入LangChain，避免命令行启动时的导入开销
+            from langchain.chat_models import init_chat_model
+            _chat_models[key] = init_chat_model(
+                model=config.llm_model,
+                model_provider=config.llm_model_provider,
+                api_key=api_key,
+                base_url=config.llm_base_url
+            )
+        return _chat_models[key]
+
+class LLMCall(NamedTuple):
+    """
+    一次LLM调用的描述
+
+    同步（invoke）与异步（ainvoke）版本共用同一份消息构建、结果解析与失败兜底逻辑。
+    """
+    name: str  # 调用名称，用于日志
+    messages: List[Dict[str, Any]]
+    parse: Callable[[str], Any]  # 解析模型返回的文本
+    fallback: Callable[[Exception], Any]  # 调用或解析失败时的返回值
+    offline: Optional[Callable[[], Any]] = None  # 离线模式下基于模板的确定性返回值
+    kind: str = "llm"  # 调用类型，同类调用共享耗时统计（用于请求对冲）
+
+def strip_json_fence(content: str) -> str:
+    """去除模型输出中包裹JSON的markdown代码块标记"""
+    content = content.strip()
+    if content.startswith('```json'): # Clean markdown
+        content = content[7:]
+    if content.endswith('```'):
+        content = content[:-3]
+    if content.strip().startswith('```'): # Handle implicit json block
+         content = content.replace('```', '')
+    return content
+
+def build_messages(system_prompt: str, request: Any, context: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    按"系统提示词 → 章节上下文 → 本次请求"的固定顺序组织消息
+
+    静态内容在前、每次调用不同的内容在最后，同一章节上的多次调用共享相同的消息前缀，
+    可命中服务端的前缀缓存。
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    if context:
+        messages.append({"role": "user", "content": context})
+    messages.append({"role": "user", "content": request})
+    return messages
+
+def apply_prompt_cache(messages: List[Dict[str, Any]], config: RunConfig) -> List[Dict[str, Any]]:
+    """
+    在最后一条前缀消息上标记显式缓存（DashScope OpenAI兼容接口的cache_control）
+
+    仅在开启缓存且模型位于llm_prompt_cache_models中时标记，不支持的模型可能拒绝带cache_control的请求。
+    """
+    if not config.llm_prompt_cache or config.llm_model not in config.llm_prompt_cache_models:
+        return messages
+    if len(messages) < 2 or not isinstance(messages[-2]["content"], str):
+        return messages
+    prefix_end = dict(messages[-2])
+    prefix_end["content"] = [{"type": "text", "text": prefix_end["content"], "cache_control": {"type": "ephemeral"}}]
+    return messages[:-2] + [prefix_end, messages[-1]]
+
+def log_token_usage(call: LLMCall, response: Any) -> None:
+    """记录单次调用的输入（缓存命中/未命中）与输出token数"""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    input_tokens = usage.get("input_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    logger.info(
+        f"{call.name} token用量：输入{input_tokens}（缓存命中{cached_tokens}，未命中{input_tokens - cached_tokens}），"
+        f"输出{usage.get('output_tokens', 0)}"
     )
 
-def generate_voice_script(chapter_content: str) -> str:
-    """根据小说的一个章节内容生成口播文案"""
+def encode_llm_response(response: Any) -> Dict[str, Any]:
+    """录制LLM响应中调用方使用的字段"""
+    return {"content": response.content, "usage_metadata": getattr(response, "usage_metadata", None)}
+
+def decode_llm_response(record: Dict[str, Any]) -> Any:
+    return SimpleNamespace(**record)
+
+def run_llm_call(call: LLMCall, config: Optional[RunConfig] = None) -> Any:
+    """同步执行LLM调用"""
+    config = resolve_config(config)
+    if config.provider == PROVIDER_LOCAL and call.offline:
+        logger.info(f"离线模式：{call.name}使用模板结果")
+        return call.offline()
     try:
-        logger.info("开始生成口播文案...")
-        logger.debug(f"输入的章节内容：{chapter_content[:100]}...")
-        
-        model = initialize_chat_model()
-        response = model.invoke([
-                {"role": "system", "content": PORTAL_PROMPT},
-                {"role": "user", "content": f"请根据以下章节内容生成口播文案：\n{chapter_content}"}
-        ])
-        
-        content = response.content.strip()
-        if content.startswith('```json'): # Clean markdown
-            content = content[7:]
-        if content.endswith('```'):
-            content = content[:-3]
-        if content.strip().startswith('```'): # Handle implicit json block
-             content = content.replace('```', '')
+        logger.info(f"开始{call.name}...")
+        messages = apply_prompt_cache(call.messages, config)
+
+        def invoke() -> Any:
+            with get_credential_pool(PROVIDER_LLM, config).lease(config) as account:
+                model = initialize_chat_model(config, account.secret)
+                return hedged_call(f"llm:{config.llm_model}:{call.kind}", lambda: model.invoke(messages), config)
 
+        request = {"model": config.llm_model, "messages": call.messages}
+        response = cassette_call("llm", request, invoke, encode_llm_response, decode_llm_response)
+        log_token_usage(call, response)
+        charge_llm(getattr(response, "usage_metadata", None), config)
+        result = call.parse(str(response.content))
+        logger.info(f"{call.name}成功！")
+        return result
+    except Exception as e:
+        return call.fallback(e)
+
+async def arun_llm_call(call: LLMCall, config: Optional[RunConfig] = None) -> Any:
+    """异步执行LLM调用"""
+    config = resolve_config(config)
+    if config.provider == PROVIDER_LOCAL and call.offline:
+        logger.info(f"离线模式：{call.name}使用模板结果")
+        return call.offline()
+    try:
+        logger.info(f"开始{call.name}...")
+        messages = apply_prompt_cache(call.messages, config)
+
+        async def invoke() -> Any:
+            with get_credential_pool(PROVIDER_LLM, config).lease(config) as account:
+                model = initialize_chat_model(config, account.secret)
+                return await ahedged_call(f"llm:{config.llm_model}:{call.kind}", lambda: model.ainvoke(messages), config)
+
+        request = {"model": config.llm_model, "messages": call.messages}
+        response = await acassette_call("llm", request, invoke, encode_llm_response, decode_llm_response)
+        log_token_usage(call, response)
+        charge_llm(getattr(response, "usage_metadata", None), config)
+        result = call.parse(str(response.content))
+        logger.info(f"{call.name}成功！")
+        return result
+    except Exception as e:
+        return call.fallback(e)
+
+def offline_voice_script(chapter_content: str, paragraphs: int = 20) -> str:
+    """离线模板文案：按句子将章节原文均分为若干段（不提取人物）"""
+    sentences = [s for s in re.split(r"(?<=[。！？!?])", chapter_content.replace("\n", "")) if s.strip()]
+    paragraphs = max(1, min(paragraphs, len(sentences)))
+    per_paragraph = -(-len(sentences) // paragraphs)
+    script = {}
+    for i in range(0, len(sentences), per_paragraph):
+        script[str(len(script) + 1)] = {"content": "".join(sentences[i:i + per_paragraph]), "character": []}
+    return json.dumps(script, ensure_ascii=False)
+
+def offline_frame_prompts(scene_content: str) -> Dict[str, str]:
+    """离线模板首尾帧提示词"""
+    return {"start_frame": f"[起始帧] {scene_content[:60]}", "end_frame": f"[结束帧] {scene_content[:60]}"}
+
+def voice_script_call(chapter_content: str) -> LLMCall:
+    """根据小说的一个章节内容生成口播文案"""
+    logger.debug("输入的章节内容：%s", payload(chapter_content, limit=100))
+
+    def parse(content: str) -> str:
+        content = strip_json_fence(content)
         json.loads(content) # Validate
-        
-        logger.info("口播文案生成成功！")
         return content
-    except json.JSONDecodeError as e:
-        logger.error(f"生成的口播文案JSON格式无效：{e}")
-        return f"生成的口播文案JSON格式无效，错误信息：{e}"
-    except Exception as e:
-        logger.error(f"生成口播文案失败：{e}", exc_info=True)
+
+    def fallback(e: Exception) -> str:
+        if isinstance(e, json.JSONDecodeError):
+            logger.error(f"生成的口播文案JSON格式无效：{e}")
+            return f"生成的口播文案JSON格式无效，错误信息：{e}"
+        logger.error(f"生成口播文案失败：{e}", exc_info=e)
         return f"生成口播文案失败，错误信息：{e}"
 
-def generate_image_prompt(scene_content: str) -> Dict[str, str]:
+    return LLMCall(
+        name="生成口播文案",
+        messages=build_messages(PORTAL_PROMPT, "请根据以上章节内容生成口播文案", context=f"章节内容：\n{chapter_content}"),
+        parse=parse,
+        fallback=fallback,
+        offline=lambda: offline_voice_script(chapter_content),
+        kind="voice_script",
+    )
+
+def renumber_voice_script(script: Dict[str, Any]) -> Dict[str, Any]:
+    """按原有顺序将文案段落重新编号为"1"、"2"……，丢弃没有content的段落"""
+    segments = [s for s in script.values() if isinstance(s, dict) and s.get("content")]
+    return {str(i): segment for i, segment in enumerate(segments, start=1)}
+
+def merge_voice_drafts(drafts: List[Dict[str, Any]], paragraphs: int = 20) -> str:
+    """按顺序将各块草稿的段落均分合并为若干段（不生成高潮切入段落），用于离线模式与合并失败时的兜底"""
+    segments = [segment for draft in drafts for segment in draft.values()]
+    paragraphs = max(1, min(paragraphs, len(segments)))
+    per_paragraph = -(-len(segments) // paragraphs)
+    script = {}
+    for i in range(0, len(segments), per_paragraph):
+        group = segments[i:i + per_paragraph]
+        characters = list(dict.fromkeys(name for segment in group for name in segment.get("character", [])))
+        script[str(len(script) + 1)] = {"content": "".join(segment["content"] for segment in group), "character": characters}
+    return json.dumps(script, ensure_ascii=False)
+
+def voice_script_chunks(chapter_content: str, config: RunConfig) -> List[str]:
+    """分块生成口播文案时按段落切分章节，未启用或章节不超过单块字数时返回整章"""
+    if not config.voice_script_map_reduce or len(chapter_content) <= config.voice_script_chunk_chars:
+        return [chapter_content]
+    return split_chapter(chapter_content, config.voice_script_chunk_chars)
+
+def draft_segment_counts(chunks: List[str], segments: int = 18) -> List[int]:
+    """
+    按各块字数分配顺叙段落（文案的段落3-20）的草稿段数
+
+    按最大余数法分配，各块段数之和等于segments；每块至少1段，块数多于segments时总数为块数。
+    """
+    # 各块均为空时按块数均分
+    weights = [len(chunk) for chunk in chunks] if any(chunks) else [1] * len(chunks)
+    total = sum(weights)
+    segments = max(segments, len(chunks))
+    # 先给每块1段，剩余段数按字数比例分配
+    shares = [(segments - len(chunks)) * weight / total for weight in weights]
+    counts = [1 + int(share) for share in shares]
+    by_remainder = sorted(range(len(chunks)), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_remainder[:segments - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+def voice_draft_call(chunk: str, index: int, total: int, count: int) -> LLMCall:
+    """根据章节的一块内容生成count段口播文案草稿"""
+
+    def parse(content: str) -> Dict[str, Any]:
+        draft = renumber_voice_script(json.loads(strip_json_fence(content)))
+        if not draft:
+            raise ValueError("草稿不含有效段落")
+        return draft
+
+    def fallback(e: Exception) -> None:
+        logger.warning(f"第{index}/{total}块口播文案草稿生成失败：{e}")
+        return None
+
+    return LLMCall(
+        name=f"生成口播文案草稿（第{index}/{total}块）",
+        messages=build_messages(VOICE_DRAFT_PROMPT, f"请根据以上章节片段生成{count}段口播文案草稿", context=f"章节片段：\n{chunk}"),
+        parse=parse,
+        fallback=fallback,
+        offline=lambda: json.loads(offline_voice_script(chunk, count)),
+        kind="voice_script_draft",
+    )
+
+def voice_merge_call(drafts: List[Dict[str, Any]]) -> LLMCall:
+    """将各块草稿合并为20段口播文案并重新编号"""
+    segments = renumber_voice_script({f"{i}-{key}": segment for i, draft in enumerate(drafts) for key, segment in draft.items()})
+
+    def parse(content: str) -> str:
+        script = renumber_voice_script(json.loads(strip_json_fence(content)))
+        if not script:
+            raise ValueError("合并结果不含有效段落")
+        return json.dumps(script, ensure_ascii=False)
+
+    def fallback(e: Exception) -> str:
+        logger.warning(f"合并口播文案草稿失败，按顺序拼接草稿：{e}")
+        return merge_voice_drafts(drafts)
+
+    return LLMCall(
+        name="合并口播文案草稿",
+        messages=build_messages(VOICE_MERGE_PROMPT, "请将以上分段草稿合并为口播文案", context=f"分段草稿：\n{json.dumps(segments, ensure_ascii=False)}"),
+        parse=parse,
+        fallback=fallback,
+        offline=lambda: merge_voice_drafts(drafts),
+        kind="voice_script_merge",
+    )
+
+def image_prompt_call(scene_content: str) -> LLMCall:
     """根据口播文案的一个场景生成文生图提示词（首帧+尾帧）"""
-    try:
-        logger.info("开始生成文生图提示词(Start/End)...")
-        model = initialize_chat_model()
-        response = model.invoke([
-                {"role": "system", "content": IMAGE_PROMPT},
-                {"role": "user", "content": f"请根据以下小说场景描述生成文生图提示词（包含start_frame和end_frame）：\n{scene_content}"}
-        ])
-        content = response.content.strip()
-        # Clean markdown
-        if content.startswith('```json'):
-            content = content[7:]
-        if content.endswith('```'):
-            content = content[:-3]
-        if content.strip().startswith('```'):
-             content = content.replace('```', '')
-        
+    def parse(content: str) -> Dict[str, str]:
+        content = strip_json_fence(content)
         try:
             prompts = json.loads(content)
-            if "start_frame" not in prompts or "end_frame" not in prompts:
-                raise ValueError("缺少start_frame或end_frame字段")
-            logger.info("文生图提示词生成成功！")
-            return prompts
         except json.JSONDecodeError:
-            logger.error(f"生成的提示词非JSON格式: {content}")
+            logger.error("生成的提示词非JSON格式: %s", payload(content))
             # Fallback: Treat entire content as start frame, empty end frame or try to fix
-            return {"start_frame": content, "end_frame": content} 
-            
-    except Exception as e:
-        logger.error(f"生成文生图提示词失败：{e}", exc_info=True)
+            return {"start_frame": content, "end_frame": content}
+        if "start_frame" not in prompts or "end_frame" not in prompts:
+            raise ValueError("缺少start_frame或end_frame字段")
+        return prompts
+
+    def fallback(e: Exception) -> Dict[str, str]:
+        logger.error(f"生成文生图提示词失败：{e}", exc_info=e)
         return {"start_frame": f"生成失败: {e}", "end_frame": f"生成失败: {e}"}
 
-def generate_video_prompt(scene_info: Dict[str, Any]) -> str:
-    """根据口播文案及首尾帧信息生成图生视频提示词"""
-    try:
-        logger.info("开始生成图生视频提示词...")
-        model = initialize_chat_model()
-        
+    return LLMCall(
+        name="生成文生图提示词(Start/End)",
+        messages=build_messages(IMAGE_PROMPT, f"请根据以下小说场景描述生成文生图提示词（包含start_frame和end_frame）：\n{scene_content}"),
+        parse=parse,
+        fallback=fallback,
+        offline=lambda: offline_frame_prompts(scene_content),
+        kind="image_prompt",
+    )
+
+def image_prompts_batch_call(scenes: Dict[str, str]) -> LLMCall:
+    """一次为多个场景生成首尾帧提示词，返回{scene_id: {"start_frame", "end_frame"}}"""
+    def parse(content: str) -> Dict[str, Dict[str, str]]:
+        result = json.loads(strip_json_fence(content))
+        prompts = {}
+        for scene_id in scenes:
+            frame = result.get(scene_id)
+            # 缺失或字段不全的场景不计入结果，由调用方逐场景补生成
+            if isinstance(frame, dict) and frame.get("start_frame") and frame.get("end_frame"):
+                prompts[scene_id] = {"start_frame": str(frame["start_frame"]), "end_frame": str(frame["end_frame"])}
+        return prompts
+
+    def fallback(e: Exception) -> Dict[str, Dict[str, str]]:
+        logger.error(f"批量生成文生图提示词失败：{e}", exc_info=e)
+        return {}
+
+    scene_text = "\n".join(f"场景{scene_id}: {content}" for scene_id, content in scenes.items())
+    return LLMCall(
+        name=f"批量生成{len(scenes)}个场景的文生图提示词",
+        messages=build_messages(IMAGE_BATCH_PROMPT, f"请根据以下连续的小说场景描述，为每个场景生成文生图提示词（包含start_frame和end_frame）：\n{scene_text}"),
+        parse=parse,
+        fallback=fallback,
+        offline=lambda: {scene_id: offline_frame_prompts(content) for scene_id, content in scenes.items()},
+        kind="image_prompt_batch",
+    )
+
+def chunk_scenes(scenes: Dict[str, str], batch_size: int) -> List[Dict[str, str]]:
+    """按场景顺序将场景切分为每批batch_size个"""
+    items = list(scenes.items())
+    batch_size = max(1, batch_size)
+    return [dict(items[i:i + batch_size]) for i in range(0, len(items), batch_size)]
+
+def keyframe_prompts_call(scene_content: str, start_prompt: str, end_prompt: str, count: int) -> LLMCall:
+    """根据首尾帧提示词生成count个中间关键帧提示词，用于长场景拆分子片段"""
+    def parse(content: str) -> List[str]:
+        keyframes = json.loads(strip_json_fence(content)).get("keyframes", [])
+        if not isinstance(keyframes, list) or len(keyframes) != count:
+            raise ValueError(f"关键帧数量不符，期望{count}个，实际{len(keyframes) if isinstance(keyframes, list) else 0}个")
+        return [str(k) for k in keyframes]
+
+    def fallback(e: Exception) -> List[str]:
+        logger.error(f"生成中间关键帧提示词失败：{e}", exc_info=e)
+        # Fallback: 前半段沿用起始帧，后半段沿用结束帧
+        return [start_prompt if (i + 1) * 2 <= count else end_prompt for i in range(count)]
+
+    return LLMCall(
+        name=f"生成{count}个中间关键帧提示词",
+        messages=build_messages(KEYFRAME_PROMPT, f"场景内容: {scene_content}\n起始帧提示词: {start_prompt}\n结束帧提示词: {end_prompt}\n请生成{count}个中间关键帧提示词"),
+        parse=parse,
+        fallback=fallback,
+        offline=lambda: [f"[关键帧{i}/{count}] {scene_content[:60]}" for i in range(1, count + 1)],
+        kind="keyframe_prompt",
+    )
+
+def video_prompt_call(scene_info: Dict[str, Any], text_only: bool = False) -> LLMCall:
+    """
+    根据口播文案及首尾帧信息生成图生视频提示词
+
+    text_only时不附带首尾帧图片，首尾帧画面由生成它们的文生图提示词描述。
+    """
+    if text_only:
+        user_content = f"根据以下场景描述及首尾帧的文生图提示词生成视频提示词（首尾帧画面与提示词一致）:\n场景内容: {scene_info.get('scene_content','')}\nStart Prompt: {scene_info.get('image_prompt_start','')}\nEnd Prompt: {scene_info.get('image_prompt_end','')}"
+    else:
         user_content = [
             {"type":"text","text":f"根据以下场景描述及首尾帧图片生成视频提示词:\n场景内容: {scene_info.get('scene_content','')}\nStart Prompt: {scene_info.get('image_prompt_start','')}\nEnd Prompt: {scene_info.get('image_prompt_end','')}"}
         ]
-        
+
         # Add start image if available
         if "image_base64_start" in scene_info and scene_info["image_base64_start"]:
              user_content.append({"type":"image","base64":scene_info["image_base64_start"],"mime_type":"image/jpeg"})
-        
+
         # Add end image if available
         if "image_base64_end" in scene_info and scene_info["image_base64_end"]:
              user_content.append({"type":"image","base64":scene_info["image_base64_end"],"mime_type":"image/jpeg"})
 
-        response = model.invoke([
-                {"role": "system", "content": VIDEO_PROMPT},
-                {"role": "user", "content": user_content}
-        ])
-        content = response.content.strip()
+    def parse(content: str) -> str:
+        content = content.strip()
         # Clean markdown
         if content.startswith('```'):
             lines = content.split('\n')
             if len(lines) > 1:
                 content = lines[1] if not lines[0].lower().startswith('```') else '\n'.join(lines[1:])
             content = content.replace('```', '')
-            
-        logger.info("图生视频提示词生成成功！")
         return content.strip()
-    except Exception as e:
-        logger.error(f"生成图生视频提示词失败：{e}", exc_info=True)
+
+    def fallback(e: Exception) -> str:
+        logger.error(f"生成图生视频提示词失败：{e}", exc_info=e)
         return f"生成图生视频提示词失败，错误信息：{e}"
 
-def extract_character_appearance(novel_text: str, character_name: str) -> str:
+    return LLMCall(
+        name="生成图生视频提示词" + ("(文本)" if text_only else ""),
+        messages=build_messages(VIDEO_PROMPT, user_content),
+        parse=parse,
+        fallback=fallback,
+        offline=lambda: f"[镜头缓慢推进] {scene_info.get('scene_content', '')[:60]}",
+        kind="video_prompt_text" if text_only else "video_prompt",
+    )
+
+def character_appearance_call(novel_text: str, character_name: str) -> LLMCall:
     """从小说文本中提取人物的外貌特征"""
-    try:
-        model = initialize_chat_model()
-        system_prompt = "你是一个专业的文学分析助手，请从小说文本中提取指定人物的外貌特征描述，只返回提取到的外貌特征，不要添加任何其他内容。"
-        user_prompt = f"请从以下小说文本中提取人物{character_name}的外貌特征：\n{novel_text}"
-        
-        response = model.invoke([
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ])
-        return str(response.content).strip()
-    except Exception as e:
+    system_prompt = "你是一个专业的文学分析助手，请从小说文本中提取指定人物的外貌特征描述，只返回提取到的外貌特征，不要添加任何其他内容。"
+
+    def fallback(e: Exception) -> str:
         logger.error(f"提取人物外貌特征时出错: {e}")
         return f"{character_name}的外貌特征：从小说中提取"
+
+    return LLMCall(
+        name=f"提取人物{character_name}的外貌特征",
+        # 小说文本作为前缀上下文，同一章节的各人物调用只有最后的人物名不同
+        messages=build_messages(system_prompt, f"请从以上小说文本中提取人物{character_name}的外貌特征", context=f"小说文本：\n{novel_text}"),
+        parse=lambda content: content.strip(),
+        fallback=fallback,
+        offline=lambda: f"{character_name}的外貌特征（离线占位）",
+        kind="character_appearance",
+    )
+
+def character_alias_call(novel_text: str, names: List[str], known: List[str]) -> LLMCall:
+    """判断人物称呼对应的规范名，返回{称呼: 规范名}；调用失败时返回空字典"""
+    def parse(content: str) -> Dict[str, str]:
+        result = json.loads(strip_json_fence(content))
+        if not isinstance(result, dict):
+            raise ValueError("人物别名归并结果不是JSON对象")
+        return {name: str(result.get(name) or name).strip() or name for name in names}
+
+    def fallback(e: Exception) -> Dict[str, str]:
+        # 不登记失败的结果，下次运行重新判断
+        logger.error(f"人物别名归并失败，按原称呼处理：{e}")
+        return {}
+
+    known_text = "、".join(known) if known else "无"
+    return LLMCall(
+        name=f"归并{len(names)}个人物称呼",
+        messages=build_messages(CHARACTER_ALIAS_PROMPT, f"已登记人物：{known_text}\n待判断的称呼：{'、'.join(names)}", context=f"小说文本：\n{novel_text}"),
+        parse=parse,
+        fallback=fallback,
+        offline=lambda: {name: name for name in names},
+        kind="character_alias",
+    )
+
+def generate_voice_draft(chunk: str, index: int, total: int, count: int, config: RunConfig) -> Optional[Dict[str, Any]]:
+    """生成一块的口播文案草稿，失败时单独重试该块，重试后仍失败返回None"""
+    for attempt in range(config.voice_script_chunk_retries + 1):
+        if attempt:
+            logger.info(f"{attempt}秒后重试第{index}/{total}块草稿（{attempt}/{config.voice_script_chunk_retries}）...")
+            cassette_sleep(attempt)
+        draft = run_llm_call(voice_draft_call(chunk, index, total, count), config)
+        if draft is not None:
+            return draft
+    return None
+
+async def agenerate_voice_draft(chunk: str, index: int, total: int, count: int, config: RunConfig) -> Optional[Dict[str, Any]]:
+    """generate_voice_draft的异步版本"""
+    for attempt in range(config.voice_script_chunk_retries + 1):
+        if attempt:
+            logger.info(f"{attempt}秒后重试第{index}/{total}块草稿（{attempt}/{config.voice_script_chunk_retries}）...")
+            await acassette_sleep(attempt)
+        draft = await arun_llm_call(voice_draft_call(chunk, index, total, count), config)
+        if draft is not None:
+            return draft
+    return None
+
+def generate_voice_script(chapter_content: str, config: Optional[RunConfig] = None) -> str:
+    """
+    根据小说的一个章节内容生成口播文案
+
+    长章节（超过voice_script_chunk_chars字）按段落切块，各块并行（至多voice_script_chunk_concurrency块）生成顺叙段落草稿并单独重试，
+    再由一次合并调用整理为20段文案，耗时取决于单块长度而非整章长度。
+    """
+    config = resolve_config(config)
+    chunks = voice_script_chunks(chapter_content, config)
+    if len(chunks) == 1:
+        return run_llm_call(voice_script_call(chapter_content), config)
+    logger.info(f"章节共{len(chapter_content)}字，按段落分为{len(chunks)}块并行生成口播文案草稿")
+    counts = draft_segment_counts(chunks)
+    with ThreadPoolExecutor(max_workers=max(1, min(config.voice_script_chunk_concurrency, len(chunks)))) as executor:
+        # 复制上下文，使草稿生成的日志保留阶段等字段
+        futures = [
+            executor.submit(contextvars.copy_context().run, generate_voice_draft, chunk, i, len(chunks), count, config)
+            for i, (chunk, count) in enumerate(zip(chunks, counts), start=1)
+        ]
+        drafts = [future.result() for future in futures]
+    failed = [str(i) for i, draft in enumerate(drafts, start=1) if draft is None]
+    if failed:
+        logger.error(f"第{'、'.join(failed)}块口播文案草稿重试后仍生成失败")
+        return f"生成口播文案失败，错误信息：第{'、'.join(failed)}块草稿生成失败"
+    return run_llm_call(voice_merge_call(drafts), config)
+
+async def agenerate_voice_script(chapter_content: str, config: Optional[RunConfig] = None) -> str:
+    """generate_voice_script的异步版本，各块草稿并发生成"""
+    config = resolve_config(config)
+    chunks = voice_script_chunks(chapter_content, config)
+    if len(chunks) == 1:
+        return await arun_llm_call(voice_script_call(chapter_content), config)
+    logger.info(f"章节共{len(chapter_content)}字，按段落分为{len(chunks)}块并发生成口播文案草稿")
+    counts = draft_segment_counts(chunks)
+    draft_slots = asyncio.Semaphore(max(1, config.voice_script_chunk_concurrency))
+
+    async def run_draft(chunk: str, index: int, count: int) -> Optional[Dict[str, Any]]:
+        async with draft_slots:
+            return await agenerate_voice_draft(chunk, index, len(chunks), count, config)
+
+    drafts = await asyncio.gather(*(
+        run_draft(chunk, i, count) for i, (chunk, count) in enumerate(zip(chunks, counts), start=1)
+    ))
+    failed = [str(i) for i, draft in enumerate(drafts, start=1) if draft is None]
+    if failed:
+        logger.error(f"第{'、'.join(failed)}块口播文案草稿重试后仍生成失败")
+        return f"生成口播文案失败，错误信息：第{'、'.join(failed)}块草稿生成失败"
+    return await arun_llm_call(voice_merge_call(list(drafts)), config)
+
+def generate_image_prompt(scene_content: str, config: Optional[RunConfig] = None) -> Dict[str, str]:
+    """根据口播文案的一个场景生成文生图提示词（首帧+尾帧）"""
+    return run_llm_call(image_prompt_call(scene_content), config)
+
+async def agenerate_image_prompt(scene_content: str, config: Optional[RunConfig] = None) -> Dict[str, str]:
+    """generate_image_prompt的异步版本"""
+    return await arun_llm_call(image_prompt_call(scene_content), config)
+
+def generate_image_prompts(scenes: Dict[str, str], config: Optional[RunConfig] = None) -> Dict[str, Dict[str, str]]:
+    """
+    批量生成多个场景的首尾帧提示词
+
+    按image_prompt_batch_size分批，每批一次LLM调用并共享章节上下文；
+    批量结果中缺失的场景回退为逐场景调用generate_image_prompt。
+
+    Args:
+        scenes: {scene_id: 场景内容}，按场景顺序排列
+        config: 运行配置
+
+    Returns:
+        {scene_id: {"start_frame": ..., "end_frame": ...}}
+    """
+    config = resolve_config(config)
+    prompts: Dict[str, Dict[str, str]] = {}
+    if config.image_prompt_batch_size > 1:
+        for batch in chunk_scenes(scenes, config.image_prompt_batch_size):
+            prompts.update(run_llm_call(image_prompts_batch_call(batch), config))
+    for scene_id, content in scenes.items():
+        if scene_id not in prompts:
+            if config.image_prompt_batch_size > 1:
+                logger.warning(f"批量结果缺少场景 {scene_id}，单独生成提示词")
+            prompts[scene_id] = generate_image_prompt(content, config=config)
+    return {scene_id: prompts[scene_id] for scene_id in scenes}
+
+async def agenerate_image_prompts(scenes: Dict[str, str], config: Optional[RunConfig] = None) -> Dict[str, Dict[str, str]]:
+    """generate_image_prompts的异步版本，各批次及补生成的场景并发执行"""
+    config = resolve_config(config)
+    prompts: Dict[str, Dict[str, str]] = {}
+    if config.image_prompt_batch_size > 1:
+        batches = chunk_scenes(scenes, config.image_prompt_batch_size)
+        for result in await asyncio.gather(*(arun_llm_call(image_prompts_batch_call(batch), config) for batch in batches)):
+            prompts.update(result)
+    missing = [scene_id for scene_id in scenes if scene_id not in prompts]
+    if missing and config.image_prompt_batch_size > 1:
+        logger.warning(f"批量结果缺少场景 {', '.join(missing)}，单独生成提示词")
+    results = await asyncio.gather(*(agenerate_image_prompt(scenes[scene_id], config=config) for scene_id in missing))
+    prompts.update(zip(missing, results))
+    return {scene_id: prompts[scene_id] for scene_id in scenes}
+
+def generate_keyframe_prompts(scene_content: str, start_prompt: str, end_prompt: str, count: int, config: Optional[RunConfig] = None) -> List[str]:
+    """根据首尾帧提示词生成count个中间关键帧提示词，用于长场景拆分子片段"""
+    if count <= 0:
+        return []
+    return run_llm_call(keyframe_prompts_call(scene_content, start_prompt, end_prompt, count), config)
+
+async def agenerate_keyframe_prompts(scene_content: str, start_prompt: str, end_prompt: str, count: int, config: Optional[RunConfig] = None) -> List[str]:
+    """generate_keyframe_prompts的异步版本"""
+    if count <= 0:
+        return []
+    return await arun_llm_call(keyframe_prompts_call(scene_content, start_prompt, end_prompt, count), config)
+
+def generate_video_prompt(scene_info: Dict[str, Any], text_only: bool = False, config: Optional[RunConfig] = None) -> str:
+    """根据口播文案及首尾帧信息生成图生视频提示词，text_only时不上传首尾帧图片"""
+    return run_llm_call(video_prompt_call(scene_info, text_only), config)
+
+async def agenerate_video_prompt(scene_info: Dict[str, Any], text_only: bool = False, config: Optional[RunConfig] = None) -> str:
+    """generate_video_prompt的异步版本"""
+    return await arun_llm_call(video_prompt_call(scene_info, text_only), config)
+
+def extract_character_appearance(novel_text: str, character_name: str, config: Optional[RunConfig] = None) -> str:
+    """从小说文本中提取人物的外貌特征"""
+    return run_llm_call(character_appearance_call(novel_text, character_name), config)
+
+async def aextract_character_appearance(novel_text: str, character_name: str, config: Optional[RunConfig] = None) -> str:
+    """extract_character_appearance的异步版本"""
+    return await arun_llm_call(character_appearance_call(novel_text, character_name), config)
+
+def resolve_character_aliases(novel_text: str, names: List[str], known: List[str], config: Optional[RunConfig] = None) -> Dict[str, str]:
+    """将人物称呼归并为规范名，known为已登记的人物"""
+    return run_llm_call(character_alias_call(novel_text, names, known), config)
+
+async def aresolve_character_aliases(novel_text: str, names: List[str], known: List[str], config: Optional[RunConfig] = None) -> Dict[str, str]:
+    """resolve_character_aliases的异步版本"""
+    return await arun_llm_call(character_alias_call(novel_text, names, known), config)
@@ -0,0 +1,54 @@
+import os
+import base64
+import hashlib
+import tempfile
+from typing import Any, Dict, Optional
+from app.config import RunConfig
+from app.utils.logger import setup_logger
+from app.utils.video_ops import render_text_card, render_ken_burns
+
+logger = setup_logger(__name__)
+
+# 离线占位服务：不访问任何外部服务，用本地ffmpeg生成确定性的图片与视频，
+# 用于在付费生成前检查全章节奏、时长与音画对齐
+
+# 即梦480p竖屏输出尺寸
+LOCAL_VIDEO_SIZE = "480x854"
+
+
+def card_color(text: str) -> str:
+    """按文本哈希取一个稳定的深色背景，便于区分不同场景"""
+    digest = hashlib.md5(text.encode("utf-8")).digest()
+    return "0x" + "".join(f"{64 + b % 128:02x}" for b in digest[:3])
+
+
+def local_generate_image(prompt: str, size: str, save_path: Optional[str], config: RunConfig) -> str:
+    """渲染文字卡片代替文生图，卡片文字为保存文件名（如3_start），返回file://地址或失败信息"""
+    if not save_path:
+        save_path = os.path.join(tempfile.gettempdir(), f"card_{hashlib.md5(prompt.encode('utf-8')).hexdigest()[:12]}.jpeg")
+    label = os.path.splitext(os.path.basename(save_path))[0]
+    if render_text_card(label, size, save_path, color=card_color(prompt), font_file=config.local_font_file):
+        logger.info(f"离线模式：已渲染占位图 {save_path}")
+        return f"file://{os.path.abspath(save_path)}"
+    return "生成图片失败：离线占位图渲染失败"
+
+
+def local_generate_video(scene_info: Dict[str, Any], video_frames: int, save_path: str, config: RunConfig) -> Dict[str, Any]:
+    """以首尾帧渲染指定帧数的Ken Burns视频代替即梦图生视频"""
+    scene_id = scene_info["scene_id"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        frame_paths = []
+        for name in ("start", "end"):
+            path = os.path.join(tmp_dir, f"{name}.jpeg")
+            with open(path, "wb") as f:
+                f.write(base64.b64decode(scene_info[f"image_base64_{name}"]))
+            frame_paths.append(path)
+        if not render_ken_burns(frame_paths[0], frame_paths[1], video_frames, config.video_frame_rate, LOCAL_VIDEO_SIZE, save_path):
+            raise Exception(f"场景 {scene_id} 离线视频渲染失败")
+    logger.info(f"离线模式：场景 {scene_id} 已渲染{video_frames}帧占位视频 {save_path}")
+    return {
+        "scene_id": scene_id,
+        "video_url": f"file://{os.path.abspath(save_path)}",
+        "video_path": save_path,
+        "narration": None,
+    }
@@ -1,26 +1,57 @@
 import os
 import time
+import asyncio
+import threading
+import weakref
 from typing import List, Optional, Dict, Any
-from volcenginesdkarkruntime import Ark
-from app.config import Config
-from app.utils.logger import setup_logger
-from app.utils.file_ops import image_to_base64, download_image, download_video
-from app.services.llm import generate_image_prompt, generate_video_prompt
+from app.config import RunConfig, resolve_config, PROVIDER_LOCAL, VIDEO_PROMPT_TEXT
+from app.utils.logger import setup_logger, payload, set_log_context
+from app.utils.file_ops import image_to_base64, download_image, download_video, adownload_image, adownload_video, iter_download
+from app.utils.video_ops import mux_video_stream
+from app.services.llm import generate_image_prompt, generate_video_prompt, agenerate_video_prompt
 import json
-from app.utils.volc_signature import request
-import requests
-from urllib.parse import urlparse, parse_qs
+from app.utils.volc_signature import request, arequest
+from app.utils.media_store import get_media_store, media_key, text_digest, file_digest
+from app.utils.file_ops import atomic_output
+from app.services.local import local_generate_image, local_generate_video
+from app.utils.hedging import hedged_call, ahedged_call
+from app.utils.quality import quality_gate_enabled, check_frame, probe_clip, frames_too_similar
+from app.utils.credentials import get_credential_pool, lease_video_account, alease_video_account, PROVIDER_SEEDREAM, PROVIDER_JIMENG
+from app.utils.cassette import cassette_call, acassette_call, cassette_sleep, acassette_sleep, get_cassette
+from app.utils.budget import charge_images, charge_video, poll_hopeless, estimate_clip_seconds, DeadlineExceeded
 
 logger = setup_logger(__name__)
 
-# 豆包文生图
-def generate_image(prompt: str, size: str = "1440x2560", save_path: Optional[str] = None, max_retries: int = 3, characters: List[str] = None) -> str:
-    """生成图片"""
-    # 参数验证
-    if not prompt or not isinstance(prompt, str):
-        logger.error("图片描述不能为空且必须是字符串")
-        return "生成图片失败：图片描述不能为空且必须是字符串"
-    
+# 按凭证缓存Ark客户端，复用底层连接池
+_ark_clients: Dict[tuple, Any] = {}
+_clients_lock = threading.Lock()
+
+# 异步版本的客户端，按事件循环隔离
+_async_ark_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, Any]]" = weakref.WeakKeyDictionary()
+
+def get_async_ark_client(config: RunConfig, api_key: Optional[str] = None) -> Any:
+    """获取当前事件循环的（缓存的）AsyncArk客户端，api_key为账号池分配的凭证"""
+    api_key = api_key or config.doubao_api_key
+    clients = _async_ark_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (api_key, config.ark_base_url)
+    if key not in clients:
+        from volcenginesdkarkruntime import AsyncArk
+        clients[key] = AsyncArk(api_key=api_key, base_url=config.ark_base_url)
+    return clients[key]
+
+def get_ark_client(config: RunConfig, api_key: Optional[str] = None) -> Any:
+    """获取（缓存的）Ark客户端，api_key为账号池分配的凭证"""
+    api_key = api_key or config.doubao_api_key
+    key = (api_key, config.ark_base_url)
+    with _clients_lock:
+        if key not in _ark_clients:
+            # 延迟导入方舟SDK，首次调用时才加载
+            from volcenginesdkarkruntime import Ark
+            _ark_clients[key] = Ark(api_key=api_key, base_url=config.ark_base_url)
+        return _ark_clients[key]
+
+def build_image_params(prompt: str, size: str, characters: List[str], config: RunConfig) -> Dict[str, Any]:
+    """构建豆包文生图请求参数（附带人物写真参考图）"""
     if size not in ["2048x2048","2560x1440","1440x2560"]:
         logger.warning(f"无效的图片尺寸：{size}，将使用默认尺寸1440x2560")
         size = "1440x2560"
@@ -30,7 +61,7 @@ def generate_image(prompt: str, size: str = "1440x2560", save_path: Optional[str
     character_names = []
     if characters:
         for character in characters:
-            portrait_path = os.path.join(Config.CHARACTER_DIR, f"{character}.png")
+            portrait_path = os.path.join(config.character_dir, f"{character}.png")
             if os.path.exists(portrait_path):
                 base64_image = image_to_base64(portrait_path)
                 if not base64_image.startswith("转换失败"):
@@ -40,13 +71,13 @@ def generate_image(prompt: str, size: str = "1440x2560", save_path: Optional[str
                 else:
                     logger.error(f"人物 {character} 的写真转换为base64失败：{base64_image}")
 
-    logger.info(f"开始生成图片，提示词：{prompt[:50]}...")
+    logger.info("开始生成图片，提示词：%s", payload(prompt, limit=50))
     if reference_images:
         logger.info(f"使用 {len(reference_images)} 张人物写真作为参考")
     
     # 构建API请求参数
     api_params = {
-        "model": "doubao-seedream-4-5-251128",
+        "model": config.image_model,
         "prompt": prompt,
         "size": size,
         "watermark": False,
@@ -58,22 +89,53 @@ def generate_image(prompt: str, size: str = "1440x2560", save_path: Optional[str
             enhanced_prompt += f",{character_names[i]} 的外貌特征如图{i}所示"
         api_params.update({"image":reference_images})
         api_params["prompt"] = enhanced_prompt
+    return api_params
+
+def encode_image_response(response: Any) -> Dict[str, Any]:
+    """录制文生图响应中调用方使用的字段"""
+    error = getattr(response, "error", None)
+    return {"urls": [d.url for d in response.data or []], "error": error.message if error else None}
+
+def decode_image_response(record: Dict[str, Any]) -> Any:
+    from types import SimpleNamespace
+    error = SimpleNamespace(message=record["error"]) if record["error"] else None
+    return SimpleNamespace(data=[SimpleNamespace(url=url) for url in record["urls"]], error=error)
+
+# 豆包文生图
+def generate_image(prompt: str, size: str = "1440x2560", save_path: Optional[str] = None, max_retries: int = 3, characters: List[str] = None, config: Optional[RunConfig] = None) -> str:
+    """生成图片"""
+    config = resolve_config(config)
+    # 参数验证
+    if not prompt or not isinstance(prompt, str):
+        logger.error("图片描述不能为空且必须是字符串")
+        return "生成图片失败：图片描述不能为空且必须是字符串"
+    if config.provider == PROVIDER_LOCAL:
+        return local_generate_image(prompt, size, save_path, config)
+    
+    api_params = build_image_params(prompt, size, characters, config)
+    pool = get_credential_pool(PROVIDER_SEEDREAM, config)
+
+    def generate() -> Any:
+        # 每次尝试重新分配账号，被限流或隔离的账号由其他账号接替
+        with pool.lease(config) as account:
+            client = get_ark_client(config, account.secret)
+
+            def submit() -> Any:
+                # 按提交计费，对冲发出的重复请求同样计费
+                charge_images(1, config)
+                return client.images.generate(**api_params)
+
+            return hedged_call(f"image:{config.image_model}", submit, config, budget=config.image_hedge_budget)
 
     retry_count = 0
     while retry_count < max_retries:
         try:
-            client = Ark(
-                api_key=Config.DOUBAO_API_KEY,
-                base_url="https://ark.cn-beijing.volces.com/api/v3",
-            )
-            
             logger.debug(f"调用豆包API生成图片，重试次数：{retry_count}")
-            
-            response = client.images.generate(**api_params)
+            response = cassette_call("image", {"params": api_params}, generate, encode_image_response, decode_image_response)
             
             if response.data and len(response.data) > 0:
                 image_url = response.data[0].url
-                logger.info(f"图片生成成功，URL：{image_url}")
+                logger.info("图片生成成功，URL：%s", payload(image_url))
                 
                 if save_path:
                     logger.info(f"开始下载图片到：{save_path}")
@@ -96,77 +158,183 @@ def generate_image(prompt: str, size: str = "1440x2560", save_path: Optional[str
             logger.error(f"图片生成异常（{retry_count}/{max_retries}）：{str(e)}")
             if retry_count < max_retries:
                 logger.info(f"{retry_count}秒后重试...")
-                time.sleep(retry_count) # Backoff
+                cassette_sleep(retry_count) # Backoff
             else:
                 logger.error(f"图片生成失败，已达到最大重试次数：{max_retries}")
                 return f"生成图片失败，已达到最大重试次数：{str(e)}"
 
-# def poll_video_status(client: Ark, task_id: str, scene_id: str, max_retries: int, poll_interval: int) -> str:
-#     """轮询查询视频生成结果"""
-#     video_url = None
-#     for i in range(max_retries):
-#         logger.debug(f"场景 {scene_id} 第{i+1}次查询视频生成结果...")
-        
-#         try:
-#             fetch_result = client.content_generation.tasks.get(task_id=task_id)
-#             status = fetch_result.status
-            
-#             if status == 'succeeded':
-#                 video_url = fetch_result.content.video_url
-#                 if video_url:
-#                     logger.info(f"场景 {scene_id} 视频生成成功！视频URL：{video_url}")
-#                     if hasattr(fetch_result, 'usage'):
-#                         logger.info(f"视频生成消耗tokens:{fetch_result.usage.completion_tokens}")
-#                     break
-#             elif status == 'failed' or status == 'cancelled':
-#                 error_msg = fetch_result.error
-#                 logger.error(f"场景 {scene_id} 视频生成失败：{error_msg.message}")
-#                 raise Exception(f"场景 {scene_id} 视频生成失败：{error_msg.message}")
-#             else:
-#                 logger.info(f"场景 {scene_id} 视频生成中，当前状态：{status}")
-#         except Exception as e:
-#             logger.warning(f"场景 {scene_id} 查询视频生成结果失败，将重试：{e}")
-        
-#         if i < max_retries - 1:
-#             time.sleep(poll_interval)
-    
-#     if not video_url:
-#         logger.error(f"场景 {scene_id} 视频生成超时或失败")
-#         raise Exception(f"场景 {scene_id} 视频生成超时或失败")
-    
-#     return video_url
+async def agenerate_image(prompt: str, size: str = "1440x2560", save_path: Optional[str] = None, max_retries: int = 3, characters: List[str] = None, config: Optional[RunConfig] = None) -> str:
+    """generate_image的异步版本"""
+    config = resolve_config(config)
+    # 参数验证
+    if not prompt or not isinstance(prompt, str):
+        logger.error("图片描述不能为空且必须是字符串")
+        return "生成图片失败：图片描述不能为空且必须是字符串"
+    if config.provider == PROVIDER_LOCAL:
+        return await asyncio.to_thread(local_generate_image, prompt, size, save_path, config)
+
+    api_params = build_image_params(prompt, size, characters, config)
+    pool = get_credential_pool(PROVIDER_SEEDREAM, config)
+
+    async def generate() -> Any:
+        with pool.lease(config) as account:
+            client = get_async_ark_client(config, account.secret)
+
+            async def submit() -> Any:
+                charge_images(1, config)
+                return await client.images.generate(**api_params)
+
+            return await ahedged_call(f"image:{config.image_model}", submit, config, budget=config.image_hedge_budget)
+
+    retry_count = 0
+    while retry_count < max_retries:
+        try:
+            logger.debug(f"调用豆包API生成图片，重试次数：{retry_count}")
+            response = await acassette_call("image", {"params": api_params}, generate, encode_image_response, decode_image_response)
+
+            if response.data and len(response.data) > 0:
+                image_url = response.data[0].url
+                logger.info("图片生成成功，URL：%s", payload(image_url))
+                if save_path:
+                    logger.info(f"开始下载图片到：{save_path}")
+                    result = await adownload_image(image_url, save_path)
+                    if "成功" in result:
+                        logger.info(f"图片下载成功：{save_path}")
+                    else:
+                        logger.error(f"图片下载失败：{result}")
+                return image_url
+            else:
+                error_msg = response.error.message if hasattr(response, 'error') and response.error else "未知错误"
+                logger.error(f"图片生成失败：{error_msg}")
+                return f"生成图片失败：{error_msg}"
+
+        except Exception as e:
+            retry_count += 1
+            logger.error(f"图片生成异常（{retry_count}/{max_retries}）：{str(e)}")
+            if retry_count < max_retries:
+                logger.info(f"{retry_count}秒后重试...")
+                await acassette_sleep(retry_count) # Backoff
+            else:
+                logger.error(f"图片生成失败，已达到最大重试次数：{max_retries}")
+                return f"生成图片失败，已达到最大重试次数：{str(e)}"
+
+def frame_prompt_path(image_path: str) -> str:
+    """图片对应的提示词记录：{"prompt": 文生图提示词, "digest": 图片内容摘要}"""
+    return os.path.splitext(image_path)[0] + ".prompt.json"
+
+def save_frame_prompt(image_path: str, prompt: str) -> None:
+    if not os.path.exists(image_path):
+        return
+    with atomic_output(frame_prompt_path(image_path)) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"prompt": prompt, "digest": file_digest(image_path)}, f, ensure_ascii=False)
+
+def load_frame_prompt(image_path: str) -> Optional[str]:
+    """读取生成该图片的提示词，没有记录或图片已被替换（摘要不一致）时返回None"""
+    path = frame_prompt_path(image_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if record.get("digest") != file_digest(image_path):
+        return None
+    return record.get("prompt") or None
+
+def generate_checked_image(prompt: str, save_path: str, characters: List[str] = None, config: Optional[RunConfig] = None) -> str:
+    """
+    生成图片并做本地质量检查（可解码、非全黑、非纯色），不合格时重新生成
+
+    Returns:
+        图片URL；重试quality_max_retries次后仍不合格时返回以"生成图片失败"开头的信息
+    """
+    config = resolve_config(config)
+    for attempt in range(config.quality_max_retries + 1):
+        image_url = generate_image(prompt, save_path=save_path, characters=characters, config=config)
+        if image_url.startswith("生成图片失败"):
+            return image_url
+        problem = check_frame(save_path, config) if quality_gate_enabled(config) else None
+        if problem is None:
+            # 记录提示词，生成视频提示词时可直接使用而无需上传图片
+            save_frame_prompt(save_path, prompt)
+            return image_url
+        logger.warning(f"图片 {save_path} 未通过质量检查：{problem}（{attempt + 1}/{config.quality_max_retries + 1}）")
+    return f"生成图片失败：图片未通过质量检查，{problem}"
+
+async def agenerate_checked_image(prompt: str, save_path: str, characters: List[str] = None, config: Optional[RunConfig] = None) -> str:
+    """generate_checked_image的异步版本"""
+    config = resolve_config(config)
+    for attempt in range(config.quality_max_retries + 1):
+        image_url = await agenerate_image(prompt, save_path=save_path, characters=characters, config=config)
+        if image_url.startswith("生成图片失败"):
+            return image_url
+        problem = await asyncio.to_thread(check_frame, save_path, config) if quality_gate_enabled(config) else None
+        if problem is None:
+            await asyncio.to_thread(save_frame_prompt, save_path, prompt)
+            return image_url
+        logger.warning(f"图片 {save_path} 未通过质量检查：{problem}（{attempt + 1}/{config.quality_max_retries + 1}）")
+    return f"生成图片失败：图片未通过质量检查，{problem}"
+
+def check_video_result(fetch_result: Dict[str, Any], scene_id: str) -> Any:
+    """
+    解析即梦任务查询结果
+
+    Returns:
+        (是否结束, 视频URL)：生成成功返回(True, url)，生成失败返回(True, None)，仍在生成返回(False, None)
+    """
+    status = fetch_result["data"]["status"]
+    message = fetch_result["message"]
+    if status == 'done':
+        if message == "Success":
+            video_url = fetch_result["data"]["video_url"]
+            if video_url:
+                logger.info("场景 %s 视频生成成功！视频URL：%s", scene_id, payload(video_url))
+                return True, video_url
+            return False, None
+        logger.error(f"场景{scene_id}视频生成失败,错误信息{message}")
+        return True, None
+    elif status == 'not_found' or status == 'expired':
+        logger.error(f"场景 {scene_id} 视频生成失败：{message}")
+        raise Exception(f"场景 {scene_id} 视频生成失败：{message}")
+    logger.info(f"场景 {scene_id} 视频生成中，当前状态：{status}")
+    return False, None
 
-def poll_video_status(task_id: str, scene_id: str, max_retries: int, poll_interval: int) -> str:
-    """轮询查询视频生成结果"""
+def pinned_account(task_id: str, config: RunConfig) -> Optional[tuple]:
+    """提交该任务的即梦账号"""
+    credential = get_credential_pool(PROVIDER_JIMENG, config).pinned(task_id)
+    return credential.secret if credential else None
+
+def check_poll_hopeless(scene_id: str, started: float, expected_seconds: Optional[float], config: RunConfig) -> None:
+    """已无望在截止时间前完成时放弃轮询（即梦任务无法取消，放弃后释放并发槽位）"""
+    reason = poll_hopeless(time.monotonic() - started, expected_seconds, config) if expected_seconds else None
+    if reason:
+        logger.warning(f"场景 {scene_id} 放弃轮询：{reason}")
+        raise DeadlineExceeded(f"场景 {scene_id} 放弃轮询：{reason}")
+
+def poll_video_status(task_id: str, scene_id: str, max_retries: int, poll_interval: int, config: Optional[RunConfig] = None, account: Optional[tuple] = None, expected_seconds: Optional[float] = None) -> str:
+    """轮询查询视频生成结果，任务只能用提交它的账号查询，account未传入时使用提交时记录的账号"""
+    config = resolve_config(config)
+    account = account or pinned_account(task_id, config)
     video_url = None
+    started = time.monotonic()
+    body = {"req_key":config.jimeng_model_name,"task_id":task_id}
+    payload_str = json.dumps(body, separators=(",", ":"))
     for i in range(max_retries):
         logger.debug(f"场景 {scene_id} 第{i+1}次查询视频生成结果...")
         
         try:
-            body = {"req_key":"jimeng_i2v_first_tail_v30","task_id":task_id}
-            payload_str = json.dumps(body, separators=(",", ":"))
-            fetch_result = request("POST","CVSync2AsyncGetResult",payload_str)
-            status = fetch_result["data"]["status"]
-            message = fetch_result["message"]
-            if status == 'done':
-                if message == "Success":
-                    video_url = fetch_result["data"]["video_url"]
-                    if video_url:
-                        logger.info(f"场景 {scene_id} 视频生成成功！视频URL：{video_url}")
-                        break
-                else:
-                    logger.error(f"场景{scene_id}视频生成失败,错误信息{message}")
-                    break
-            elif status == 'not_found' or status == 'expired':
-                logger.error(f"场景 {scene_id} 视频生成失败：{message}")
-                raise Exception(f"场景 {scene_id} 视频生成失败：{message}")
-            else:
-                logger.info(f"场景 {scene_id} 视频生成中，当前状态：{status}")
+            fetch_result = request("POST","CVSync2AsyncGetResult",payload_str,config=config,account=account)
+            finished, video_url = check_video_result(fetch_result, scene_id)
+            if finished:
+                break
         except Exception as e:
             logger.warning(f"场景 {scene_id} 查询视频生成结果失败，将重试：{e}")
         
+        check_poll_hopeless(scene_id, started, expected_seconds, config)
         if i < max_retries - 1:
-            time.sleep(poll_interval)
+            cassette_sleep(poll_interval)
     
     if not video_url:
         logger.error(f"场景 {scene_id} 视频生成超时或失败")
@@ -174,47 +342,69 @@ def poll_video_status(task_id: str, scene_id: str, max_retries: int, poll_interv
     
     return video_url
 
+async def apoll_video_status(task_id: str, scene_id: str, max_retries: int, poll_interval: int, config: Optional[RunConfig] = None, account: Optional[tuple] = None, expected_seconds: Optional[float] = None) -> str:
+    """poll_video_status的异步版本，轮询间隔使用asyncio.sleep，不占用线程"""
+    config = resolve_config(config)
+    account = account or pinned_account(task_id, config)
+    video_url = None
+    started = time.monotonic()
+    body = {"req_key":config.jimeng_model_name,"task_id":task_id}
+    payload_str = json.dumps(body, separators=(",", ":"))
+    for i in range(max_retries):
+        logger.debug(f"场景 {scene_id} 第{i+1}次查询视频生成结果...")
+        try:
+            fetch_result = await arequest("POST","CVSync2AsyncGetResult",payload_str,config=config,account=account)
+            finished, video_url = check_video_result(fetch_result, scene_id)
+            if finished:
+                break
+        except Exception as e:
+            logger.warning(f"场景 {scene_id} 查询视频生成结果失败，将重试：{e}")
 
+        check_poll_hopeless(scene_id, started, expected_seconds, config)
+        if i < max_retries - 1:
+            await acassette_sleep(poll_interval)
 
-def generate_single_video(scene_info: Dict[str, Any], video_dir: str, duration: float = None) -> Dict[str, Any]:
-    """生成单个场景的视频"""
-    scene_id = scene_info["scene_id"]
-    # 优先使用Start Frame作为视频生成的首帧
-    image_url = scene_info.get("image_url_start")
-    image_path = scene_info.get("image_path_start")
-    
-    logger.info(f"生成场景 {scene_id} 的视频...")
-    
-    try:
-        # 生成视频提示词
-        video_prompt = generate_video_prompt(scene_info)
-        # Try to parse strict JSON of prompt if it returns JSON string
-        try:
-             json_prompt = json.loads(video_prompt)
-             if isinstance(json_prompt, dict) and "video_prompt" in json_prompt:
-                 video_prompt = json_prompt["video_prompt"]
-                 narration = json_prompt["narration"]
-        except:
-             pass # assume it is raw text if not json
-
-        logger.info(f"场景 {scene_id} 的视频生成提示词：{video_prompt}")
-
-        # 获取音频帧数
-        video_frames = int((duration * Config.VIDEO_FRAME_RATE + 1) if duration is not None else Config.VIDEO_DURATION * Config.VIDEO_FRAME_RATE)
-        if video_frames < Config.VIDEO_MIN_FRAMES or video_frames > Config.VIDEO_MAX_FRAMES:
-            logger.error(f"场景 {scene_id} 的音频帧数不在[{Config.VIDEO_MIN_FRAMES},{Config.VIDEO_MAX_FRAMES}]范围内")
-            raise Exception(f"场景 {scene_id} 的音频帧数不在[{Config.VIDEO_MIN_FRAMES},{Config.VIDEO_MAX_FRAMES}]范围内")
-        logger.info(f"场景{scene_id}生成{video_frames}帧视频")
+    if not video_url:
+        logger.error(f"场景 {scene_id} 视频生成超时或失败")
+        raise Exception(f"场景 {scene_id} 视频生成超时或失败")
+
+    return video_url
+
+def build_video_task_body(image_base64_start: str, image_base64_end: str, video_prompt: str, video_frames: int, config: RunConfig) -> str:
+    """构建即梦首尾帧图生视频任务的请求体"""
+    body = {"req_key": config.jimeng_model_name,"binary_data_base64":[image_base64_start,image_base64_end],
+            "prompt":video_prompt,"frames":video_frames
+            }
+    return json.dumps(body, separators=(",", ":"))
 
+def get_video_task_id(video_task_result: Dict[str, Any], scene_id: str) -> str:
+    """检查任务提交结果并返回任务ID"""
+    if not video_task_result.get("code") == 100000:
+        # 带上错误码与信息，账号池据此区分限流、额度与鉴权错误
+        error = video_task_result.get("ResponseMetadata", {}).get("Error", {})
+        reason = " ".join(str(v) for v in (video_task_result.get("code"), video_task_result.get("message"), error.get("Code"), error.get("Message")) if v)
+        logger.error(f"场景{scene_id}的视频生成任务创建失败：{reason}")
+        raise Exception(f"场景{scene_id}的视频生成任务创建失败：{reason}")
+    task_id = video_task_result["data"]["task_id"]
+    set_log_context(task_id=task_id)
+    logger.info(f"场景 {scene_id} 的视频生成任务ID：{task_id}")
+    return task_id
+
+def run_video_task(scene_id: str, image_base64_start: str, image_base64_end: str, video_prompt: str, video_frames: int, config: Optional[RunConfig] = None) -> str:
+    """
+    提交即梦首尾帧图生视频任务并轮询结果，返回视频URL
+
+    从账号池分配一个未达并发上限的账号完成提交与轮询，期间占用该账号的一个并发槽位。
+    """
+    config = resolve_config(config)
+    pool = get_credential_pool(PROVIDER_JIMENG, config)
+    with lease_video_account(config) as account:
         #调用即梦AI生成视频
         #jimeng_i2v_first_tail_v30:即梦AI-视频生成3.0 720P-图生视频-首尾帧
         #jimeng_i2v_first_tail_v30_1080:即梦AI-视频生成3.0 1080P-图生视频-首尾帧
         #jimeng_ti2v_v30_pro:即梦AI-视频生成3.0 Pro
-        body = {"req_key": Config.JIMENG_MODEL_NAME,"binary_data_base64":[scene_info["image_base64_start"],scene_info["image_base64_end"]],
-                "prompt":video_prompt,"frames":video_frames
-                }
-        payload_str = json.dumps(body, separators=(",", ":"))
-        video_task_result = request("POST","CVSync2AsyncSubmitTask",payload_str)
+        payload_str = build_video_task_body(image_base64_start, image_base64_end, video_prompt, video_frames, config)
+        video_task_result = request("POST","CVSync2AsyncSubmitTask",payload_str,config=config,account=account.secret)
         # client = Ark(
         #     api_key=Config.DOUBAO_API_KEY,
         #     base_url="https://ark.cn-beijing.volces.com/api/v3"
@@ -243,31 +433,249 @@ def generate_single_video(scene_info: Dict[str, Any], video_dir: str, duration:
 
         #     ],
         # )
-        if not video_task_result["code"] == 100000:
-            logger.error(f"场景{scene_id}的视频生成任务创建失败")
-            raise Exception(f"场景{scene_id}的视频生成任务创建失败")
-        task_id = video_task_result["data"]["task_id"]
-        logger.info(f"场景 {scene_id} 的视频生成任务ID：{task_id}")
-        
+        task_id = get_video_task_id(video_task_result, scene_id)
+        pool.pin(task_id, account)
+        # 任务提交即计费，轮询中途放弃（超过截止时间）也已产生费用
+        charge_video(video_frames, config)
+
         #轮询查询视频生成结果
         video_url = poll_video_status(
             task_id=task_id,
             scene_id=scene_id,
-            max_retries=Config.MAX_VIDEO_RETRIES,
-            poll_interval=Config.VIDEO_POLL_INTERVAL
+            max_retries=config.max_video_retries,
+            poll_interval=config.video_poll_interval,
+            config=config,
+            account=account.secret,
+            expected_seconds=estimate_clip_seconds(video_frames, config)
         )
+    return video_url
+
+
+def parse_video_prompt(video_prompt: str) -> Any:
+    """解析视频提示词，返回(video_prompt, narration)"""
+    narration = None
+    # Try to parse strict JSON of prompt if it returns JSON string
+    try:
+         json_prompt = json.loads(video_prompt)
+         if isinstance(json_prompt, dict) and "video_prompt" in json_prompt:
+             video_prompt = json_prompt["video_prompt"]
+             narration = json_prompt.get("narration")
+    except:
+         pass # assume it is raw text if not json
+    return video_prompt, narration
+
+def get_video_frames(scene_id: str, duration: Optional[float], frames: Optional[int], config: RunConfig) -> int:
+    """确定视频帧数并检查是否在即梦允许范围内"""
+    if frames is not None:
+        video_frames = int(frames)
+    else:
+        video_frames = int((duration * config.video_frame_rate + 1) if duration is not None else config.video_duration * config.video_frame_rate)
+    if video_frames < config.video_min_frames or video_frames > config.video_max_frames:
+        logger.error(f"场景 {scene_id} 的音频帧数不在[{config.video_min_frames},{config.video_max_frames}]范围内")
+        raise Exception(f"场景 {scene_id} 的音频帧数不在[{config.video_min_frames},{config.video_max_frames}]范围内")
+    logger.info(f"场景{scene_id}生成{video_frames}帧视频")
+    return video_frames
+
+def video_clip_key(scene_info: Dict[str, Any], video_frames: int, config: RunConfig) -> str:
+    """视频片段的媒体库键：由首尾帧、帧数、场景内容与模型决定（视频提示词由这些输入生成）"""
+    return media_key(
+        "video_clip",
+        model=config.jimeng_model_name,
+        resolution=config.video_resolution,
+        start=text_digest(scene_info["image_base64_start"]),
+        end=text_digest(scene_info["image_base64_end"]),
+        frames=video_frames,
+        content=scene_info.get("scene_content", ""),
+    )
+
+def use_text_video_prompt(scene_info: Dict[str, Any], config: RunConfig) -> bool:
+    """
+    是否仅凭首尾帧的文生图提示词生成视频提示词
+
+    首尾帧提示词未知（断点续传时没有记录），或首尾帧几乎相同（画面与提示词描述的动作不符）时，
+    回退到上传首尾帧图片的方式。
+    """
+    if config.video_prompt_mode != VIDEO_PROMPT_TEXT:
+        return False
+    scene_id = scene_info["scene_id"]
+    if not (scene_info.get("image_prompt_start") and scene_info.get("image_prompt_end")):
+        logger.info(f"场景 {scene_id} 的首尾帧提示词未知，上传首尾帧图片生成视频提示词")
+        return False
+    start_path, end_path = scene_info.get("image_path_start"), scene_info.get("image_path_end")
+    if quality_gate_enabled(config) and start_path and end_path and frames_too_similar(start_path, end_path, config):
+        logger.info(f"场景 {scene_id} 的首尾帧过于相似，上传首尾帧图片生成视频提示词")
+        return False
+    return True
+
+def stream_video_clip(scene_id: str, video_url: str, save_path: str, video_frames: int, mux: Dict[str, Any], keep_raw: bool, config: RunConfig) -> bool:
+    """
+    边下载边与配音合并为mux["output_path"]，keep_raw时同时保存原始片段到save_path
+
+    录制/回放时下载需经过录制层，不走此路径。合并失败或结果未通过检查时返回False，由调用方改为先下载再合并；
+    moov位于文件末尾（非faststart）的MP4无法从管道读取，也会走这一回退。
+    """
+    if get_cassette() is not None:
+        return False
+    logger.info(f"场景 {scene_id} 边下载边合并配音...")
+    raw_path = save_path if keep_raw else None
+    if not mux_video_stream(iter_download(video_url), mux["audio_path"], mux["output_path"], pad_audio=mux["pad_audio"], keep_path=raw_path):
+        return False
+    problem = probe_clip(mux["output_path"], config, video_frames) if quality_gate_enabled(config) else None
+    if problem:
+        logger.warning(f"场景 {scene_id} 合并后的视频未通过检查：{problem}，改为先下载再合并")
+        for path in (mux["output_path"], raw_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        return False
+    return True
+
+def prepare_video_clip(scene_info: Dict[str, Any], video_dir: str, duration: Optional[float], frames: Optional[int], save_path: Optional[str], config: RunConfig) -> Dict[str, Any]:
+    """确定片段帧数、保存路径与媒体库键，同步与异步版本共用"""
+    scene_id = scene_info["scene_id"]
+    video_frames = get_video_frames(scene_id, duration, frames, config)
+    store = get_media_store(config)
+    return {
+        "scene_id": scene_id,
+        "video_frames": video_frames,
+        "save_path": save_path or os.path.join(video_dir, f"{scene_id}.mp4"),
+        "store": store,
+        "key": video_clip_key(scene_info, video_frames, config) if store else None,
+    }
+
+def video_clip_result(clip: Dict[str, Any], video_url: Optional[str] = None, narration: Optional[str] = None) -> Dict[str, Any]:
+    return {"scene_id": clip["scene_id"], "video_url": video_url, "video_path": clip["save_path"], "narration": narration}
+
+def fetch_video_clip(clip: Dict[str, Any]) -> bool:
+    """媒体库命中时链接到保存路径，不再生成提示词和提交即梦任务"""
+    return clip["store"] is not None and clip["store"].fetch(clip["key"], clip["save_path"])
+
+def keep_raw_clip(clip: Dict[str, Any]) -> bool:
+    """边下载边合并配音时是否仍需保存原始片段：只在媒体库缺少该片段时保存（生成期间可能已由其他运行存入）"""
+    return clip["store"] is not None and not clip["store"].contains(clip["key"])
+
+def save_video_clip(clip: Dict[str, Any]) -> None:
+    if clip["store"]:
+        clip["store"].save(clip["key"], clip["save_path"])
+
+def check_video_clip(clip: Dict[str, Any], config: RunConfig, retried: bool = False) -> bool:
+    """
+    检查下载的片段
+
+    通过检查（或未启用质量检查）时返回True；首次未通过时返回False，下载不完整时重新下载即可，无需重新生成；
+    重新下载后仍未通过时抛出异常。
+    """
+    if not retried and not quality_gate_enabled(config):
+        return True
+    problem = probe_clip(clip["save_path"], config, clip["video_frames"])
+    if not problem:
+        return True
+    if retried:
+        raise Exception(f"场景 {clip['scene_id']} 视频未通过检查：{problem}")
+    logger.warning(f"场景 {clip['scene_id']} 视频未通过检查：{problem}，重新下载")
+    return False
+
+def generate_single_video(scene_info: Dict[str, Any], video_dir: str, duration: float = None, frames: int = None, save_path: str = None, mux: Optional[Dict[str, Any]] = None, config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """
+    生成单个场景（或场景子片段）的视频
+
+    Args:
+        scene_info: 场景信息，需包含首尾帧base64
+        video_dir: 视频保存目录
+        duration: 视频时长（秒），未指定frames时据此计算帧数
+        frames: 视频帧数，优先于duration
+        save_path: 视频保存路径，默认为video_dir/{scene_id}.mp4
+        mux: 下载时直接合并配音的参数（audio_path、output_path、pad_audio），合并成功时仅在媒体库缺少该片段时保存原始片段
+        config: 运行配置
+    """
+    config = resolve_config(config)
+    scene_id = scene_info["scene_id"]
+    logger.info(f"生成场景 {scene_id} 的视频...")
+    
+    try:
+        clip = prepare_video_clip(scene_info, video_dir, duration, frames, save_path, config)
+        if config.provider == PROVIDER_LOCAL:
+            os.makedirs(video_dir, exist_ok=True)
+            return local_generate_video(scene_info, clip["video_frames"], clip["save_path"], config)
+        if fetch_video_clip(clip):
+            return video_clip_result(clip)
+
+        # 生成视频提示词
+        video_prompt, narration = parse_video_prompt(generate_video_prompt(scene_info, text_only=use_text_video_prompt(scene_info, config), config=config))
+        logger.info("场景 %s 的视频生成提示词：%s", scene_id, payload(video_prompt))
+
+        #调用即梦AI生成视频
+        video_url = run_video_task(scene_id, scene_info["image_base64_start"], scene_info["image_base64_end"], video_prompt, clip["video_frames"], config=config)
         
         os.makedirs(video_dir, exist_ok=True)
-        save_path = os.path.join(video_dir, f"{scene_id}.mp4")
-        video_result = download_video(video_url, save_path)
+        keep_raw = keep_raw_clip(clip)
+        if mux and stream_video_clip(scene_id, video_url, clip["save_path"], clip["video_frames"], mux, keep_raw, config):
+            if keep_raw:
+                save_video_clip(clip)
+            return video_clip_result(clip, video_url, narration)
+        video_result = download_video(video_url, clip["save_path"])
         logger.info(f"场景 {scene_id} {video_result}")
-        
-        return {
-            "scene_id": scene_id,
-            "video_url": video_url,
-            "video_path": save_path,
-            "narration": narration
-        }
+        if not check_video_clip(clip, config):
+            download_video(video_url, clip["save_path"])
+            check_video_clip(clip, config, retried=True)
+        save_video_clip(clip)
+        return video_clip_result(clip, video_url, narration)
+    except Exception as e:
+        logger.error(f"生成场景 {scene_id} 的视频失败: {e}")
+        raise
+
+async def arun_video_task(scene_id: str, image_base64_start: str, image_base64_end: str, video_prompt: str, video_frames: int, config: Optional[RunConfig] = None) -> str:
+    """run_video_task的异步版本"""
+    config = resolve_config(config)
+    pool = get_credential_pool(PROVIDER_JIMENG, config)
+    async with alease_video_account(config) as account:
+        payload_str = build_video_task_body(image_base64_start, image_base64_end, video_prompt, video_frames, config)
+        video_task_result = await arequest("POST","CVSync2AsyncSubmitTask",payload_str,config=config,account=account.secret)
+        task_id = get_video_task_id(video_task_result, scene_id)
+        pool.pin(task_id, account)
+        charge_video(video_frames, config)
+        video_url = await apoll_video_status(
+            task_id=task_id,
+            scene_id=scene_id,
+            max_retries=config.max_video_retries,
+            poll_interval=config.video_poll_interval,
+            config=config,
+            account=account.secret,
+            expected_seconds=estimate_clip_seconds(video_frames, config)
+        )
+    return video_url
+
+async def agenerate_single_video(scene_info: Dict[str, Any], video_dir: str, duration: float = None, frames: int = None, save_path: str = None, mux: Optional[Dict[str, Any]] = None, config: Optional[RunConfig] = None) -> Dict[str, Any]:
+    """generate_single_video的异步版本，媒体库与ffmpeg等阻塞操作放到线程中执行"""
+    config = resolve_config(config)
+    scene_id = scene_info["scene_id"]
+    logger.info(f"生成场景 {scene_id} 的视频...")
+    try:
+        clip = prepare_video_clip(scene_info, video_dir, duration, frames, save_path, config)
+        if config.provider == PROVIDER_LOCAL:
+            os.makedirs(video_dir, exist_ok=True)
+            return await asyncio.to_thread(local_generate_video, scene_info, clip["video_frames"], clip["save_path"], config)
+        if await asyncio.to_thread(fetch_video_clip, clip):
+            return video_clip_result(clip)
+
+        text_only = await asyncio.to_thread(use_text_video_prompt, scene_info, config)
+        video_prompt, narration = parse_video_prompt(await agenerate_video_prompt(scene_info, text_only=text_only, config=config))
+        logger.info("场景 %s 的视频生成提示词：%s", scene_id, payload(video_prompt))
+
+        video_url = await arun_video_task(scene_id, scene_info["image_base64_start"], scene_info["image_base64_end"], video_prompt, clip["video_frames"], config=config)
+
+        os.makedirs(video_dir, exist_ok=True)
+        keep_raw = await asyncio.to_thread(keep_raw_clip, clip)
+        if mux and await asyncio.to_thread(stream_video_clip, scene_id, video_url, clip["save_path"], clip["video_frames"], mux, keep_raw, config):
+            if keep_raw:
+                await asyncio.to_thread(save_video_clip, clip)
+            return video_clip_result(clip, video_url, narration)
+        video_result = await adownload_video(video_url, clip["save_path"])
+        logger.info(f"场景 {scene_id} {video_result}")
+        if not await asyncio.to_thread(check_video_clip, clip, config):
+            await adownload_video(video_url, clip["save_path"])
+            await asyncio.to_thread(check_video_clip, clip, config, True)
+        await asyncio.to_thread(save_video_clip, clip)
+        return video_clip_result(clip, video_url, narration)
     except Exception as e:
         logger.error(f"生成场景 {scene_id} 的视频失败: {e}")
         raise
@@ -0,0 +1,197 @@
+import os
+import re
+import json
+import wave
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from app.config import RunConfig, resolve_config, PROVIDER_LOCAL
+from app.utils.logger import setup_logger, log_context
+from app.utils.file_ops import atomic_output
+from app.utils.media_store import get_media_store, media_key
+from app.utils.video_ops import get_audio_duration
+from app.utils.cassette import cassette_file
+
+logger = setup_logger(__name__)
+
+# 语音合成引擎：输入文案与保存路径，写入WAV文件；失败时抛出异常
+TTSEngine = Callable[[str, str, RunConfig], None]
+
+TTS_ENGINES: Dict[str, TTSEngine] = {}
+
+# 记录各场景配音对应的合成请求键，文案与音色不变时重跑直接跳过
+TTS_MANIFEST = "tts_manifest.json"
+
+_manifest_lock = threading.Lock()
+
+
+def register_tts_engine(name: str) -> Callable[[TTSEngine], TTSEngine]:
+    """注册语音合成引擎，通过config.tts_engine选择"""
+    def register(engine: TTSEngine) -> TTSEngine:
+        TTS_ENGINES[name] = engine
+        return engine
+    return register
+
+
+def estimate_narration_duration(text: str, config: RunConfig) -> float:
+    """按语速估算文案朗读时长（秒），标点不计入字数"""
+    chars = len(re.sub(r"[\s，。！？、；：“”‘’（）《》,.!?;:\"'()]", "", text))
+    return max(1.0, chars / config.tts_chars_per_second)
+
+
+@register_tts_engine("local")
+def local_tts(text: str, save_path: str, config: RunConfig) -> None:
+    """
+    本地替身引擎：按语速估算时长写入静音WAV
+
+    不调用任何服务，时长与真实配音接近，用于测试与离线预览中的片段规划和音画对齐。
+    """
+    sample_rate = 24000
+    frames = int(estimate_narration_duration(text, config) * sample_rate)
+    with atomic_output(save_path) as tmp_path:
+        with wave.open(tmp_path, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(b"\x00\x00" * frames)
+
+
+@register_tts_engine("cosyvoice")
+def cosyvoice_tts(text: str, save_path: str, config: RunConfig) -> None:
+    """阿里云百炼CosyVoice语音合成（与LLM共用DashScope凭证）"""
+    # 延迟导入DashScope SDK
+    import dashscope
+    from dashscope.audio.tts_v2 import SpeechSynthesizer, AudioFormat
+    api_key = config.tts_api_key or config.llm_api_key
+    if not api_key:
+        raise Exception("未配置DashScope凭证（DASHSCOPE_API_KEY或LLM_API_KEY）")
+    # 凭证随请求头传入，不修改SDK的全局api_key；SDK构造时仍要求全局api_key非空，仅在未设置时填入一次
+    if dashscope.api_key is None:
+        dashscope.api_key = api_key
+    synthesizer = SpeechSynthesizer(
+        model=config.tts_model,
+        voice=config.tts_voice,
+        format=AudioFormat.WAV_24000HZ_MONO_16BIT,
+        headers={"Authorization": f"Bearer {api_key}"},
+    )
+    audio = synthesizer.call(text)
+    if not audio:
+        raise Exception(f"语音合成无返回数据，request_id：{synthesizer.get_last_request_id()}")
+    with atomic_output(save_path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+
+
+def get_tts_engine_name(config: RunConfig) -> str:
+    """离线模式使用本地替身引擎"""
+    return "local" if config.provider == PROVIDER_LOCAL else config.tts_engine
+
+
+def voice_key(text: str, config: RunConfig) -> str:
+    """配音的请求键：文案、引擎、模型与音色"""
+    engine = get_tts_engine_name(config)
+    if engine == "local":
+        return media_key("tts", engine=engine, text=text, chars_per_second=config.tts_chars_per_second)
+    return media_key("tts", engine=engine, model=config.tts_model, voice=config.tts_voice, text=text)
+
+
+def load_manifest(voice_dir: str) -> Dict[str, str]:
+    path = os.path.join(voice_dir, TTS_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_manifest(voice_dir: str, scene_id: str, key: str) -> None:
+    with _manifest_lock:
+        manifest = load_manifest(voice_dir)
+        manifest[scene_id] = key
+        with atomic_output(os.path.join(voice_dir, TTS_MANIFEST)) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def run_tts_engine(engine_name: str, text: str, save_path: str, config: RunConfig) -> str:
+    TTS_ENGINES[engine_name](text, save_path, config)
+    return f"配音已成功保存至：{save_path}"
+
+
+def synthesize_scene_voice(scene_id: str, text: str, config: Optional[RunConfig] = None) -> Optional[float]:
+    """
+    合成单个场景的配音到voice_dir/{scene_id}.wav，返回音频时长
+
+    已有配音对应的请求键与本次一致时跳过；没有合成记录的已有文件视为手动准备的配音，保持不变。
+    请求键相同的配音从媒体库复用。
+    """
+    config = resolve_config(config)
+    save_path = os.path.join(config.voice_dir, f"{scene_id}.wav")
+    key = voice_key(text, config)
+    recorded = load_manifest(config.voice_dir).get(scene_id)
+    if os.path.exists(save_path) and recorded in (None, key):
+        return get_audio_duration(save_path)
+
+    store = get_media_store(config)
+    if not (store and store.fetch(key, save_path)):
+        engine_name = get_tts_engine_name(config)
+        if engine_name not in TTS_ENGINES:
+            raise Exception(f"未知的语音合成引擎：{engine_name}")
+        logger.info(f"合成场景 {scene_id} 的配音（{engine_name}，{len(text)}字）...")
+        if engine_name == "local":
+            TTS_ENGINES[engine_name](text, save_path, config)
+        else:
+            cassette_file("tts", {"key": key}, save_path, lambda: run_tts_engine(engine_name, text, save_path, config))
+        if store:
+            store.save(key, save_path)
+    update_manifest(config.voice_dir, scene_id, key)
+    duration = get_audio_duration(save_path)
+    logger.info(f"场景 {scene_id} 配音完成，时长：{duration:.2f}s")
+    return duration
+
+
+def synthesize_voice_script(voice_script: Dict[str, Dict], scene_ids: List[str], config: Optional[RunConfig] = None) -> Dict[str, float]:
+    """
+    并发合成各场景配音
+
+    Returns:
+        {scene_id: 音频时长}，合成失败的场景不包含在内（视频按默认时长生成）
+    """
+    config = resolve_config(config)
+    if not config.tts_engine:
+        return {}
+    os.makedirs(config.voice_dir, exist_ok=True)
+
+    def run(scene_id: str) -> Optional[float]:
+        with log_context(scene_id=scene_id, stage="tts"):
+            try:
+                return synthesize_scene_voice(scene_id, voice_script[scene_id]["content"], config)
+            except Exception as e:
+                logger.error(f"场景 {scene_id} 配音合成失败：{e}")
+                return None
+
+    with ThreadPoolExecutor(max_workers=max(1, config.tts_concurrency)) as executor:
+        durations = dict(zip(scene_ids, executor.map(lambda sid: contextvars.copy_context().run(run, sid), scene_ids)))
+    return {scene_id: duration for scene_id, duration in durations.items() if duration}
+
+
+async def asynthesize_voice_script(voice_script: Dict[str, Dict], scene_ids: List[str], config: Optional[RunConfig] = None) -> Dict[str, float]:
+    """synthesize_voice_script的异步版本，合成在线程中执行，并发数受tts_concurrency限制"""
+    config = resolve_config(config)
+    if not config.tts_engine:
+        return {}
+    os.makedirs(config.voice_dir, exist_ok=True)
+    slots = asyncio.Semaphore(max(1, config.tts_concurrency))
+
+    async def run(scene_id: str) -> Optional[float]:
+        async with slots:
+            with log_context(scene_id=scene_id, stage="tts"):
+                try:
+                    return await asyncio.to_thread(synthesize_scene_voice, scene_id, voice_script[scene_id]["content"], config)
+                except Exception as e:
+                    logger.error(f"场景 {scene_id} 配音合成失败：{e}")
+                    return None
+
+    durations = await asyncio.gather(*(run(scene_id) for scene_id in scene_ids))
+    return {scene_id: duration for scene_id, duration in zip(scene_ids, durations) if duration}
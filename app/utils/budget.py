@@ -0,0 +1,185 @@
+import time
+import threading
+import contextvars
+from collections import defaultdict
+from typing import Any, Dict, Optional
+from app.config import RunConfig, resolve_config
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 计费的调用类型
+COST_LLM = "llm"
+COST_IMAGE = "image"
+COST_VIDEO = "video"
+
+COST_LABELS = {COST_LLM: "LLM", COST_IMAGE: "文生图", COST_VIDEO: "即梦视频"}
+
+
+class DeadlineExceeded(Exception):
+    """已无望在截止时间前完成"""
+
+
+class RunBudget:
+    """
+    单次运行的费用记账与截止时间
+
+    按调用类型记录调用次数、预计费用与实际费用；场景开始生成前为其预留预计费用，
+    避免并发执行的场景合计超出预算，场景结束后释放预留。
+    """
+
+    def __init__(self, budget: Optional[float] = None, deadline_at: Optional[float] = None):
+        self.budget = budget
+        self.deadline_at = deadline_at
+        self.started_at = time.time()
+        self.reserved = 0.0
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.estimated: Dict[str, float] = defaultdict(float)
+        self.actual: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def charge(self, kind: str, actual: float, estimated: float) -> None:
+        with self._lock:
+            self.calls[kind] += 1
+            self.actual[kind] += actual
+            self.estimated[kind] += estimated
+
+    @property
+    def spent(self) -> float:
+        with self._lock:
+            return sum(self.actual.values())
+
+    def remaining_money(self) -> Optional[float]:
+        """剩余可用预算（扣除已花费与已预留），未设置预算时返回None"""
+        if self.budget is None:
+            return None
+        with self._lock:
+            return self.budget - sum(self.actual.values()) - self.reserved
+
+    def remaining_seconds(self) -> Optional[float]:
+        """距截止时间的剩余秒数，未设置截止时间时返回None"""
+        if self.deadline_at is None:
+            return None
+        return self.deadline_at - time.time()
+
+    def reserve(self, amount: float) -> bool:
+        """预留费用，剩余预算不足时返回False"""
+        with self._lock:
+            if self.budget is not None and sum(self.actual.values()) + self.reserved + amount > self.budget:
+                return False
+            self.reserved += amount
+            return True
+
+    def release(self, amount: float) -> None:
+        with self._lock:
+            self.reserved = max(0.0, self.reserved - amount)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                kind: {"calls": self.calls[kind], "estimated": self.estimated[kind], "actual": self.actual[kind]}
+                for kind in self.calls
+            }
+
+
+_run_budget: contextvars.ContextVar[Optional[RunBudget]] = contextvars.ContextVar("run_budget", default=None)
+
+
+def start_run_budget(config: RunConfig, deadline_at: Optional[float] = None) -> contextvars.Token:
+    """
+    在当前上下文中开始本次运行的记账，返回的token需在运行结束时传给end_run_budget
+
+    线程池任务需通过contextvars.copy_context().run继承（与日志上下文相同）。
+    deadline_at为绝对时间戳，未传入时由config.deadline_seconds自当前时刻起算。
+    """
+    if deadline_at is None and config.deadline_seconds:
+        deadline_at = time.time() + config.deadline_seconds
+    return _run_budget.set(RunBudget(config.budget, deadline_at))
+
+
+def end_run_budget(token: contextvars.Token) -> None:
+    """结束本次运行的记账，避免预算泄漏到同一线程（如服务的作业线程）上的后续运行"""
+    _run_budget.reset(token)
+
+
+def get_run_budget() -> Optional[RunBudget]:
+    return _run_budget.get()
+
+
+def budget_exhausted() -> bool:
+    """本次运行的预算已用完或已超过截止时间"""
+    budget = _run_budget.get()
+    if budget is None:
+        return False
+    remaining_money, remaining_seconds = budget.remaining_money(), budget.remaining_seconds()
+    return (remaining_money is not None and remaining_money <= 0) or (remaining_seconds is not None and remaining_seconds <= 0)
+
+
+def charge(kind: str, actual: float, estimated: float) -> None:
+    budget = _run_budget.get()
+    if budget is not None:
+        budget.charge(kind, actual, estimated)
+
+
+def charge_llm(usage: Optional[Dict[str, Any]], config: RunConfig) -> None:
+    """按token用量记录LLM调用的费用，响应不含用量时按单次调用的估计值记录"""
+    if not usage:
+        charge(COST_LLM, config.llm_cost_per_call, config.llm_cost_per_call)
+        return
+    actual = (usage.get("input_tokens", 0) * config.llm_input_cost_per_1k_tokens
+              + usage.get("output_tokens", 0) * config.llm_output_cost_per_1k_tokens) / 1000
+    charge(COST_LLM, actual, config.llm_cost_per_call)
+
+
+def charge_images(count: int, config: RunConfig) -> None:
+    """记录文生图费用（按提交的请求数，对冲发出的重复请求同样计费）"""
+    charge(COST_IMAGE, count * config.image_cost_per_call, config.image_cost_per_call)
+
+
+def estimate_clip_seconds(frames: int, config: Optional[RunConfig] = None) -> float:
+    """估算单个即梦子片段从提交到完成的耗时（排队 + 按帧数生成）"""
+    config = resolve_config(config)
+    return config.jimeng_queue_seconds + frames * config.jimeng_seconds_per_frame
+
+
+def video_cost(frames: int, config: RunConfig) -> float:
+    """即梦视频按时长计费，时长由帧数换算（首帧 + 每秒frame_rate帧）"""
+    return max(frames - 1, 0) / config.video_frame_rate * config.video_cost_per_second
+
+
+def charge_video(frames: int, config: RunConfig) -> None:
+    """记录即梦视频费用，任务提交成功即计费（之后放弃轮询也已产生费用）"""
+    cost = video_cost(frames, config)
+    charge(COST_VIDEO, cost, cost)
+
+
+def poll_hopeless(elapsed: float, expected: float, config: RunConfig) -> Optional[str]:
+    """
+    设置了截止时间时判断轮询中的即梦任务是否已无望完成，返回原因，仍有希望时返回None
+
+    已超过截止时间，或轮询耗时超过预计耗时的poll_stuck_factor倍（任务卡住）时放弃轮询，释放并发槽位。
+    """
+    budget = _run_budget.get()
+    if budget is None or budget.deadline_at is None:
+        return None
+    if time.time() >= budget.deadline_at:
+        return "已超过截止时间"
+    if config.poll_stuck_factor and elapsed > expected * config.poll_stuck_factor:
+        return f"已轮询{elapsed:.0f}s，超过预计耗时{expected:.0f}s的{config.poll_stuck_factor:g}倍"
+    return None
+
+
+def log_run_spend() -> None:
+    """打印本次运行各类调用的预计与实际费用"""
+    budget = _run_budget.get()
+    if budget is None:
+        return
+    summary = budget.summary()
+    if not summary:
+        return
+    parts = [
+        f"{COST_LABELS.get(kind, kind)} {stats['calls']}次 实际{stats['actual']:.2f}元（预计{stats['estimated']:.2f}元）"
+        for kind, stats in summary.items()
+    ]
+    limit = f"，预算{budget.budget:.2f}元" if budget.budget is not None else ""
+    logger.info(f"本次运行费用：{'；'.join(parts)}；合计{budget.spent:.2f}元{limit}，耗时{time.time() - budget.started_at:.0f}s")
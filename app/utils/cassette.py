@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import hashlib
+import tempfile
+import threading
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+T = TypeVar("T")
+
+# 录制/回放：录制时记录所有服务交互（LLM、文生图、即梦提交与轮询、下载的文件），
+# 回放时按原始或缩放后的耗时返回录制结果，不调用任何服务
+CASSETTE_RECORD = "record"
+CASSETTE_REPLAY = "replay"
+
+INDEX_FILE = "index.jsonl"
+
+
+class CassetteMiss(Exception):
+    """回放时找不到对应的录制交互（请求与录制时不同）"""
+
+
+def request_key(kind: str, request: Any) -> str:
+    """交互的请求键：类型 + 请求内容（模型、消息、参数、请求体等）的哈希"""
+    data = json.dumps([kind, request], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    内容寻址的交互录制
+
+    index.jsonl按发生顺序记录每次交互的请求键、耗时与响应对象摘要；响应（JSON或下载的文件）
+    以zlib压缩后按内容摘要存放在objects/下，相同的响应（如即梦轮询中的"生成中"）只存一份。
+    同一请求键的多次交互（轮询、重试）回放时按录制顺序依次返回，超出录制次数时重复最后一次。
+    """
+
+    def __init__(self, root: str, mode: str, time_scale: float = 1.0):
+        if mode not in (CASSETTE_RECORD, CASSETTE_REPLAY):
+            raise ValueError(f"未知的录制模式：{mode}")
+        self.root = root
+        self.mode = mode
+        self.time_scale = time_scale
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursors: Dict[str, int] = defaultdict(int)
+        if mode == CASSETTE_REPLAY:
+            if not os.path.exists(self.index_path):
+                raise FileNotFoundError(f"录制文件不存在：{self.index_path}")
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(entry)
+            logger.info(f"回放录制 {root}：{sum(len(e) for e in self._entries.values())}次交互，耗时缩放{time_scale}")
+        else:
+            os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+            logger.info(f"录制服务交互到 {root}")
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest[2:])
+
+    def put_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(data))
+            os.replace(tmp_path, path)
+        return digest
+
+    def get_blob(self, digest: str) -> bytes:
+        with open(self.object_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def append(self, kind: str, key: str, elapsed: float, blob: Optional[str] = None, error: Optional[str] = None) -> None:
+        entry = {"kind": kind, "key": key, "elapsed": round(elapsed, 3), "blob": blob, "error": error}
+        with self._lock:
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def next_entry(self, kind: str, key: str) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(f"录制中没有对应的{kind}交互（请求键{key[:12]}）")
+            index = min(self._cursors[key], len(entries) - 1)
+            self._cursors[key] += 1
+            return entries[index]
+
+    def delay(self, seconds: float) -> float:
+        return seconds * self.time_scale
+
+
+_cassette: Optional[Cassette] = None
+
+
+def use_cassette(root: Optional[str], mode: Optional[str] = None, time_scale: float = 1.0) -> Optional[Cassette]:
+    """启用（root为None时关闭）进程内的录制或回放"""
+    global _cassette
+    _cassette = Cassette(root, mode, time_scale) if root else None
+    return _cassette
+
+
+def get_cassette() -> Optional[Cassette]:
+    return _cassette
+
+
+def encode_payload(payload: Any) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def cassette_call(kind: str, request: Any, func: Callable[[], T], encode: Callable[[T], Any], decode: Callable[[Any], T]) -> T:
+    """
+    经过录制层执行一次服务调用
+
+    Args:
+        kind: 交互类型（llm、image、volc等）
+        request: 决定响应的请求内容，不含凭证
+        func: 实际调用
+        encode: 将响应转为可JSON序列化的对象
+        decode: 将录制的对象还原为调用方使用的响应
+    """
+    cassette = _cassette
+    if cassette is None:
+        return func()
+    key = request_key(kind, request)
+    if cassette.mode == CASSETTE_REPLAY:
+        entry = cassette.next_entry(kind, key)
+        time.sleep(cassette.delay(entry["elapsed"]))
+        if entry["error"]:
+            raise Exception(entry["error"])
+        return decode(json.loads(cassette.get_blob(entry["blob"])))
+    start = time.monotonic()
+    try:
+        result = func()
+    except Exception as e:
+        cassette.append(kind, key, time.monotonic() - start, error=str(e))
+        raise
+    cassette.append(kind, key, time.monotonic() - start, blob=cassette.put_blob(encode_payload(encode(result))))
+    return result
+
+
+async def acassette_call(kind: str, request: Any, func: Callable[[], Awaitable[T]], encode: Callable[[T], Any], decode: Callable[[Any], T]) -> T:
+    """cassette_call的异步版本"""
+    cassette = _cassette
+    if cassette is None:
+        return await func()
+    key = request_key(kind, request)
+    if cassette.mode == CASSETTE_REPLAY:
+        entry = cassette.next_entry(kind, key)
+        await asyncio.sleep(cassette.delay(entry["elapsed"]))
+        if entry["error"]:
+            raise Exception(entry["error"])
+        return decode(json.loads(cassette.get_blob(entry["blob"])))
+    start = time.monotonic()
+    try:
+        result = await func()
+    except Exception as e:
+        cassette.append(kind, key, time.monotonic() - start, error=str(e))
+        raise
+    cassette.append(kind, key, time.monotonic() - start, blob=cassette.put_blob(encode_payload(encode(result))))
+    return result
+
+
+def cassette_file(kind: str, request: Any, save_path: str, func: Callable[[], str]) -> str:
+    """
+    经过录制层下载文件：录制时保存下载的文件内容，回放时直接写出录制的文件
+
+    func为实际下载函数，返回下载结果信息；下载失败的结果信息同样被录制。
+    """
+    cassette = _cassette
+    if cassette is None:
+        return func()
+    key = request_key(kind, request)
+    if cassette.mode == CASSETTE_REPLAY:
+        entry = cassette.next_entry(kind, key)
+        time.sleep(cassette.delay(entry["elapsed"]))
+        return restore_file(cassette, entry, save_path)
+    start = time.monotonic()
+    result = func()
+    record_file(cassette, kind, key, time.monotonic() - start, save_path, result)
+    return result
+
+
+async def acassette_file(kind: str, request: Any, save_path: str, func: Callable[[], Awaitable[str]]) -> str:
+    """cassette_file的异步版本"""
+    cassette = _cassette
+    if cassette is None:
+        return await func()
+    key = request_key(kind, request)
+    if cassette.mode == CASSETTE_REPLAY:
+        entry = cassette.next_entry(kind, key)
+        await asyncio.sleep(cassette.delay(entry["elapsed"]))
+        return await asyncio.to_thread(restore_file, cassette, entry, save_path)
+    start = time.monotonic()
+    result = await func()
+    await asyncio.to_thread(record_file, cassette, kind, key, time.monotonic() - start, save_path, result)
+    return result
+
+
+def record_file(cassette: Cassette, kind: str, key: str, elapsed: float, save_path: str, result: str) -> None:
+    content = None
+    if "成功" in result and os.path.exists(save_path):
+        with open(save_path, "rb") as f:
+            content = cassette.put_blob(f.read())
+    cassette.append(kind, key, elapsed, blob=cassette.put_blob(encode_payload({"result": result, "content": content})))
+
+
+def restore_file(cassette: Cassette, entry: Dict[str, Any], save_path: str) -> str:
+    record = json.loads(cassette.get_blob(entry["blob"]))
+    if record["content"]:
+        os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(save_path) or ".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(cassette.get_blob(record["content"]))
+        os.replace(tmp_path, save_path)
+    return record["result"]
+
+
+def cassette_sleep(seconds: float) -> None:
+    """轮询等待等流程内的等待，回放时按耗时缩放"""
+    time.sleep(_cassette.delay(seconds) if _cassette is not None and _cassette.mode == CASSETTE_REPLAY else seconds)
+
+
+async def acassette_sleep(seconds: float) -> None:
+    """cassette_sleep的异步版本"""
+    await asyncio.sleep(_cassette.delay(seconds) if _cassette is not None and _cassette.mode == CASSETTE_REPLAY else seconds)
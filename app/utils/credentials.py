@@ -0,0 +1,260 @@
+import time
+import asyncio
+import threading
+import contextlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from app.config import RunConfig, resolve_config
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 凭证池：同一服务配置多个账号时按最少占用分配调用，突破单账号的QPS与并发任务限制
+
+PROVIDER_LLM = "llm"
+PROVIDER_SEEDREAM = "seedream"
+PROVIDER_JIMENG = "jimeng"
+
+# 错误类型：鉴权失败与额度耗尽的账号被隔离，限流的账号短暂冷却
+ERROR_AUTH = "auth"
+ERROR_QUOTA = "quota"
+ERROR_THROTTLE = "throttle"
+
+AUTH_MARKERS = ("InvalidApiKey", "invalid_api_key", "Unauthorized", "AuthenticationError", "SignatureDoesNotMatch", "InvalidAccessKey", "AccessDenied")
+QUOTA_MARKERS = ("Arrearage", "insufficient_quota", "QuotaExceeded", "AccountOverdue", "FreeTierOnly")
+THROTTLE_MARKERS = ("Throttling", "RateLimit", "rate limit", "Too Many Requests", "Concurrent Limit", "50429", "50430")
+
+
+def classify_error(error: BaseException) -> Optional[str]:
+    """根据HTTP状态码与错误信息判断是否为账号相关的错误"""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    text = f"{type(error).__name__} {error}"
+    if status in (401, 403) or any(marker in text for marker in AUTH_MARKERS):
+        return ERROR_AUTH
+    if any(marker in text for marker in QUOTA_MARKERS):
+        return ERROR_QUOTA
+    if status == 429 or any(marker in text for marker in THROTTLE_MARKERS):
+        return ERROR_THROTTLE
+    return None
+
+
+class Credential:
+    """单个账号的凭证及其占用、限流与隔离状态"""
+
+    def __init__(self, provider: str, secret: Any):
+        self.provider = provider
+        self.secret = secret
+        key_id = secret[0] if isinstance(secret, tuple) else secret
+        self.label = f"{key_id[:4]}…{key_id[-4:]}" if key_id else "default"
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self.available_at = 0.0  # 冷却或隔离结束的时间（monotonic）
+        self.quarantined = False
+        self.last_error: Optional[str] = None
+
+
+class CredentialPool:
+    """
+    单个服务的账号池
+
+    每次调用选择未被隔离、不在冷却中且正在进行的调用最少的账号，全部被隔离时抛出异常。
+    指定limit（单账号并发上限，如即梦的video_concurrency）时不会让任何账号超过上限：
+    没有空闲账号（均已满或在冷却中）时等待，直到有账号释放或冷却结束；
+    未指定limit时全部账号冷却中则选择最早恢复的账号。即梦任务ID与提交它的账号绑定，轮询使用同一账号。
+    """
+
+    def __init__(self, provider: str, secrets: List[Any]):
+        self.provider = provider
+        self.credentials = [Credential(provider, secret) for secret in secrets]
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._pinned: "OrderedDict[str, Credential]" = OrderedDict()
+
+    @property
+    def size(self) -> int:
+        return len(self.credentials)
+
+    def available(self) -> int:
+        """未被隔离的账号数"""
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for c in self.credentials if not (c.quarantined and c.available_at > now))
+
+    def _try_select(self, limit: Optional[int]) -> Tuple[Optional[Credential], Optional[float]]:
+        """
+        在持有锁时选择账号，返回(账号, None)；没有空闲账号时返回(None, 最长等待秒数)，
+        等待秒数为None表示只能等待其他调用释放账号
+        """
+        now = time.monotonic()
+        usable = [c for c in self.credentials if not (c.quarantined and c.available_at > now)]
+        if not usable:
+            raise Exception(f"{self.provider}没有可用的账号（全部因鉴权或额度错误被隔离）")
+        ready = [c for c in usable if c.available_at <= now and (limit is None or c.in_flight < limit)]
+        if ready:
+            credential = min(ready, key=lambda c: (c.in_flight, c.calls))
+        elif limit is None:
+            credential = min(usable, key=lambda c: c.available_at)
+            logger.warning(f"{self.provider}的账号均在限流冷却中，使用最早恢复的账号 {credential.label}")
+        else:
+            cooling = [c.available_at - now for c in usable if c.available_at > now and c.in_flight < limit]
+            return None, min(cooling) if cooling else None
+        credential.quarantined = credential.quarantined and credential.available_at > now
+        credential.in_flight += 1
+        credential.calls += 1
+        return credential, None
+
+    def select(self, limit: Optional[int] = None) -> Credential:
+        """选择账号，指定limit且没有空闲账号时阻塞等待"""
+        with self._released:
+            while True:
+                credential, wait = self._try_select(limit)
+                if credential is not None:
+                    return credential
+                self._released.wait(wait)
+
+    async def aselect(self, limit: Optional[int] = None) -> Credential:
+        """select的异步版本，等待期间不阻塞事件循环"""
+        while True:
+            with self._lock:
+                credential, wait = self._try_select(limit)
+            if credential is not None:
+                return credential
+            await asyncio.sleep(min(wait, 1.0) if wait is not None else 0.5)
+
+    def release(self, credential: Credential, error: Optional[BaseException] = None, config: Optional[RunConfig] = None) -> None:
+        config = resolve_config(config)
+        kind = classify_error(error) if error is not None else None
+        with self._released:
+            credential.in_flight -= 1
+            if kind in (ERROR_AUTH, ERROR_QUOTA):
+                credential.quarantined = True
+                credential.available_at = time.monotonic() + config.credential_quarantine_seconds
+                credential.last_error = str(error)
+            elif kind == ERROR_THROTTLE:
+                credential.throttled += 1
+                credential.available_at = time.monotonic() + config.credential_cooldown_seconds
+                credential.last_error = str(error)
+            self._released.notify_all()
+        if kind in (ERROR_AUTH, ERROR_QUOTA):
+            reason = "鉴权失败" if kind == ERROR_AUTH else "额度耗尽"
+            logger.error(f"{self.provider}账号 {credential.label} {reason}，隔离{config.credential_quarantine_seconds}秒：{error}")
+        elif kind == ERROR_THROTTLE:
+            logger.warning(f"{self.provider}账号 {credential.label} 被限流，冷却{config.credential_cooldown_seconds}秒")
+
+    @contextlib.contextmanager
+    def lease(self, config: Optional[RunConfig] = None, limit: Optional[int] = None) -> Iterator[Credential]:
+        """占用一个账号执行调用，调用抛出的账号相关错误会更新该账号的状态"""
+        credential = self.select(limit)
+        try:
+            yield credential
+        except BaseException as e:
+            self.release(credential, e, config)
+            raise
+        self.release(credential, config=config)
+
+    @contextlib.asynccontextmanager
+    async def alease(self, config: Optional[RunConfig] = None, limit: Optional[int] = None) -> AsyncIterator[Credential]:
+        """lease的异步版本"""
+        credential = await self.aselect(limit)
+        try:
+            yield credential
+        except BaseException as e:
+            self.release(credential, e, config)
+            raise
+        self.release(credential, config=config)
+
+    def pin(self, task_id: str, credential: Credential) -> None:
+        """记录任务由哪个账号提交（只保留最近的任务）"""
+        with self._lock:
+            self._pinned[task_id] = credential
+            while len(self._pinned) > 10000:
+                self._pinned.popitem(last=False)
+
+    def pinned(self, task_id: str) -> Optional[Credential]:
+        with self._lock:
+            return self._pinned.get(task_id)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "account": c.label,
+                    "in_flight": c.in_flight,
+                    "calls": c.calls,
+                    "throttled": c.throttled,
+                    "quarantined": c.quarantined and c.available_at > now,
+                    "cooldown": max(0.0, c.available_at - now),
+                    "last_error": c.last_error,
+                }
+                for c in self.credentials
+            ]
+
+
+def unique(values: List[Any]) -> List[Any]:
+    return list(dict.fromkeys(v for v in values if v))
+
+
+def get_secrets(provider: str, config: RunConfig) -> Tuple[Any, ...]:
+    """运行配置中该服务的全部凭证（单账号字段与多账号列表合并去重）"""
+    if provider == PROVIDER_LLM:
+        secrets = unique([config.llm_api_key, *config.llm_api_keys])
+    elif provider == PROVIDER_SEEDREAM:
+        secrets = unique([config.doubao_api_key, *config.doubao_api_keys])
+    elif provider == PROVIDER_JIMENG:
+        pairs = [(config.access_key_id, config.secret_access_key), *config.jimeng_credentials]
+        secrets = unique([tuple(pair) for pair in pairs if pair[0] and pair[1]])
+    else:
+        raise ValueError(f"未知的服务：{provider}")
+    # 未配置任何凭证时保留一个空凭证，由SDK按环境变量处理
+    return tuple(secrets) or (None,)
+
+
+_pools: Dict[tuple, CredentialPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_credential_pool(provider: str, config: Optional[RunConfig] = None) -> CredentialPool:
+    """返回进程内共享的账号池，同一组凭证的占用与隔离状态在各工作流之间共享"""
+    config = resolve_config(config)
+    secrets = get_secrets(provider, config)
+    key = (provider, secrets)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = CredentialPool(provider, list(secrets))
+        return _pools[key]
+
+
+def get_video_capacity(config: Optional[RunConfig] = None) -> int:
+    """即梦视频任务的总并发数：单账号并发上限 × 未被隔离的账号数（全部被隔离时按1个账号估算）"""
+    config = resolve_config(config)
+    return max(1, config.video_concurrency) * max(1, get_credential_pool(PROVIDER_JIMENG, config).available())
+
+
+@contextlib.contextmanager
+def lease_video_account(config: Optional[RunConfig] = None) -> Iterator[Credential]:
+    """占用一个即梦账号的并发槽位（每个账号同时最多video_concurrency个任务），提交到轮询结束期间占用"""
+    config = resolve_config(config)
+    with get_credential_pool(PROVIDER_JIMENG, config).lease(config, max(1, config.video_concurrency)) as account:
+        yield account
+
+
+@contextlib.asynccontextmanager
+async def alease_video_account(config: Optional[RunConfig] = None) -> AsyncIterator[Credential]:
+    """lease_video_account的异步版本"""
+    config = resolve_config(config)
+    async with get_credential_pool(PROVIDER_JIMENG, config).alease(config, max(1, config.video_concurrency)) as account:
+        yield account
+
+
+def log_credential_stats() -> None:
+    """输出多账号池中各账号的调用、限流与隔离情况"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        if pool.size < 2:
+            continue
+        for stats in pool.stats():
+            state = "隔离中" if stats["quarantined"] else (f"冷却{stats['cooldown']:.0f}s" if stats["cooldown"] else "可用")
+            logger.info(f"账号统计 {pool.provider} {stats['account']}：调用{stats['calls']}次，限流{stats['throttled']}次，{state}")
@@ -1,12 +1,147 @@
 import os
 import re
-import requests
+import time
+import uuid
 import base64
-from typing import Dict
+import socket
+import asyncio
+import contextlib
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List
 from app.utils.logger import setup_logger
+from app.utils.cassette import cassette_file, acassette_file
+
+if TYPE_CHECKING:
+    import requests
 
 logger = setup_logger(__name__)
 
+# 进程内共享的HTTP会话（每个线程一个，复用连接池）
+_http_local = threading.local()
+
+def get_http_session() -> "requests.Session":
+    """获取当前线程的HTTP会话"""
+    session = getattr(_http_local, "session", None)
+    if session is None:
+        # 延迟导入requests，仅在首次发起网络请求时加载
+        import requests
+        session = requests.Session()
+        _http_local.session = session
+    return session
+
+# 每个事件循环一个异步HTTP客户端（httpx客户端不能跨事件循环使用）
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+def get_async_http_client() -> Any:
+    """获取当前事件循环的异步HTTP客户端（httpx.AsyncClient）"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        # 延迟导入httpx，仅异步路径需要
+        import httpx
+        client = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0), limits=httpx.Limits(max_connections=200))
+        _async_clients[loop] = client
+    return client
+
+@contextlib.contextmanager
+def atomic_output(path: str) -> Iterator[str]:
+    """
+    原子写入：在同目录的临时文件中写入，成功后重命名为目标文件
+
+    断点续传以文件是否存在判断产物是否完成，写入中途失败或多机并发写入时不会留下半截文件。
+    临时文件保留原扩展名，ffmpeg可据此推断输出格式。
+    """
+    directory, name = os.path.split(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _, ext = os.path.splitext(name)
+    tmp_path = os.path.join(directory, f".{name}.{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}.tmp{ext}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def read_lock_owner(lock_path: str) -> str:
+    """锁文件中记录的持有者，锁文件不存在时返回空字符串"""
+    try:
+        with open(lock_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+def take_over_stale_lock(lock_path: str, stale_seconds: float) -> None:
+    """
+    清除过期的锁文件
+
+    先将锁文件原子地改名为唯一的名字再复核：多个等待者同时判定过期时只有一个能改名成功，
+    不会误删其他等待者刚创建的新锁；改名后发现并未过期（期间已被他人换成新锁）时原样放回。
+    """
+    stale_path = f"{lock_path}.stale.{uuid.uuid4().hex}"
+    try:
+        os.rename(lock_path, stale_path)
+    except FileNotFoundError:
+        return
+    if time.time() - os.path.getmtime(stale_path) > stale_seconds:
+        logger.warning(f"清除过期的锁文件：{lock_path}")
+    else:
+        # os.link在目标已存在时失败，不会覆盖此后创建的锁
+        with contextlib.suppress(FileExistsError):
+            os.link(stale_path, lock_path)
+    os.remove(stale_path)
+
+@contextlib.contextmanager
+def file_lock(path: str, stale_seconds: float = 600, poll_interval: float = 1.0) -> Iterator[None]:
+    """
+    跨进程/跨机器的文件锁（共享存储上以O_EXCL创建锁文件）
+
+    持锁期间后台线程定期刷新锁文件修改时间；超过stale_seconds未刷新的锁视为持有者已退出并被接管。
+    锁文件记录持有者，释放与刷新时只处理自己持有的锁。
+    """
+    lock_path = path + ".lock"
+    directory = os.path.dirname(lock_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex[:8]}"
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(owner)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_seconds:
+                    take_over_stale_lock(lock_path, stale_seconds)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(poll_interval)
+
+    released = threading.Event()
+
+    def refresh() -> None:
+        while not released.wait(stale_seconds / 3):
+            if read_lock_owner(lock_path) != owner:
+                logger.warning(f"锁文件已被接管：{lock_path}")
+                return
+            with contextlib.suppress(OSError):
+                os.utime(lock_path)
+
+    refresher = threading.Thread(target=refresh, name="file-lock-refresh", daemon=True)
+    refresher.start()
+    try:
+        yield
+    finally:
+        released.set()
+        if read_lock_owner(lock_path) == owner:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(lock_path)
+        else:
+            logger.warning(f"锁文件已被接管，不再删除：{lock_path}")
+
 def download_file(url: str, save_path: str, file_type: str = "文件") -> str:
     """
     通用文件下载函数
@@ -19,6 +154,10 @@ def download_file(url: str, save_path: str, file_type: str = "文件") -> str:
     Returns:
         下载结果信息
     """
+    return cassette_file("download", {"url": url}, save_path, lambda: fetch_file(url, save_path, file_type))
+
+def fetch_file(url: str, save_path: str, file_type: str) -> str:
+    import requests
     try:
         # 确保保存目录存在
         save_dir = os.path.dirname(save_path)
@@ -26,11 +165,11 @@ def download_file(url: str, save_path: str, file_type: str = "文件") -> str:
             os.makedirs(save_dir, exist_ok=True)
         
         # 发送GET请求
-        response = requests.get(url, stream=True) # stream=True支持大文件流式下载
+        response = get_http_session().get(url, stream=True) # stream=True支持大文件流式下载
         response.raise_for_status() # 检查请求是否成功（状态码200）
 
         # 以二进制写入模式保存文件
-        with open(save_path, 'wb') as file:
+        with atomic_output(save_path) as tmp_path, open(tmp_path, 'wb') as file:
             for chunk in response.iter_content(chunk_size=8192): # 分块写入
                 file.write(chunk)
         return f"{file_type}已成功保存至：{save_path}"
@@ -44,6 +183,42 @@ def download_file(url: str, save_path: str, file_type: str = "文件") -> str:
         logger.error(f"{file_type}下载和保存失败：{e}")
         return f"下载和保存失败，错误信息：{e}"
 
+async def adownload_file(url: str, save_path: str, file_type: str = "文件") -> str:
+    """download_file的异步版本"""
+    return await acassette_file("download", {"url": url}, save_path, lambda: afetch_file(url, save_path, file_type))
+
+async def afetch_file(url: str, save_path: str, file_type: str) -> str:
+    import httpx
+    try:
+        # 确保保存目录存在
+        save_dir = os.path.dirname(save_path)
+        if save_dir and not os.path.exists(save_dir):
+            os.makedirs(save_dir, exist_ok=True)
+
+        client = get_async_http_client()
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            with atomic_output(save_path) as tmp_path, open(tmp_path, 'wb') as file:
+                async for chunk in response.aiter_bytes(chunk_size=65536): # 分块写入
+                    file.write(chunk)
+        return f"{file_type}已成功保存至：{save_path}"
+    except httpx.HTTPError as e:
+        logger.error(f"{file_type}下载失败：{e}")
+        return f"下载失败，错误信息：{e}"
+    except OSError as e:
+        logger.error(f"{file_type}保存失败：{e}")
+        return f"保存失败，错误信息：{e}"
+    except Exception as e:
+        logger.error(f"{file_type}下载和保存失败：{e}")
+        return f"下载和保存失败，错误信息：{e}"
+
+def iter_download(url: str, chunk_size: int = 65536) -> Iterator[bytes]:
+    """流式下载，逐块返回数据而不写入磁盘，请求失败时抛出异常"""
+    response = get_http_session().get(url, stream=True)
+    with contextlib.closing(response):
+        response.raise_for_status()
+        yield from response.iter_content(chunk_size=chunk_size)
+
 def download_image(url: str, save_path: str) -> str:
     """下载图片并保存到本地"""
     return download_file(url, save_path, "图片")
@@ -52,6 +227,14 @@ def download_video(url: str, save_path: str) -> str:
     """下载视频并保存到本地"""
     return download_file(url, save_path, "视频")
 
+async def adownload_image(url: str, save_path: str) -> str:
+    """download_image的异步版本"""
+    return await adownload_file(url, save_path, "图片")
+
+async def adownload_video(url: str, save_path: str) -> str:
+    """download_video的异步版本"""
+    return await adownload_file(url, save_path, "视频")
+
 def image_to_base64(image_path: str) -> str:
     """
     将本地图片转换为base64编码
@@ -96,3 +279,31 @@ def load_novel(file_path: str) -> Dict[str, str]:
     except Exception as e:
         logger.error(f"加载小说失败: {e}")
         return {}
+
+def split_chapter(chapter_content: str, max_chars: int) -> List[str]:
+    """
+    按段落边界将章节切分为不超过max_chars字的若干块
+
+    超长的单个段落再按句子切分，返回的各块按原文顺序排列。
+    """
+    units: List[str] = []
+    for paragraph in (p.strip() for p in chapter_content.split("\n")):
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            units.append(paragraph)
+        else:
+            units.extend(s for s in re.split(r"(?<=[。！？!?])", paragraph) if s.strip())
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for unit in units:
+        if current and size + len(unit) > max_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(unit)
+        size += len(unit)
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
@@ -0,0 +1,247 @@
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+from app.config import RunConfig, resolve_config
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+T = TypeVar("T")
+
+# 每类调用保留最近的成功耗时样本数
+LATENCY_WINDOW = 200
+
+
+
+class HedgePool:
+    """
+    同步对冲调用的线程池
+
+    主请求与对冲请求都在线程池中执行，以便在主请求阻塞时先返回对冲结果。
+    只在有空闲线程时提交，任务不会在线程池中排队：线程占满时主请求改在调用方线程执行（不对冲），
+    对冲请求直接放弃，因此线程池大小不会限制同步调用的并发数。
+    """
+
+    def __init__(self, size: int):
+        self._slots = threading.BoundedSemaphore(size)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="hedge")
+
+    def submit(self, func: Callable[[], T]) -> Optional["Future[T]"]:
+        """有空闲线程时提交func（继承调用方的上下文变量），否则返回None"""
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        def run() -> T:
+            try:
+                return func()
+            finally:
+                self._slots.release()
+
+        try:
+            return self._executor.submit(contextvars.copy_context().run, run)
+        except BaseException:
+            self._slots.release()
+            raise
+
+
+_pools: Dict[int, HedgePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_hedge_pool(config: RunConfig) -> HedgePool:
+    size = max(1, config.hedge_max_workers)
+    with _pools_lock:
+        if size not in _pools:
+            _pools[size] = HedgePool(size)
+        return _pools[size]
+
+
+class HedgeTracker:
+    """
+    单类调用（如某个文生图模型、某种LLM调用）的耗时分布与对冲计数
+
+    对冲请求数不超过总调用数的budget比例；样本不足min_samples时不对冲。
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def start_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+
+    def hedge_delay(self, config: RunConfig, budget: float) -> Optional[float]:
+        """返回发出对冲请求前的等待时间，不允许对冲时返回None"""
+        if budget <= 0 or len(self._latencies) < config.hedge_min_samples:
+            return None
+        return self.quantile(config.hedge_quantile)
+
+    def try_hedge(self, budget: float) -> bool:
+        """在预算内占用一次对冲名额"""
+        with self._lock:
+            if self.hedged + 1 > budget * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    def cancel_hedge(self) -> None:
+        """归还未能发出的对冲名额"""
+        with self._lock:
+            self.hedged -= 1
+
+    def record_win(self) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> Dict[str, Any]:
+        p50, p90, p99 = (self.quantile(q) for q in (0.5, 0.9, 0.99))
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "samples": len(self._latencies),
+                "p50": p50,
+                "p90": p90,
+                "p99": p99,
+            }
+
+
+_trackers: Dict[str, HedgeTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(key: str) -> HedgeTracker:
+    with _trackers_lock:
+        if key not in _trackers:
+            _trackers[key] = HedgeTracker(key)
+        return _trackers[key]
+
+
+def get_hedge_stats() -> Dict[str, Dict[str, Any]]:
+    """各类调用的对冲统计（进程内累计）"""
+    with _trackers_lock:
+        trackers = list(_trackers.values())
+    return {tracker.key: tracker.stats() for tracker in trackers}
+
+
+def log_hedge_stats() -> None:
+    for key, stats in get_hedge_stats().items():
+        if stats["calls"]:
+            p90 = f"{stats['p90']:.1f}s" if stats["p90"] is not None else "-"
+            logger.info(
+                f"对冲统计 {key}：调用{stats['calls']}次，对冲{stats['hedged']}次（{stats['hedge_rate']:.1%}），"
+                f"对冲胜出{stats['hedge_wins']}次，p90 {p90}"
+            )
+
+
+def hedged_call(key: str, func: Callable[[], T], config: Optional[RunConfig] = None, budget: Optional[float] = None) -> T:
+    """
+    带对冲的同步调用
+
+    调用开始执行后超过该类调用观测到的p90耗时仍未返回时（且在对冲预算内），再发出一个相同的请求，
+    取先成功的结果；已在执行的落后请求无法中断，其结果被忽略。对冲线程池（config.hedge_max_workers）
+    占满时不对冲。两个请求都失败时抛出先失败的异常。budget为对冲预算，默认使用config.hedge_budget。
+    """
+    config = resolve_config(config)
+    budget = config.hedge_budget if budget is None else budget
+    tracker = get_tracker(key)
+    tracker.start_call()
+    delay = tracker.hedge_delay(config, budget)
+
+    def attempt() -> Any:
+        start = time.monotonic()
+        result = func()
+        tracker.record(time.monotonic() - start)
+        return result
+
+    pool = get_hedge_pool(config)
+    primary = pool.submit(attempt) if delay is not None else None
+    if primary is None:
+        return attempt()
+
+    done, _ = wait([primary], timeout=delay)
+    if done or not tracker.try_hedge(budget):
+        return primary.result()
+
+    hedge = pool.submit(attempt)
+    if hedge is None:
+        tracker.cancel_hedge()
+        logger.debug(f"{key} 对冲线程已占满，放弃对冲")
+        return primary.result()
+    logger.info(f"{key} 调用超过p90耗时{delay:.1f}秒，发出对冲请求")
+    pending = {primary, hedge}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    tracker.record_win()
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+async def ahedged_call(key: str, func: Callable[[], Awaitable[T]], config: Optional[RunConfig] = None, budget: Optional[float] = None) -> T:
+    """hedged_call的异步版本，先成功的请求返回后取消另一个请求"""
+    config = resolve_config(config)
+    budget = config.hedge_budget if budget is None else budget
+    tracker = get_tracker(key)
+    tracker.start_call()
+    delay = tracker.hedge_delay(config, budget)
+
+    async def attempt() -> Any:
+        start = time.monotonic()
+        result = await func()
+        tracker.record(time.monotonic() - start)
+        return result
+
+    if delay is None:
+        return await attempt()
+
+    tasks = [asyncio.ensure_future(attempt())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not tracker.try_hedge(budget):
+            return await tasks[0]
+
+        logger.info(f"{key} 调用超过p90耗时{delay:.1f}秒，发出对冲请求")
+        tasks.append(asyncio.ensure_future(attempt()))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is tasks[1]:
+                        tracker.record_win()
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        # 调用方被取消或已有请求胜出时，取消仍在进行的请求
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -1,20 +1,167 @@
+import atexit
+import contextlib
+import contextvars
+import json
 import logging
-import os
+import queue
+import threading
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterator, Optional
+from app.config import Config
+
+# 日志上下文字段：作业ID（服务模式）、场景ID、阶段、任务ID，随调用链（contextvars）传递
+CONTEXT_FIELDS = ("job_id", "scene_id", "stage", "task_id")
+_log_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("log_context", default={})
+
+_queue_handler: Optional[QueueHandler] = None
+_listener: Optional[QueueListener] = None
+_init_lock = threading.Lock()
+
+
+class ContextFilter(logging.Filter):
+    """将当前日志上下文写入日志记录"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    不在调用线程格式化消息的QueueHandler
+
+    标准QueueHandler在入队前即完成msg % args的格式化，这里仅预先渲染异常堆栈，
+    消息格式化推迟到监听线程中进行，工作线程只付出入队的开销。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """以JSON Lines格式输出日志，便于机器聚合"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """控制台文本格式，存在上下文时在消息前附加[字段=值]"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(context)s%(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        tags = [f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS if getattr(record, field, None) is not None]
+        record.context = f"[{' '.join(tags)}] " if tags else ""
+        return super().format(record)
+
+
+class LogPayload:
+    """
+    大文本的延迟渲染包装
+
+    仅在日志真正被格式化时才截断/渲染；按内容哈希抽样，抽中的记录保留全文，
+    其余只保留前limit个字符，避免完整提示词与base64刷满日志。
+    """
+    __slots__ = ("value", "limit", "sample_rate")
+
+    def __init__(self, value: Any, limit: int, sample_rate: float):
+        self.value = value
+        self.limit = limit
+        self.sample_rate = sample_rate
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        if self.sample_rate > 0 and (zlib.crc32(text.encode("utf-8")) % 10000) < self.sample_rate * 10000:
+            return text
+        return f"{text[:self.limit]}...(共{len(text)}字)"
+
+
+def payload(value: Any, limit: int = None, sample_rate: float = None) -> LogPayload:
+    """包装大文本日志参数，用法：logger.debug("提示词：%s", payload(prompt))"""
+    return LogPayload(
+        value,
+        Config.LOG_PAYLOAD_LIMIT if limit is None else limit,
+        Config.LOG_PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate,
+    )
+
+
+@contextlib.contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """
+    在代码块内为日志附加上下文字段（job_id/scene_id/stage/task_id）
+
+    注意线程池不会自动继承上下文，提交任务时需通过contextvars.copy_context().run传递，
+    或在任务函数内部调用。
+    """
+    token = _log_context.set({**_log_context.get(), **{k: v for k, v in fields.items() if k in CONTEXT_FIELDS}})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def get_log_context() -> Dict[str, Any]:
+    """返回当前日志上下文字段"""
+    return dict(_log_context.get())
+
+
+def set_log_context(**fields: Any) -> None:
+    """在当前上下文中追加字段（如提交任务后得到的task_id），作用到所在log_context结束"""
+    _log_context.set({**_log_context.get(), **{k: v for k, v in fields.items() if k in CONTEXT_FIELDS}})
+
+
+def _get_queue_handler() -> QueueHandler:
+    """创建进程内唯一的日志队列及监听线程，磁盘与控制台写入都在监听线程中完成"""
+    global _queue_handler, _listener
+    with _init_lock:
+        if _queue_handler is None:
+            log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+            # Console Handler
+            ch = logging.StreamHandler()
+            ch.setFormatter(ConsoleFormatter())
+
+            # File Handler (JSON Lines)
+            fh = logging.FileHandler(Config.LOG_FILE, encoding='utf-8')
+            fh.setFormatter(JsonFormatter())
+
+            _listener = QueueListener(log_queue, ch, fh, respect_handler_level=True)
+            _listener.start()
+            atexit.register(_listener.stop)
+
+            _queue_handler = DeferredQueueHandler(log_queue)
+            _queue_handler.addFilter(ContextFilter())
+        return _queue_handler
+
 
 def setup_logger(name: str):
     logger = logging.getLogger(name)
     if not logger.handlers:
-        logger.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        
-        # Console Handler
-        ch = logging.StreamHandler()
-        ch.setFormatter(formatter)
-        logger.addHandler(ch)
-        
-        # File Handler
-        fh = logging.FileHandler('novel_video.log', encoding='utf-8')
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
-        
+        logger.setLevel(getattr(logging, Config.LOG_LEVEL, logging.INFO))
+        logger.addHandler(_get_queue_handler())
+
     return logger
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional
+from app.config import RunConfig, resolve_config, PROVIDER_LOCAL
+from app.utils.logger import setup_logger
+from app.utils.file_ops import atomic_output
+
+logger = setup_logger(__name__)
+
+
+def media_key(kind: str, **fields: Any) -> str:
+    """根据生成请求（类型、模型、提示词、参考图、帧数等）计算内容寻址的键"""
+    canonical = json.dumps([kind, fields], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def text_digest(text: str) -> str:
+    """大段文本（如base64图片）的摘要，用于组成请求键"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=1024)
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path: str) -> Optional[str]:
+    """文件内容摘要（按路径、大小、修改时间缓存），文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return _file_digest(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+class MediaStore:
+    """
+    全局内容寻址媒体库
+
+    产物按生成请求的哈希存放在objects/下，各运行目录中的文件是指向库中对象的硬链接
+    （跨设备时退化为复制）。对象的引用数即硬链接数减一；垃圾回收按最近访问时间
+    淘汰没有引用的对象，直到总大小不超过预算。
+    """
+
+    def __init__(self, root: str, budget_bytes: int):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._db_path = os.path.join(root, "index.db")
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS objects (
+                    key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._db_path, timeout=30)
+
+    def object_path(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, "objects", key[:2], key + ext)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT path FROM objects WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(row[0]):
+                conn.execute("DELETE FROM objects WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE objects SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    @staticmethod
+    def _link(src: str, dest: str) -> None:
+        """在dest处原子地创建src的硬链接，跨设备或不支持硬链接时复制"""
+        with atomic_output(dest) as tmp_path:
+            try:
+                os.link(src, tmp_path)
+            except OSError:
+                shutil.copy2(src, tmp_path)
+
+    def contains(self, key: str) -> bool:
+        """库中是否已有该键的对象"""
+        return self._lookup(key) is not None
+
+    def fetch(self, key: str, dest_path: str) -> bool:
+        """命中时将库中对象链接到dest_path并返回True"""
+        object_path = self._lookup(key)
+        if object_path is None:
+            return False
+        if os.path.exists(dest_path) and os.path.samefile(object_path, dest_path):
+            return True
+        self._link(object_path, dest_path)
+        logger.info(f"媒体库命中：{dest_path}")
+        return True
+
+    def save(self, key: str, src_path: str) -> bool:
+        """将新生成的文件收入库中，src_path随即成为库中对象的一个引用"""
+        if not os.path.exists(src_path):
+            return False
+        if self._lookup(key):
+            return True
+        object_path = self.object_path(key, os.path.splitext(src_path)[1])
+        self._link(src_path, object_path)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO objects (key, path, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, object_path, os.path.getsize(object_path), now, now),
+            )
+        return True
+
+    def usage(self) -> Dict[str, int]:
+        """库中对象总数、总大小及其中无引用对象的数量与大小"""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT path, size FROM objects").fetchall()
+        unreferenced = [(p, s) for p, s in rows if os.path.exists(p) and os.stat(p).st_nlink <= 1]
+        return {
+            "objects": len(rows),
+            "bytes": sum(s for _, s in rows),
+            "unreferenced_objects": len(unreferenced),
+            "unreferenced_bytes": sum(s for _, s in unreferenced),
+        }
+
+    def gc(self, budget_bytes: Optional[int] = None) -> Dict[str, int]:
+        """
+        按LRU淘汰无引用的对象，直到库大小不超过预算
+
+        仍被运行目录引用的对象不会被删除（删除后磁盘空间也不会释放），
+        只在所有引用都被清理后才成为回收对象。
+        """
+        budget = self.budget_bytes if budget_bytes is None else budget_bytes
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT key, path, size FROM objects ORDER BY last_access ASC").fetchall()
+            total = sum(size for _, _, size in rows)
+            removed, freed = 0, 0
+            for key, path, size in rows:
+                if total <= budget:
+                    break
+                try:
+                    if os.stat(path).st_nlink > 1:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM objects WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+                freed += size
+        if removed:
+            logger.info(f"媒体库回收了{removed}个对象，释放{freed / (1 << 20):.1f}MB")
+        if total > budget:
+            logger.warning(f"媒体库大小{total / (1 << 30):.2f}GB仍超出预算，其余对象仍被运行目录引用")
+        return {"removed": removed, "freed_bytes": freed, "bytes": total}
+
+
+_stores: Dict[str, MediaStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_media_store(config: Optional[RunConfig] = None) -> Optional[MediaStore]:
+    """返回配置对应的媒体库，未启用（media_store_dir为空）或离线模式时返回None"""
+    config = resolve_config(config)
+    # 离线占位产物与付费生成的请求键相同，不能收入媒体库
+    if not config.media_store_dir or config.provider == PROVIDER_LOCAL:
+        return None
+    root = os.path.abspath(config.media_store_dir)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = MediaStore(root, int(config.media_store_budget_gb * (1 << 30)))
+        return _stores[root]
@@ -0,0 +1,113 @@
+import os
+import re
+import subprocess
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+from app.config import RunConfig, PROVIDER_LOCAL
+from app.utils.logger import setup_logger
+from app.utils.video_ops import get_ffmpeg_exe, get_media_duration
+
+logger = setup_logger(__name__)
+
+# 本地质量检查：在把首尾帧提交给即梦（按次计费）之前，以及接受下载的视频之前，
+# 用ffmpeg解码 + NumPy统计排除损坏、全黑/纯色、首尾帧几乎相同和截断的产物
+
+# 检查用的灰度缩略图尺寸，72x64可整除为9x8的差值哈希块
+THUMB_WIDTH, THUMB_HEIGHT = 72, 64
+
+
+def quality_gate_enabled(config: RunConfig) -> bool:
+    """离线模式的占位卡片本身就是纯色图，不做检查"""
+    return config.quality_gate and config.provider != PROVIDER_LOCAL
+
+
+@lru_cache(maxsize=256)
+def _decode_thumbnail(path: str, size: int, mtime_ns: int) -> Tuple[Any, Optional[str]]:
+    import numpy as np
+    cmd = [
+        get_ffmpeg_exe(), "-v", "error", "-err_detect", "explode", "-i", path,
+        "-frames:v", "1", "-vf", f"scale={THUMB_WIDTH}:{THUMB_HEIGHT}:flags=area,format=gray",
+        "-f", "rawvideo", "-",
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0 or result.stderr.strip() or len(result.stdout) != THUMB_WIDTH * THUMB_HEIGHT:
+        error = result.stderr.decode("utf-8", errors="replace").strip().splitlines()
+        return None, f"图片无法完整解码（{error[-1] if error else '输出为空'}）"
+    return np.frombuffer(result.stdout, dtype=np.uint8).reshape(THUMB_HEIGHT, THUMB_WIDTH), None
+
+
+def decode_thumbnail(path: str) -> Tuple[Any, Optional[str]]:
+    """解码为灰度缩略图，返回(像素数组, 错误描述)；按路径、大小与修改时间缓存"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None, "文件不存在"
+    if stat.st_size == 0:
+        return None, "文件为空"
+    return _decode_thumbnail(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def dhash(pixels: Any) -> int:
+    """64位差值哈希：缩为8x9后比较每行相邻像素的明暗"""
+    import numpy as np
+    small = pixels.astype(np.float32).reshape(8, THUMB_HEIGHT // 8, 9, THUMB_WIDTH // 9).mean(axis=(1, 3))
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def check_frame(path: str, config: RunConfig) -> Optional[str]:
+    """检查单帧图片，合格返回None，否则返回问题描述"""
+    pixels, error = decode_thumbnail(path)
+    if error:
+        return error
+    mean, std = float(pixels.mean()), float(pixels.std())
+    if mean < config.frame_black_level:
+        return f"画面全黑（平均亮度{mean:.1f}）"
+    if std < config.frame_flat_std:
+        return f"画面为纯色或几乎无内容（亮度标准差{std:.1f}）"
+    return None
+
+
+def frame_distance(path_a: str, path_b: str) -> Optional[int]:
+    """两帧差值哈希的汉明距离，任一帧无法解码时返回None"""
+    pixels_a, _ = decode_thumbnail(path_a)
+    pixels_b, _ = decode_thumbnail(path_b)
+    if pixels_a is None or pixels_b is None:
+        return None
+    return bin(dhash(pixels_a) ^ dhash(pixels_b)).count("1")
+
+
+def frames_too_similar(start_path: str, end_path: str, config: RunConfig) -> bool:
+    """首尾帧几乎相同时图生视频只会得到静止画面"""
+    distance = frame_distance(start_path, end_path)
+    return distance is not None and distance < config.frame_min_hash_distance
+
+
+def probe_clip(path: str, config: RunConfig, expected_frames: Optional[int] = None) -> Optional[str]:
+    """
+    完整解码视频并统计帧数，合格返回None，否则返回问题描述
+
+    Args:
+        path: 视频路径
+        config: 运行配置
+        expected_frames: 期望帧数，实际帧数低于其clip_min_frame_ratio时视为截断
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return "视频文件不存在或为空"
+    cmd = [
+        get_ffmpeg_exe(), "-v", "error", "-i", path, "-map", "0:v:0",
+        "-f", "null", "-progress", "pipe:1", "-nostats", "-",
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0 or result.stderr.strip():
+        error = result.stderr.strip().splitlines()
+        return f"视频无法完整解码（{error[-1] if error else f'退出码{result.returncode}'}）"
+    frames = [int(n) for n in re.findall(r"^frame=(\d+)", result.stdout, re.MULTILINE)]
+    frame_count = frames[-1] if frames else 0
+    if frame_count == 0:
+        return "视频没有画面"
+    if expected_frames and frame_count < expected_frames * config.clip_min_frame_ratio:
+        return f"视频帧数不足（{frame_count}/{expected_frames}）"
+    if get_media_duration(path) <= 0:
+        return "无法读取视频时长"
+    return None
@@ -2,9 +2,10 @@ import datetime
 import hashlib
 import hmac
 from urllib.parse import quote
-import requests
 import os
 import dotenv
+from app.utils.file_ops import get_http_session, get_async_http_client
+from app.utils.cassette import cassette_call, acassette_call
 
 def norm_query(params):
     query = ""
@@ -32,7 +33,8 @@ def hash_sha256(content: str):
 
 
 # 第二步：签名请求函数
-def request(method, action, body):
+def sign_request(method, action, body, config=None, account=None):
+    """计算签名，返回发送请求所需的url、headers、params与body；account为账号池分配的(AK, SK)"""
     # 第三步：创建身份证明。其中的 Service 和 Region 字段是固定的。ak 和 sk 分别代表
     # AccessKeyID 和 SecretAccessKey。同时需要初始化签名结构体。一些签名计算时需要的属性也在这里处理。
     # 初始化身份证明结构体
@@ -43,8 +45,11 @@ def request(method, action, body):
     Region = "cn-north-1"
     Host = "visual.volcengineapi.com"
     ContentType = "application/json"
-    ak = os.getenv("ACCESS_KEY_ID")
-    sk = os.getenv("SECRET_ACCESS_KEY")
+    # 优先使用运行配置中的凭证，未传入时回退到环境变量
+    ak = config.access_key_id if config is not None and config.access_key_id else os.getenv("ACCESS_KEY_ID")
+    sk = config.secret_access_key if config is not None and config.secret_access_key else os.getenv("SECRET_ACCESS_KEY")
+    if account:
+        ak, sk = account
     credential = {
         "access_key_id": ak,
         "secret_access_key": sk,
@@ -115,14 +120,42 @@ def request(method, action, body):
     )
     header = {**sign_result}
     # header = {**header, **{"X-Security-Token": SessionToken}}
+    return {
+        "url": "https://{}{}".format(request_param["host"], request_param["path"]),
+        "headers": header,
+        "params": request_param["query"],
+        "body": request_param["body"],
+    }
+
+
+def request(method, action, body, config=None, account=None):
     # 第六步：将 Signature 签名写入 HTTP Header 中，并发送 HTTP 请求。
-    r = requests.request(method=method,
-                         url="https://{}{}".format(request_param["host"], request_param["path"]),
-                         headers=header,
-                         params=request_param["query"],
-                         data=request_param["body"],
-                         )
-    return r.json()
+    def send():
+        signed = sign_request(method, action, body, config, account)
+        r = get_http_session().request(method=method,
+                             url=signed["url"],
+                             headers=signed["headers"],
+                             params=signed["params"],
+                             data=signed["body"],
+                             )
+        return r.json()
+    # 录制/回放按Action与请求体区分，不含签名与凭证
+    return cassette_call("volc", {"method": method, "action": action, "body": body}, send, lambda r: r, lambda r: r)
+
+
+async def arequest(method, action, body, config=None, account=None):
+    """request的异步版本，使用共享的异步HTTP客户端发送"""
+    async def send():
+        signed = sign_request(method, action, body, config, account)
+        client = get_async_http_client()
+        r = await client.request(method,
+                                 signed["url"],
+                                 headers=signed["headers"],
+                                 params=signed["params"],
+                                 content=signed["body"],
+                                 )
+        return r.json()
+    return await acassette_call("volc", {"method": method, "action": action, "body": body}, send, lambda r: r, lambda r: r)
 
 
 # datetime.utcnow() 在 3.12+ 已经过期，使用如下方法兼容
@@ -0,0 +1,7 @@
+"""
+本地热点路径的微基准测试
+
+运行方式：python -m benchmarks [--save] [--filter 名称] [--baseline 路径]
+结果（ops/sec、峰值内存、调用后残留内存）与benchmarks/baseline.json中的基线比较，
+超过阈值的退化会使进程以非零状态退出。
+"""
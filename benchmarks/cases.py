@@ -0,0 +1,135 @@
+import os
+import json
+from typing import Any, Callable, List, NamedTuple, Optional
+from benchmarks import fixtures
+
+
+class BenchContext(NamedTuple):
+    fixtures_dir: str
+    output_dir: str
+    ffmpeg_exe: Optional[str]  # 未安装ffmpeg时为None，依赖ffmpeg的用例跳过
+
+
+class Benchmark(NamedTuple):
+    """
+    一个基准用例
+
+    setup在计时之外准备素材，返回被计时的无参函数；ffmpeg类用例启动子进程，
+    耗时波动较大，使用更宽的阈值。max_peak_bytes是与机器无关的峰值内存上限，
+    没有基线时同样检查。
+    """
+    name: str
+    setup: Callable[[BenchContext], Callable[[], Any]]
+    requires_ffmpeg: bool = False
+    max_slowdown: Optional[float] = None  # 覆盖默认的ops/sec退化阈值
+    max_peak_bytes: Optional[int] = None  # 单次调用峰值内存的绝对上限
+
+
+BENCHMARKS: List[Benchmark] = []
+
+MB = 1 << 20
+
+
+def benchmark(name: str, requires_ffmpeg: bool = False, max_slowdown: Optional[float] = None, max_peak_bytes: Optional[int] = None) -> Callable:
+    def register(setup: Callable[[BenchContext], Callable[[], Any]]) -> Callable:
+        BENCHMARKS.append(Benchmark(name, setup, requires_ffmpeg, max_slowdown, max_peak_bytes))
+        return setup
+    return register
+
+
+@benchmark("file_ops.load_novel[8MB]", max_peak_bytes=48 * MB)
+def bench_load_novel(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.file_ops import load_novel
+    path = fixtures.make_novel(fixtures.fixture_path(ctx.fixtures_dir, "novel_8mb.txt"), 8)
+    return lambda: load_novel(path)
+
+
+@benchmark("file_ops.image_to_base64[png 1440x2560]", max_peak_bytes=48 * MB)
+def bench_base64_png(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.file_ops import image_to_base64
+    path = fixtures.make_png(fixtures.fixture_path(ctx.fixtures_dir, "frame_1440x2560.png"), 1440, 2560)
+    return lambda: image_to_base64(path)
+
+
+@benchmark("file_ops.image_to_base64[jpeg]", max_peak_bytes=10 * MB)
+def bench_base64_jpeg(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.file_ops import image_to_base64
+    path = fixtures.make_jpeg(fixtures.fixture_path(ctx.fixtures_dir, "frame_1440x2560.jpeg"), 2, ctx.ffmpeg_exe)
+    return lambda: image_to_base64(path)
+
+
+@benchmark("volc_signature.norm_query", max_peak_bytes=16 * 1024)
+def bench_norm_query(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.volc_signature import norm_query
+    params = {"Action": "CVSync2AsyncSubmitTask", "Version": "2022-08-31", "req_key": ["jimeng_vgfm_i2v_l20", "a b+c"]}
+    return lambda: norm_query(params)
+
+
+@benchmark("volc_signature.hmac_sha256[signing key]", max_peak_bytes=16 * 1024)
+def bench_hmac_chain(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.volc_signature import hmac_sha256
+
+    def derive() -> bytes:
+        k_date = hmac_sha256(b"secret-access-key", "20250101")
+        k_region = hmac_sha256(k_date, "cn-north-1")
+        k_service = hmac_sha256(k_region, "cv")
+        return hmac_sha256(k_service, "request")
+    return derive
+
+
+@benchmark("volc_signature.sign_request[2 frames]", max_peak_bytes=8 * MB)
+def bench_sign_request(ctx: BenchContext) -> Callable[[], Any]:
+    from app.config import RunConfig
+    from app.utils.file_ops import image_to_base64
+    from app.utils.volc_signature import sign_request
+    # 即梦提交任务的请求体包含首尾帧base64，签名需要对整个请求体做sha256
+    frame = image_to_base64(fixtures.make_jpeg(fixtures.fixture_path(ctx.fixtures_dir, "frame_1440x2560.jpeg"), 2, ctx.ffmpeg_exe))
+    body = json.dumps({"req_key": "jimeng_vgfm_i2v_l20", "binary_data_base64": [frame, frame], "prompt": "镜头缓慢推进"})
+    config = RunConfig(access_key_id="AK", secret_access_key="SK")
+    return lambda: sign_request("POST", "CVSync2AsyncSubmitTask", body, config)
+
+
+@benchmark("llm.strip_json_fence[300 scenes]", max_peak_bytes=1 * MB)
+def bench_strip_json_fence(ctx: BenchContext) -> Callable[[], Any]:
+    from app.services.llm import strip_json_fence
+    response = fixtures.make_llm_response(300)
+    return lambda: json.loads(strip_json_fence(response))
+
+
+@benchmark("video_ops.get_audio_duration[wav header]", max_peak_bytes=64 * 1024)
+def bench_wav_duration(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.video_ops import get_audio_duration
+    path = fixtures.make_wav(fixtures.fixture_path(ctx.fixtures_dir, "voice_30s.wav"), 30)
+    return lambda: get_audio_duration(path)
+
+
+@benchmark("video_ops.get_media_duration[mp4]", requires_ffmpeg=True, max_slowdown=0.5)
+def bench_media_duration(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.video_ops import get_media_duration
+    path = fixtures.make_mp4(fixtures.fixture_path(ctx.fixtures_dir, "clip_5s.mp4"), 5, ctx.ffmpeg_exe)
+    return lambda: get_media_duration(path)
+
+
+@benchmark("video_ops.merge_video_audio", requires_ffmpeg=True, max_slowdown=0.5)
+def bench_merge_video_audio(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.video_ops import merge_video_audio
+    video = fixtures.make_mp4(fixtures.fixture_path(ctx.fixtures_dir, "clip_5s.mp4"), 5, ctx.ffmpeg_exe)
+    audio = fixtures.make_wav(fixtures.fixture_path(ctx.fixtures_dir, "voice_6s.wav"), 6)
+    output = os.path.join(ctx.output_dir, "merged_av.mp4")
+    return lambda: merge_video_audio(video, audio, output, pad_audio=True)
+
+
+@benchmark("video_ops.fit_video_duration", requires_ffmpeg=True, max_slowdown=0.5)
+def bench_fit_video_duration(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.video_ops import fit_video_duration
+    video = fixtures.make_mp4(fixtures.fixture_path(ctx.fixtures_dir, "clip_5s.mp4"), 5, ctx.ffmpeg_exe)
+    output = os.path.join(ctx.output_dir, "fitted.mp4")
+    return lambda: fit_video_duration(video, 6.5, output)
+
+
+@benchmark("video_ops.merge_videos[8 clips]", requires_ffmpeg=True, max_slowdown=0.5)
+def bench_merge_videos(ctx: BenchContext) -> Callable[[], Any]:
+    from app.utils.video_ops import merge_videos
+    video = fixtures.make_mp4(fixtures.fixture_path(ctx.fixtures_dir, "clip_5s.mp4"), 5, ctx.ffmpeg_exe)
+    output = os.path.join(ctx.output_dir, "merged.mp4")
+    return lambda: merge_videos([video] * 8, output)
@@ -0,0 +1,131 @@
+import os
+import math
+import zlib
+import wave
+import random
+import struct
+import tempfile
+import subprocess
+from typing import Optional
+
+# 合成测试素材：固定随机种子生成，文件已存在时直接复用
+
+DEFAULT_FIXTURES_DIR = os.path.join(tempfile.gettempdir(), "novel_video_bench")
+
+SENTENCES = [
+    "夜色渐深，长街上的灯笼一盏接一盏亮了起来。",
+    "她垂下眼帘，指尖轻轻摩挲着茶盏的边沿。",
+    "“你真以为我会就此罢休？”他冷笑一声，转身推门而出。",
+    "远处传来更夫的梆子声，一下，又一下。",
+    "风从窗缝里钻进来，吹得烛火摇摇晃晃。",
+    "众人面面相觑，谁也没有再开口。",
+]
+
+
+def fixture_path(fixtures_dir: str, name: str) -> str:
+    os.makedirs(fixtures_dir, exist_ok=True)
+    return os.path.join(fixtures_dir, name)
+
+
+def make_novel(path: str, size_mb: float, chapter_chars: int = 6000) -> str:
+    """生成约size_mb大小、章节格式与小说素材.txt一致的文本"""
+    if os.path.exists(path):
+        return path
+    rng = random.Random(42)
+    target = int(size_mb * (1 << 20))
+    written, chapter = 0, 0
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        while written < target:
+            chapter += 1
+            lines = [f"第{chapter}章 {rng.choice(SENTENCES)[:8]}\n\n"]
+            length = 0
+            while length < chapter_chars:
+                paragraph = "".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 6)))
+                lines.append(paragraph + "\n")
+                length += len(paragraph)
+            lines.append("\n")
+            text = "".join(lines)
+            f.write(text)
+            written += len(text.encode("utf-8"))
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def make_png(path: str, width: int, height: int) -> str:
+    """生成随机噪声RGB PNG（噪声几乎不可压缩，文件大小接近原始像素数据）"""
+    if os.path.exists(path):
+        return path
+    rng = random.Random(7)
+    row_bytes = width * 3
+    raw = b"".join(b"\x00" + rng.randbytes(row_bytes) for _ in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 1)))
+        f.write(chunk(b"IEND", b""))
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def make_jpeg(path: str, size_mb: float, ffmpeg_exe: Optional[str] = None) -> str:
+    """
+    生成JPEG：有ffmpeg时编码一张噪声图，否则写入带SOI/EOI标记的随机字节
+    （image_to_base64只读取字节，不解码图片）
+    """
+    if os.path.exists(path):
+        return path
+    if ffmpeg_exe:
+        cmd = [
+            ffmpeg_exe, "-y", "-f", "lavfi", "-i", "nullsrc=s=1440x2560,geq=random(1)*255:128:128",
+            "-frames:v", "1", "-q:v", "2", path,
+        ]
+        if subprocess.run(cmd, capture_output=True).returncode == 0:
+            return path
+    rng = random.Random(11)
+    with open(path + ".tmp", "wb") as f:
+        f.write(b"\xff\xd8\xff\xe0" + rng.randbytes(int(size_mb * (1 << 20))) + b"\xff\xd9")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def make_wav(path: str, seconds: float, sample_rate: int = 24000) -> str:
+    """生成单声道16位正弦波WAV（与配音文件格式一致）"""
+    if os.path.exists(path):
+        return path
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        frames += struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate)))
+    with wave.open(path + ".tmp", "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(bytes(frames))
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def make_mp4(path: str, seconds: float, ffmpeg_exe: str, size: str = "480x854", frame_rate: int = 24) -> str:
+    """用ffmpeg测试源生成与即梦输出规格一致的H.264视频"""
+    if os.path.exists(path):
+        return path
+    cmd = [
+        ffmpeg_exe, "-y", "-f", "lavfi", "-i", f"testsrc=size={size}:rate={frame_rate}",
+        "-t", str(seconds), "-c:v", "libx264", "-pix_fmt", "yuv420p", "-f", "mp4", path + ".tmp",
+    ]
+    subprocess.run(cmd, capture_output=True, check=True)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def make_llm_response(scenes: int) -> str:
+    """生成带```json代码块标记的批量首尾帧提示词响应"""
+    rng = random.Random(3)
+    body = ",\n".join(
+        f'  "{i}": {{"start_frame": "{rng.choice(SENTENCES) * 4}", "end_frame": "{rng.choice(SENTENCES) * 4}"}}'
+        for i in range(1, scenes + 1)
+    )
+    return "```json\n{\n" + body + "\n}\n```"
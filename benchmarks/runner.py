@@ -0,0 +1,178 @@
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+from benchmarks.cases import BENCHMARKS, Benchmark, BenchContext
+from benchmarks.fixtures import DEFAULT_FIXTURES_DIR
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# 默认退化阈值：ops/sec下降超过20%，或峰值/残留内存增长超过25%（且超过绝对容差）视为退化
+MAX_SLOWDOWN = 0.20
+MAX_MEMORY_GROWTH = 0.25
+MEMORY_SLACK_BYTES = 64 * 1024
+# 绝对上限：与基线无关，调用结束后残留超过该值视为泄漏
+MAX_RETAINED_BYTES = 64 * 1024
+
+
+def time_ops(func: Callable[[], Any], min_time: float, repeat: int) -> float:
+    """按timeit的方式自动确定循环次数，取repeat轮中最快的一轮计算ops/sec"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(min_time / repeat / elapsed) + 1)
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return number / best
+
+
+def trace_memory(func: Callable[[], Any]) -> Dict[str, int]:
+    """
+    单次调用的内存占用（tracemalloc）
+
+    CPython不提供分配次数计数器，以调用期间的峰值内存和调用结束（返回值已释放）后
+    仍未释放的内存衡量分配开销；子进程的内存不计入。
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        del result
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_bytes": max(0, peak - before), "retained_bytes": max(0, after - before)}
+
+
+def run_benchmark(bench: Benchmark, ctx: BenchContext, min_time: float, repeat: int) -> Dict[str, Any]:
+    func = bench.setup(ctx)
+    func()  # 预热：导入、lru_cache、文件系统缓存
+    result = {"ops_per_sec": time_ops(func, min_time, repeat)}
+    result.update(trace_memory(func))
+    return result
+
+
+def compare(name: str, current: Dict[str, Any], baseline: Dict[str, Any], max_slowdown: float) -> List[str]:
+    """返回相对基线的退化描述，无退化时为空列表"""
+    problems = []
+    if current["ops_per_sec"] < baseline["ops_per_sec"] * (1 - max_slowdown):
+        problems.append(
+            f"{name}: ops/sec {current['ops_per_sec']:.1f} < 基线 {baseline['ops_per_sec']:.1f}（阈值 -{max_slowdown:.0%}）"
+        )
+    for metric in ("peak_bytes", "retained_bytes"):
+        limit = baseline[metric] * (1 + MAX_MEMORY_GROWTH) + MEMORY_SLACK_BYTES
+        if current[metric] > limit:
+            problems.append(f"{name}: {metric} {current[metric]} > 基线 {baseline[metric]}（阈值 +{MAX_MEMORY_GROWTH:.0%}）")
+    return problems
+
+
+def check_limits(bench: Benchmark, current: Dict[str, Any]) -> List[str]:
+    """返回超出绝对内存上限的描述，不依赖基线，在任何机器上结果一致"""
+    problems = []
+    if bench.max_peak_bytes is not None and current["peak_bytes"] > bench.max_peak_bytes:
+        problems.append(f"{bench.name}: peak_bytes {current['peak_bytes']} > 上限 {bench.max_peak_bytes}")
+    if current["retained_bytes"] > MAX_RETAINED_BYTES:
+        problems.append(f"{bench.name}: retained_bytes {current['retained_bytes']} > 上限 {MAX_RETAINED_BYTES}")
+    return problems
+
+
+def find_ffmpeg() -> Optional[str]:
+    try:
+        from app.utils.video_ops import get_ffmpeg_exe
+        return get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("results", {})
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, Any]]) -> None:
+    data = {
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="本地热点路径微基准测试")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线JSON文件路径")
+    parser.add_argument("--save", action="store_true", help="将本次结果写入基线（在基准机器上运行）")
+    parser.add_argument("--filter", default=None, help="只运行名称包含该字符串的用例")
+    parser.add_argument("--min-time", type=float, default=1.0, help="每个用例的最短计时时长（秒）")
+    parser.add_argument("--repeat", type=int, default=5, help="计时轮数，取最快一轮")
+    parser.add_argument("--fixtures-dir", default=DEFAULT_FIXTURES_DIR, help="合成素材缓存目录")
+    parser.add_argument("--output", default=None, help="将本次结果另存为JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    ffmpeg_exe = find_ffmpeg()
+    baseline = load_baseline(args.baseline)
+    results: Dict[str, Dict[str, Any]] = {}
+    problems: List[str] = []
+
+    with tempfile.TemporaryDirectory(prefix="bench_out_") as output_dir:
+        ctx = BenchContext(args.fixtures_dir, output_dir, ffmpeg_exe)
+        for bench in BENCHMARKS:
+            if args.filter and args.filter not in bench.name:
+                continue
+            if bench.requires_ffmpeg and not ffmpeg_exe:
+                print(f"{bench.name:<48} 跳过（未找到ffmpeg）")
+                continue
+            result = run_benchmark(bench, ctx, args.min_time, args.repeat)
+            results[bench.name] = result
+            problems += check_limits(bench, result)
+            line = f"{bench.name:<48} {result['ops_per_sec']:>12.1f} ops/s  峰值 {result['peak_bytes'] / 1024:>10.1f}KB  残留 {result['retained_bytes'] / 1024:>8.1f}KB"
+            if bench.name in baseline:
+                delta = result["ops_per_sec"] / baseline[bench.name]["ops_per_sec"] - 1
+                line += f"  ({delta:+.1%})"
+                problems += compare(bench.name, result, baseline[bench.name], bench.max_slowdown or MAX_SLOWDOWN)
+            print(line)
+
+    if args.output:
+        save_baseline(args.output, results)
+    if args.save:
+        # 只更新本次运行的用例，保留被过滤或跳过的用例的基线
+        save_baseline(args.baseline, {**baseline, **results})
+        print(f"基线已写入 {args.baseline}")
+        return 0
+    if not baseline:
+        print(f"没有基线文件 {args.baseline}，只检查内存绝对上限；使用 --save 记录基线")
+    if problems:
+        print("\n性能退化：")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    return 0
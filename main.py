@@ -1,6 +1,6 @@
+import os
 import argparse
-from app.config import Config
-from app.core.workflow import create_workflow
+from app.config import Config, RunConfig, PROVIDER_LOCAL
 
 def parse_args():
     """解析命令行参数"""
@@ -10,18 +10,96 @@ def parse_args():
     parser.add_argument("--max-scenes", type=int, default=Config.MAX_SCENES, help="最大生成场景数")
     parser.add_argument("--chapter", type=str, default=Config.TARGET_CHAPTER, help="目标章节")
     parser.add_argument("--novel-file", type=str, default=Config.NOVEL_FILE_PATH, help="小说文件路径")
+    parser.add_argument("--workspace", type=str, default=None, help="输出目录根路径（默认输出到当前目录）")
+    parser.add_argument("--plan", action="store_true", help="仅打印本次运行将发起的调用及预计耗时与费用，不调用任何服务")
+    parser.add_argument("--serve", action="store_true", help="以常驻服务模式运行，通过HTTP接口提交和管理作业")
+    parser.add_argument("--host", type=str, default=Config.SERVER_HOST, help="服务模式监听地址")
+    parser.add_argument("--port", type=int, default=Config.SERVER_PORT, help="服务模式监听端口")
+    parser.add_argument("--workers", type=int, default=Config.SERVER_WORKERS, help="服务模式同时执行的作业数")
+    parser.add_argument("--queue", type=str, default=Config.QUEUE_URL, help="分布式任务队列地址（memory:// / sqlite:///path / redis://host），指定后场景任务分发给worker执行")
+    parser.add_argument("--gc", action="store_true", help="按预算回收媒体库中无引用的对象并打印占用情况")
+    parser.add_argument("--worker", action="store_true", help="以worker身份运行，从--queue领取场景任务")
+    parser.add_argument("--watch", action="store_true", help="监听小说文件，只处理新增或修改的章节（输出到--workspace，默认watch/）")
+    parser.add_argument("--offline", action="store_true", help="离线预览模式：以模板文案、文字卡片和Ken Burns占位视频代替所有付费服务")
+    parser.add_argument("--budget", type=float, default=Config.RUN_BUDGET, help="本次运行的费用预算（元），超出时降级或放弃场景")
+    parser.add_argument("--deadline", type=float, default=None, help="本次运行的截止时间（分钟），来不及时降级场景并放弃无望的即梦轮询")
+    parser.add_argument("--record", type=str, default=None, metavar="DIR", help="录制本次运行的所有服务交互（LLM、文生图、即梦、下载、配音）到DIR")
+    parser.add_argument("--replay", type=str, default=None, metavar="DIR", help="回放--record录制的交互，不调用任何服务")
+    parser.add_argument("--replay-time-scale", type=float, default=Config.CASSETTE_TIME_SCALE, help="回放耗时缩放（0为不等待，1为按录制耗时）")
     parser.set_defaults(test=Config.TEST_MODE)
     return parser.parse_args()
 
+def build_run_config(args) -> RunConfig:
+    """根据命令行参数构建本次运行的配置"""
+    config = RunConfig(
+        test_mode=args.test,
+        max_scenes=args.max_scenes,
+        target_chapter=args.chapter,
+        novel_file_path=args.novel_file,
+        budget=args.budget,
+        deadline_seconds=args.deadline * 60 if args.deadline else Config.RUN_DEADLINE_SECONDS,
+    )
+    if args.offline:
+        config = config.replace(provider=PROVIDER_LOCAL)
+    # 离线占位产物默认单独存放，避免被正式运行当作已有结果复用
+    workspace = args.workspace or (Config.OFFLINE_WORKSPACE if args.offline else None)
+    if workspace:
+        config = config.with_workspace(workspace)
+    if args.record or args.replay:
+        # 录制/回放时不从媒体库复用产物，保证录制完整、回放与录制走相同的调用序列
+        config = config.replace(media_store_dir=None)
+    return config
+
 if __name__ == "__main__":
     # 解析命令行参数
     args = parse_args()
     
-    # 根据命令行参数更新配置
-    Config.TEST_MODE = args.test
-    Config.MAX_SCENES = args.max_scenes
-    Config.TARGET_CHAPTER = args.chapter
-    Config.NOVEL_FILE_PATH = args.novel_file
-    
-    # 运行主程序
-    create_workflow()
+    config = build_run_config(args)
+    if args.record and args.replay:
+        raise SystemExit("--record 与 --replay 不能同时使用")
+    if args.record or args.replay:
+        from app.utils.cassette import use_cassette, CASSETTE_RECORD, CASSETTE_REPLAY
+        if args.record:
+            use_cassette(args.record, CASSETTE_RECORD)
+        else:
+            use_cassette(args.replay, CASSETTE_REPLAY, args.replay_time_scale)
+    if args.watch:
+        # 各章节的输出目录由监听模式按章节分配，--workspace作为监听根目录
+        from app.core.watch import watch_novel
+        run_chapter = None
+        if args.queue:
+            from app.core.lease_queue import open_queue
+            from app.core.distributed import create_distributed_workflow
+            queue = open_queue(args.queue)
+            run_chapter = lambda chapter_config: create_distributed_workflow(chapter_config, queue)
+        root = args.workspace or (os.path.join(Config.OFFLINE_WORKSPACE, Config.WATCH_DIR) if args.offline else Config.WATCH_DIR)
+        watch_novel(root, config, run_chapter)
+    elif args.plan:
+        # 规划模式只依赖本地信息，不加载LangChain等服务商SDK
+        from app.core.plan import build_run_plan, format_run_plan
+        print(format_run_plan(build_run_plan(config)))
+    elif args.gc:
+        from app.utils.media_store import get_media_store
+        store = get_media_store(config)
+        if store is None:
+            raise SystemExit("未启用媒体库（Config.MEDIA_STORE_DIR为空）")
+        store.gc()
+        print(store.usage())
+    elif args.worker:
+        from app.core.lease_queue import open_queue
+        from app.core.distributed import run_worker
+        if not args.queue:
+            raise SystemExit("--worker 需要同时指定 --queue")
+        run_worker(open_queue(args.queue), base_config=config)
+    elif args.queue:
+        from app.core.lease_queue import open_queue
+        from app.core.distributed import create_distributed_workflow
+        create_distributed_workflow(config, open_queue(args.queue))
+    elif args.serve:
+        # 命令行参数作为作业的默认配置
+        from app.server import serve
+        serve(args.host, args.port, args.workers, base_config=config)
+    else:
+        # 运行主程序（工作流在解析参数后才导入）
+        from app.core.workflow import create_workflow
+        create_workflow(config)
@@ -0,0 +1,124 @@
+import time
+import pytest
+from app.config import RunConfig
+from app.core.clip_planner import plan_scene_clips
+from app.core.scheduler import fit_to_limits, order_lpt
+from app.utils.budget import (
+    COST_IMAGE, COST_LLM, COST_VIDEO, RunBudget, budget_exhausted, charge_images, charge_llm, charge_video,
+    end_run_budget, get_run_budget, poll_hopeless, start_run_budget, video_cost,
+)
+
+# 单账号、单并发，容量不受环境变量中的即梦凭证影响
+CONFIG = RunConfig(
+    access_key_id=None, secret_access_key=None, jimeng_credentials=(), video_concurrency=1,
+    video_frame_rate=24, video_min_frames=141, video_max_frames=241, degraded_max_stretch=2.0,
+    jimeng_queue_seconds=60, jimeng_seconds_per_frame=0.5,
+    llm_cost_per_call=0.05, image_cost_per_call=0.25, video_cost_per_second=0.3,
+    llm_input_cost_per_1k_tokens=0.0008, llm_output_cost_per_1k_tokens=0.002,
+    poll_stuck_factor=3, budget=None, deadline_seconds=None,
+)
+
+
+@pytest.fixture
+def run_budget():
+    token = start_run_budget(CONFIG.replace(budget=10.0))
+    yield get_run_budget()
+    end_run_budget(token)
+
+
+def plan(scene_id, audio_duration):
+    return plan_scene_clips(scene_id, audio_duration, CONFIG)
+
+
+def test_reserve_and_release():
+    budget = RunBudget(budget=10.0)
+    budget.charge(COST_LLM, 2.0, 1.0)
+    assert budget.spent == 2.0
+    assert budget.reserve(7.0)
+    assert budget.remaining_money() == pytest.approx(1.0)
+    assert not budget.reserve(1.5)
+    budget.release(7.0)
+    assert budget.remaining_money() == pytest.approx(8.0)
+    budget.release(100.0)
+    assert budget.reserved == 0.0
+    assert RunBudget().remaining_money() is None and RunBudget().remaining_seconds() is None
+
+
+def test_charges_are_recorded_per_kind(run_budget):
+    charge_llm({"input_tokens": 1000, "output_tokens": 500}, CONFIG)
+    charge_llm(None, CONFIG)
+    charge_images(2, CONFIG)
+    charge_video(241, CONFIG)
+    summary = run_budget.summary()
+    assert summary[COST_LLM]["calls"] == 2
+    assert summary[COST_LLM]["actual"] == pytest.approx(0.0008 + 0.001 + 0.05)
+    assert summary[COST_LLM]["estimated"] == pytest.approx(0.1)
+    assert summary[COST_IMAGE]["actual"] == pytest.approx(0.5)
+    assert summary[COST_VIDEO]["actual"] == pytest.approx(video_cost(241, CONFIG)) == pytest.approx(3.0)
+
+
+def test_charges_without_run_budget_are_ignored():
+    assert get_run_budget() is None
+    charge_images(1, CONFIG)
+    assert not budget_exhausted()
+
+
+def test_end_run_budget_restores_previous_budget(run_budget):
+    token = start_run_budget(CONFIG.replace(budget=1.0))
+    assert get_run_budget() is not run_budget
+    end_run_budget(token)
+    assert get_run_budget() is run_budget
+
+
+def test_budget_exhausted_by_money_or_deadline():
+    token = start_run_budget(CONFIG.replace(budget=0.2))
+    try:
+        assert not budget_exhausted()
+        charge_images(1, CONFIG)
+        assert budget_exhausted()
+    finally:
+        end_run_budget(token)
+    token = start_run_budget(CONFIG, deadline_at=time.time() - 1)
+    try:
+        assert budget_exhausted()
+    finally:
+        end_run_budget(token)
+
+
+def test_poll_hopeless_only_with_deadline():
+    assert poll_hopeless(1000, 10, CONFIG) is None
+    token = start_run_budget(CONFIG, deadline_at=time.time() + 3600)
+    try:
+        assert poll_hopeless(20, 10, CONFIG) is None
+        assert poll_hopeless(31, 10, CONFIG)
+    finally:
+        end_run_budget(token)
+    token = start_run_budget(CONFIG, deadline_at=time.time() - 1)
+    try:
+        assert poll_hopeless(0, 10, CONFIG) == "已超过截止时间"
+    finally:
+        end_run_budget(token)
+
+
+def test_fit_to_limits_without_budget_orders_lpt():
+    plans = [plan("1", 5.0), plan("2", 20.0)]
+    admitted, skipped = fit_to_limits(plans, None, CONFIG)
+    assert admitted == order_lpt(plans, CONFIG) and skipped == []
+
+
+def test_fit_to_limits_degrades_then_skips_lowest_yield_for_money():
+    # 20s场景6.4元（降级后3.05元），5s场景各1.8元
+    plans = [plan("1", 20.0), plan("2", 5.0), plan("3", 5.0)]
+    admitted, skipped = fit_to_limits(plans, RunBudget(budget=5.0), CONFIG)
+    assert [p["scene_id"] for p in admitted] == ["1", "2"]
+    assert admitted[0]["degraded"] and admitted[0]["total_frames"] == 241
+    assert [p["scene_id"] for p in skipped] == ["3"]
+
+
+def test_fit_to_limits_degrades_then_skips_for_deadline():
+    # 单并发：20s场景两个241帧子片段共361s，降级后180.5s；5s场景130.5s
+    plans = [plan("1", 20.0), plan("2", 5.0)]
+    admitted, skipped = fit_to_limits(plans, RunBudget(deadline_at=time.time() + 200), CONFIG)
+    assert [p["scene_id"] for p in admitted] == ["1"]
+    assert admitted[0]["degraded"]
+    assert [p["scene_id"] for p in skipped] == ["2"]
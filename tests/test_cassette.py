@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from app.utils.cassette import (
+    CASSETTE_RECORD, CASSETTE_REPLAY, CassetteMiss, acassette_call, cassette_call, cassette_file, use_cassette,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_cassette():
+    yield
+    use_cassette(None)
+
+
+def identity(value):
+    return value
+
+
+def call(request, func):
+    return cassette_call("llm", request, func, identity, identity)
+
+
+def fail():
+    raise RuntimeError("rate limited")
+
+
+def unreachable():
+    raise AssertionError("回放时不应调用服务")
+
+
+def test_without_cassette_calls_through():
+    assert call({"q": 1}, lambda: "live") == "live"
+
+
+def test_replay_returns_recorded_responses_in_order(tmp_path):
+    use_cassette(str(tmp_path), CASSETTE_RECORD)
+    assert call({"q": 1}, lambda: {"status": "running"}) == {"status": "running"}
+    assert call({"q": 1}, lambda: {"status": "done"}) == {"status": "done"}
+    assert call({"q": 2}, lambda: "other") == "other"
+    with pytest.raises(RuntimeError):
+        call({"q": 3}, fail)
+
+    use_cassette(str(tmp_path), CASSETTE_REPLAY, time_scale=0)
+    assert call({"q": 2}, unreachable) == "other"
+    assert call({"q": 1}, unreachable) == {"status": "running"}
+    assert call({"q": 1}, unreachable) == {"status": "done"}
+    # 超出录制次数时重复最后一次
+    assert call({"q": 1}, unreachable) == {"status": "done"}
+    with pytest.raises(Exception, match="rate limited"):
+        call({"q": 3}, unreachable)
+    with pytest.raises(CassetteMiss):
+        call({"q": 4}, unreachable)
+
+
+def test_identical_responses_are_stored_once(tmp_path):
+    cassette = use_cassette(str(tmp_path), CASSETTE_RECORD)
+    for _ in range(3):
+        call({"poll": 1}, lambda: {"status": "running"})
+    objects = [p for p in (tmp_path / "objects").rglob("*") if p.is_file()]
+    assert len(objects) == 1
+    assert len(open(cassette.index_path, encoding="utf-8").readlines()) == 3
+
+
+def test_async_replay(tmp_path):
+    async def live():
+        return "async result"
+
+    async def missing():
+        raise AssertionError("回放时不应调用服务")
+
+    use_cassette(str(tmp_path), CASSETTE_RECORD)
+    assert asyncio.run(acassette_call("llm", {"q": 1}, live, identity, identity)) == "async result"
+    use_cassette(str(tmp_path), CASSETTE_REPLAY, time_scale=0)
+    assert asyncio.run(acassette_call("llm", {"q": 1}, missing, identity, identity)) == "async result"
+
+
+def test_file_download_replay(tmp_path):
+    save_path = tmp_path / "out" / "clip.mp4"
+
+    def download():
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        save_path.write_bytes(b"video bytes")
+        return f"下载成功：{save_path}"
+
+    use_cassette(str(tmp_path / "cassette"), CASSETTE_RECORD)
+    result = cassette_file("download", {"url": "https://example/clip.mp4"}, str(save_path), download)
+    save_path.unlink()
+
+    use_cassette(str(tmp_path / "cassette"), CASSETTE_REPLAY, time_scale=0)
+    assert cassette_file("download", {"url": "https://example/clip.mp4"}, str(save_path), unreachable) == result
+    assert save_path.read_bytes() == b"video bytes"
+
+
+def test_replay_requires_recording(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        use_cassette(str(tmp_path / "missing"), CASSETTE_REPLAY)
+    with pytest.raises(ValueError):
+        use_cassette(str(tmp_path), "rewind")
@@ -0,0 +1,46 @@
+from app.core.character import alias_index, canonicalize_script, merge_aliases, script_characters
+
+
+def test_alias_index_includes_canonical_names():
+    assert alias_index({"林婉": ["林婉", "婉儿"]}) == {"林婉": "林婉", "婉儿": "林婉"}
+
+
+def test_merge_new_alias_into_new_person():
+    registry = {}
+    merge_aliases(registry, {"婉儿": "林婉"})
+    assert registry == {"林婉": ["林婉", "婉儿"]}
+
+
+def test_merge_keeps_registered_aliases():
+    registry = {"林婉": ["林婉", "婉儿"]}
+    merge_aliases(registry, {"婉儿": "沈清", "林婉": "沈清"})
+    assert registry == {"林婉": ["林婉", "婉儿"]}
+
+
+def test_merge_into_person_of_registered_alias():
+    registry = {"林婉": ["林婉", "婉儿"]}
+    merge_aliases(registry, {"林姑娘": "婉儿"})
+    assert registry == {"林婉": ["林婉", "婉儿", "林姑娘"]}
+
+
+def test_merge_follows_chains_and_cycles():
+    registry = {}
+    merge_aliases(registry, {"小六": "六爷", "六爷": "陈六"})
+    assert alias_index(registry) == {"陈六": "陈六", "六爷": "陈六", "小六": "陈六"}
+
+    registry = {}
+    merge_aliases(registry, {"甲": "乙", "乙": "甲"})
+    assert len(registry) == 1
+    assert set(alias_index(registry)) == {"甲", "乙"}
+
+
+def test_canonicalize_script_dedupes_scene_characters():
+    script = {
+        "1": {"content": "…", "character": ["婉儿", "林婉", "陈六"]},
+        "2": {"content": "…", "character": ["林姑娘"]},
+    }
+    index = alias_index({"林婉": ["林婉", "婉儿", "林姑娘"]})
+    assert script_characters(script) == ["婉儿", "林婉", "陈六", "林姑娘"]
+    canonicalize_script(script, index)
+    assert script["1"]["character"] == ["林婉", "陈六"]
+    assert script["2"]["character"] == ["林婉"]
@@ -0,0 +1,76 @@
+import pytest
+from app.config import RunConfig
+from app.core.clip_planner import (
+    FIT_NONE, FIT_PAD, FIT_STRETCH, degrade_scene_plan, duration_to_frames, frames_to_duration, plan_scene_clips,
+    stretch_action,
+)
+
+CONFIG = RunConfig(video_frame_rate=24, video_min_frames=141, video_max_frames=241, video_duration=5, video_min_stretch_ratio=0.6, degraded_max_stretch=2.0)
+
+
+def test_frames_duration_round_trip():
+    assert duration_to_frames(5, 24) == 121
+    assert frames_to_duration(121, 24) == 5
+    assert frames_to_duration(0, 24) == 0
+
+
+@pytest.mark.parametrize("audio_duration", [None, 0, -1])
+def test_no_audio_uses_default_duration_within_limits(audio_duration):
+    plan = plan_scene_clips("1", audio_duration, CONFIG)
+    assert plan["fit"] == FIT_NONE
+    assert plan["audio_duration"] is None
+    assert [c["frames"] for c in plan["clips"]] == [141]
+
+
+def test_short_audio_is_stretched():
+    plan = plan_scene_clips("1", 5.0, CONFIG)
+    assert plan["fit"] == FIT_STRETCH
+    assert [c["frames"] for c in plan["clips"]] == [141]
+
+
+def test_very_short_audio_is_padded():
+    plan = plan_scene_clips("1", 2.0, CONFIG)
+    assert plan["fit"] == FIT_PAD
+    assert [c["frames"] for c in plan["clips"]] == [141]
+
+
+def test_long_audio_is_split_into_equal_clips():
+    plan = plan_scene_clips("1", 20.0, CONFIG)
+    assert plan["fit"] == FIT_NONE
+    assert [c["frames"] for c in plan["clips"]] == [241, 241]
+    assert [c["index"] for c in plan["clips"]] == [0, 1]
+    assert plan["total_frames"] == 482
+
+
+@pytest.mark.parametrize("audio_duration", [5.9, 6.0, 9.99, 10.0, 10.1, 17.3, 33.3, 61.0])
+def test_clips_cover_audio_within_frame_limits(audio_duration):
+    plan = plan_scene_clips("1", audio_duration, CONFIG)
+    frames = [c["frames"] for c in plan["clips"]]
+    assert all(CONFIG.video_min_frames <= f <= CONFIG.video_max_frames for f in frames)
+    assert plan["total_frames"] == sum(frames) >= duration_to_frames(audio_duration, 24)
+    # 均分：各子片段等长，且少一个子片段就放不下
+    assert len(set(frames)) == 1
+    assert (len(frames) - 1) * CONFIG.video_max_frames < duration_to_frames(audio_duration, 24)
+
+
+def test_degrade_produces_single_slowed_clip():
+    plan = plan_scene_clips("1", 20.0, CONFIG)
+    degraded = degrade_scene_plan(plan, CONFIG)
+    assert degraded["degraded"] is True
+    assert degraded["fit"] == FIT_STRETCH
+    assert [c["frames"] for c in degraded["clips"]] == [241]
+    assert degrade_scene_plan(degraded, CONFIG) is None
+
+
+def test_stretch_action_follows_clip_and_audio_duration():
+    assert stretch_action(plan_scene_clips("1", 5.0, CONFIG), 5.0) == "加速"
+    assert stretch_action(degrade_scene_plan(plan_scene_clips("1", 20.0, CONFIG), CONFIG), 20.0) == "放慢"
+
+
+def test_degrade_returns_none_when_not_possible():
+    # 无音频
+    assert degrade_scene_plan(plan_scene_clips("1", None, CONFIG), CONFIG) is None
+    # 单个子片段放慢两倍后仍超出最大帧数
+    assert degrade_scene_plan(plan_scene_clips("1", 30.0, CONFIG), CONFIG) is None
+    # 已是最小帧数的单个子片段，无法更便宜
+    assert degrade_scene_plan(plan_scene_clips("1", 5.0, CONFIG), CONFIG) is None
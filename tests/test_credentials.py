@@ -0,0 +1,78 @@
+import time
+import asyncio
+import threading
+import pytest
+from app.config import RunConfig
+from app.utils.credentials import CredentialPool, classify_error, ERROR_AUTH, ERROR_QUOTA, ERROR_THROTTLE
+
+CONFIG = RunConfig(credential_cooldown_seconds=0.2, credential_quarantine_seconds=60)
+
+
+class ProviderError(Exception):
+    pass
+
+
+def test_classify_error():
+    assert classify_error(ProviderError("InvalidApiKey")) == ERROR_AUTH
+    assert classify_error(ProviderError("Arrearage")) == ERROR_QUOTA
+    assert classify_error(ProviderError("code 50429")) == ERROR_THROTTLE
+    assert classify_error(ProviderError("timeout")) is None
+
+
+def test_select_least_busy_account():
+    pool = CredentialPool("jimeng", ["a", "b"])
+    first = pool.select()
+    second = pool.select()
+    assert {first.secret, second.secret} == {"a", "b"}
+
+
+def test_limit_blocks_instead_of_oversubscribing():
+    pool = CredentialPool("jimeng", ["a", "b"])
+    held = [pool.select(limit=1), pool.select(limit=1)]
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.select(limit=1)))
+    waiter.start()
+    waiter.join(0.1)
+    assert acquired == []
+    pool.release(held[0], config=CONFIG)
+    waiter.join(2)
+    assert [c.secret for c in acquired] == [held[0].secret]
+
+
+def test_limited_pool_waits_for_cooldown_and_skips_quarantined():
+    pool = CredentialPool("jimeng", ["a", "b"])
+    a, b = pool.select(limit=2), pool.select(limit=2)
+    pool.release(a, ProviderError("InvalidAccessKey"), CONFIG)
+    pool.release(b, ProviderError("50429"), CONFIG)
+    assert pool.available() == 1
+    start = time.monotonic()
+    credential = pool.select(limit=2)
+    # 冷却结束后才分配，且不会分配给被隔离的账号
+    assert credential.secret == "b"
+    assert time.monotonic() - start >= 0.15
+    # 剩余账号已满时等待，而不是超出其上限
+    pool.select(limit=2)
+    assert asyncio.run(wait_for(pool.aselect(limit=2), 0.2)) is None
+
+
+def test_all_quarantined_raises():
+    pool = CredentialPool("jimeng", ["a"])
+    pool.release(pool.select(), ProviderError("Unauthorized"), CONFIG)
+    with pytest.raises(Exception, match="没有可用的账号"):
+        pool.select(limit=1)
+
+
+def test_unlimited_pool_uses_earliest_recovery_when_all_cooling():
+    pool = CredentialPool("llm", ["a", "b"])
+    a, b = pool.select(), pool.select()
+    pool.release(a, ProviderError("RateLimit"), CONFIG)
+    time.sleep(0.01)
+    pool.release(b, ProviderError("RateLimit"), CONFIG)
+    assert pool.select().secret == "a"
+
+
+async def wait_for(coro, timeout):
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        return None
@@ -0,0 +1,59 @@
+import os
+import time
+import threading
+from app.utils.file_ops import file_lock, read_lock_owner, take_over_stale_lock
+
+
+def write_lock(lock_path, owner, age=0.0):
+    with open(lock_path, "w", encoding="utf-8") as f:
+        f.write(owner)
+    mtime = time.time() - age
+    os.utime(lock_path, (mtime, mtime))
+
+
+def test_stale_lock_is_taken_over(tmp_path):
+    path = str(tmp_path / "scene")
+    write_lock(path + ".lock", "dead-worker", age=60)
+    with file_lock(path, stale_seconds=10, poll_interval=0.01):
+        assert read_lock_owner(path + ".lock") not in ("", "dead-worker")
+    assert not os.path.exists(path + ".lock")
+    assert os.listdir(tmp_path) == []
+
+
+def test_fresh_lock_is_put_back(tmp_path):
+    lock_path = str(tmp_path / "scene.lock")
+    write_lock(lock_path, "live-worker")
+    take_over_stale_lock(lock_path, stale_seconds=10)
+    assert read_lock_owner(lock_path) == "live-worker"
+    assert os.listdir(tmp_path) == ["scene.lock"]
+
+
+def test_release_keeps_lock_owned_by_someone_else(tmp_path):
+    path = str(tmp_path / "scene")
+    with file_lock(path, poll_interval=0.01):
+        write_lock(path + ".lock", "new-owner")
+    assert read_lock_owner(path + ".lock") == "new-owner"
+
+
+def test_waiters_on_stale_lock_hold_it_one_at_a_time(tmp_path):
+    path = str(tmp_path / "scene")
+    write_lock(path + ".lock", "dead-worker", age=60)
+    holders, overlaps = [], []
+    start = threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        with file_lock(path, stale_seconds=10, poll_interval=0.005):
+            holders.append(1)
+            if len(holders) > 1:
+                overlaps.append(len(holders))
+            time.sleep(0.01)
+            holders.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert overlaps == []
+    assert not os.path.exists(path + ".lock")
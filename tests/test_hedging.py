@@ -0,0 +1,46 @@
+import time
+import threading
+from app.config import RunConfig
+from app.utils.hedging import hedged_call, get_tracker, get_hedge_pool
+
+CONFIG = RunConfig(hedge_budget=1.0, hedge_min_samples=1, hedge_max_workers=2)
+
+
+def warm_up(key, seconds=0.01):
+    hedged_call(key, lambda: time.sleep(seconds), CONFIG)
+
+
+def test_slow_primary_is_hedged():
+    key = "test:hedged"
+    warm_up(key)
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            release.wait(5)  # 主请求阻塞
+            return "primary"
+        return "hedge"
+
+    assert hedged_call(key, func, CONFIG) == "hedge"
+    release.set()
+    assert get_tracker(key).stats()["hedge_wins"] == 1
+
+
+def test_full_pool_runs_on_caller_thread():
+    key = "test:full"
+    warm_up(key)
+    pool = get_hedge_pool(CONFIG)
+    release = threading.Event()
+    # 占满对冲线程
+    busy = [pool.submit(lambda: release.wait(5)) for _ in range(CONFIG.hedge_max_workers)]
+    assert pool.submit(lambda: None) is None
+    try:
+        caller = threading.current_thread().name
+        assert hedged_call(key, lambda: threading.current_thread().name, CONFIG) == caller
+    finally:
+        release.set()
+        for future in busy:
+            future.result()
+    assert pool.submit(lambda: 1).result() == 1
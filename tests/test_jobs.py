@@ -0,0 +1,118 @@
+import json
+import threading
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer
+import pytest
+from app.config import RunConfig
+from app.core.jobs import (
+    JOB_CANCELLED, JOB_DONE, JOB_QUEUED, JOB_RUNNING, JobEvents, JobManager, JobStore, parse_job_options,
+)
+from app.server import JobRequestHandler
+
+CONFIG = RunConfig(novel_file_path="novel.txt")
+
+
+def test_parse_job_options():
+    assert parse_job_options({"test_mode": "false", "max_scenes": 3.0, "budget": "12.5", "deadline_seconds": None}) == {
+        "test_mode": False, "max_scenes": 3, "budget": 12.5, "deadline_seconds": None,
+    }
+    assert parse_job_options({"chapter": "第1章"}) == {}
+    for params in ({"test_mode": "maybe"}, {"max_scenes": 0}, {"max_scenes": 1.5}, {"max_scenes": True},
+                   {"budget": -1}, {"budget": "nan"}, {"deadline_seconds": 0}):
+        with pytest.raises(ValueError):
+            parse_job_options(params)
+
+
+def test_store_claims_by_priority_then_age(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    first = store.create({"chapter": "a"})
+    second = store.create({"chapter": "b"})
+    urgent = store.create({"chapter": "c"}, priority=5)
+    assert store.set_priority(second["id"], 1)
+
+    assert store.claim()["id"] == urgent["id"]
+    claimed = store.claim()
+    assert claimed["id"] == second["id"] and claimed["status"] == JOB_RUNNING
+    # 运行中的作业不能调整优先级或按排队作业取消
+    assert not store.set_priority(second["id"], 9)
+    assert not store.cancel_queued(second["id"])
+    assert store.cancel_queued(first["id"])
+    assert store.claim() is None
+
+    store.finish(second["id"], JOB_DONE, result=[{"ok": True}])
+    job = store.get(second["id"])
+    assert job["status"] == JOB_DONE and job["result"] == [{"ok": True}]
+    assert [j["id"] for j in store.list(JOB_CANCELLED)] == [first["id"]]
+
+
+def test_store_requeues_running_jobs_on_restart(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    job = JobStore(path).create({})
+    JobStore(path).claim()
+    assert JobStore(path).get(job["id"])["status"] == JOB_QUEUED
+
+
+def test_events_read_after_and_prune():
+    events = JobEvents(max_events=2, retention=0)
+    for i in range(3):
+        events.publish("a", "log", {"i": i})
+    # 只保留最近max_events个事件，序号保持递增
+    assert [e["id"] for e in events.read("a")] == [2, 3]
+    assert [e["id"] for e in events.read("a", after=2)] == [3]
+
+    events.publish("a", "status", {"status": JOB_DONE})
+    # 结束超过retention的作业在下次发布时被丢弃
+    events.publish("b", "log", {})
+    assert events.read("a") == []
+    assert len(events.read("b")) == 1
+
+
+def test_cancel_right_after_claim_is_not_lost(tmp_path):
+    manager = JobManager(str(tmp_path), base_config=CONFIG)
+    job = manager.submit({})
+    claimed = manager._claim()
+    assert claimed["id"] == job["id"]
+    # 作业已标记为运行中、尚未开始执行时取消
+    manager.cancel(job["id"])
+    assert manager._cancel_events[job["id"]].is_set()
+
+
+@pytest.fixture
+def server(tmp_path):
+    manager = JobManager(str(tmp_path), base_config=CONFIG)
+    handler = type("TestJobRequestHandler", (JobRequestHandler,), {"manager": manager})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(url, data=data, method="POST" if data is not None else "GET")
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_http_routes(server):
+    assert request(f"{server}/jobs", {"max_scenes": 0})[0] == 400
+    assert request(f"{server}/jobs", {"priority": "high"})[0] == 400
+
+    status, job = request(f"{server}/jobs", {"chapter": "第1章", "priority": 2})
+    assert status == 201 and job["status"] == JOB_QUEUED and job["priority"] == 2
+    assert request(f"{server}/jobs/{job['id']}")[1]["id"] == job["id"]
+    assert [j["id"] for j in request(f"{server}/jobs")[1]] == [job["id"]]
+
+    assert request(f"{server}/jobs/{job['id']}/priority", {"priority": "x"})[0] == 400
+    assert request(f"{server}/jobs/{job['id']}/priority", {"priority": 7})[1]["priority"] == 7
+    assert request(f"{server}/jobs/{job['id']}/cancel", {})[1]["status"] == JOB_CANCELLED
+
+    assert request(f"{server}/jobs/abc123")[0] == 404
+    assert request(f"{server}/jobs/abc123/cancel", {})[0] == 404
+    assert request(f"{server}/unknown")[0] == 404
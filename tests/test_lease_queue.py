@@ -0,0 +1,132 @@
+import os
+import pytest
+from app.core.lease_queue import (
+    TASK_DONE, TASK_FAILED, TASK_PENDING, LeaseQueue, MemoryLeaseQueue, SQLiteLeaseQueue, open_queue,
+)
+
+# Redis队列需要可写的测试库，例如 TEST_REDIS_URL=redis://localhost:6379/15（会清空该库）
+REDIS_URL = os.getenv("TEST_REDIS_URL")
+
+# 负的租约时长使租约立即过期，不依赖等待
+EXPIRED = -1
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def queue(request, tmp_path) -> LeaseQueue:
+    if request.param == "memory":
+        return open_queue("memory://")
+    if request.param == "sqlite":
+        return open_queue(f"sqlite:///{tmp_path / 'queue.db'}")
+    if not REDIS_URL:
+        pytest.skip("未设置TEST_REDIS_URL")
+    redis = pytest.importorskip("redis")
+    redis.Redis.from_url(REDIS_URL).flushdb()
+    return open_queue(REDIS_URL)
+
+
+def statuses(queue: LeaseQueue, group: str = "g"):
+    return {t["id"]: (t["status"], t["attempts"]) for t in queue.tasks(group)}
+
+
+def test_open_queue_flavours(tmp_path):
+    assert isinstance(open_queue("memory://"), MemoryLeaseQueue)
+    assert open_queue("memory://") is not open_queue("memory://")
+    assert isinstance(open_queue(f"sqlite:///{tmp_path / 'q.db'}"), SQLiteLeaseQueue)
+    with pytest.raises(ValueError):
+        open_queue("ftp://example")
+
+
+def test_lease_by_priority_and_complete(queue):
+    queue.put("a", "g", {"scene": 1}, priority=1)
+    queue.put("b", "g", {"scene": 2}, priority=5)
+    task = queue.lease("w1", 60)
+    assert task == {"id": "b", "group": "g", "payload": {"scene": 2}, "attempts": 1}
+    assert queue.lease("w2", 60)["id"] == "a"
+    assert queue.lease("w3", 60) is None
+
+    assert not queue.complete("b", "w2", {"ok": False})
+    assert queue.heartbeat("b", "w1", 60)
+    assert queue.complete("b", "w1", {"ok": True})
+    done = {t["id"]: t for t in queue.tasks("g")}["b"]
+    assert done["status"] == TASK_DONE and done["result"] == {"ok": True}
+
+
+def test_expired_lease_is_leased_again(queue):
+    queue.put("a", "g", {})
+    assert queue.lease("w1", EXPIRED)["attempts"] == 1
+    task = queue.lease("w2", 60)
+    assert task["id"] == "a" and task["attempts"] == 2
+    # 租约已转给w2，w1的续约与结果均失效
+    assert not queue.heartbeat("a", "w1", 60)
+    assert not queue.complete("a", "w1", None)
+    assert queue.complete("a", "w2", None)
+
+
+def test_task_fails_after_max_attempts(queue):
+    queue.max_attempts = 2
+    queue.put("a", "g", {})
+    queue.lease("w1", EXPIRED)
+    assert statuses(queue)["a"] == (TASK_PENDING, 1)
+    queue.lease("w1", 60)
+    assert queue.fail("a", "w1", "boom")
+    assert statuses(queue)["a"] == (TASK_FAILED, 2)
+    assert queue.lease("w1", 60) is None
+
+
+def test_fail_requeues_until_max_attempts(queue):
+    queue.max_attempts = 3
+    queue.put("a", "g", {})
+    queue.lease("w1", 60)
+    assert queue.fail("a", "w1", "boom")
+    assert statuses(queue)["a"] == (TASK_PENDING, 1)
+    assert queue.lease("w2", 60)["attempts"] == 2
+
+
+def test_reput_keeps_unfinished_tasks(queue):
+    queue.put("a", "g", {"v": 1})
+    queue.put("a", "g", {"v": 2})
+    task = queue.lease("w1", 60)
+    assert task["payload"] == {"v": 1}
+    queue.put("a", "g", {"v": 3})
+    assert statuses(queue)["a"][0] != TASK_PENDING
+    assert queue.lease("w2", 60) is None
+
+
+@pytest.mark.parametrize("finish", ["complete", "fail"])
+def test_reput_requeues_finished_tasks(queue, finish):
+    queue.max_attempts = 1
+    queue.put("a", "g", {"v": 1})
+    queue.lease("w1", 60)
+    if finish == "complete":
+        queue.complete("a", "w1", {"ok": True})
+    else:
+        queue.fail("a", "w1", "boom")
+    queue.put("a", "g", {"v": 2})
+    assert statuses(queue)["a"] == (TASK_PENDING, 0)
+    task = queue.lease("w2", 60)
+    assert task["payload"] == {"v": 2} and task["attempts"] == 1
+
+
+def test_cancel_stops_unfinished_tasks_in_group(queue):
+    queue.put("a", "g", {}, priority=3)
+    queue.put("b", "g", {}, priority=2)
+    queue.put("c", "g", {}, priority=1)
+    queue.put("x", "other", {})
+    queue.lease("w1", 60)
+    queue.lease("w1", 60)
+    queue.complete("b", "w1", "ok")
+
+    assert queue.cancel("g") == 2
+    assert statuses(queue) == {"a": (TASK_FAILED, 1), "b": (TASK_DONE, 1), "c": (TASK_FAILED, 0)}
+    # 运行中的任务续约与上报均失效，其他分组不受影响
+    assert not queue.heartbeat("a", "w1", 60)
+    assert not queue.complete("a", "w1", "late")
+    assert queue.lease("w2", 60)["id"] == "x"
+    assert queue.cancel("g") == 0
+
+
+def test_reput_after_cancel_requeues(queue):
+    queue.put("a", "g", {"v": 1})
+    queue.cancel("g")
+    queue.put("a", "g", {"v": 2})
+    assert queue.lease("w1", 60)["payload"] == {"v": 2}
@@ -0,0 +1,57 @@
+import os
+from app.config import RunConfig, PROVIDER_LOCAL
+from app.utils.media_store import MediaStore, get_media_store, media_key
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_media_key_is_order_independent():
+    assert media_key("image", prompt="p", seed=1) == media_key("image", seed=1, prompt="p")
+    assert media_key("image", prompt="p") != media_key("video", prompt="p")
+
+
+def test_gc_evicts_only_unreferenced_objects(tmp_path):
+    store = MediaStore(str(tmp_path / "store"), budget_bytes=0)
+    kept = write(tmp_path / "run1" / "kept.png", b"k" * 10)
+    dropped = write(tmp_path / "run1" / "dropped.png", b"d" * 20)
+    assert store.save("kept", kept)
+    assert store.save("dropped", dropped)
+    # 已在库中的键不重复收入
+    assert store.save("kept", kept)
+    assert not store.save("missing", str(tmp_path / "none.png"))
+
+    # 运行目录中的文件是库中对象的硬链接；删除后对应对象不再被引用
+    os.remove(dropped)
+    assert store.usage() == {"objects": 2, "bytes": 30, "unreferenced_objects": 1, "unreferenced_bytes": 20}
+
+    assert store.gc() == {"removed": 1, "freed_bytes": 20, "bytes": 10}
+    assert store.contains("kept")
+    assert not store.contains("dropped")
+    assert not store.fetch("dropped", str(tmp_path / "run2" / "dropped.png"))
+
+    # 命中时链接到新的运行目录
+    dest = str(tmp_path / "run2" / "kept.png")
+    assert store.fetch("kept", dest)
+    assert os.path.samefile(dest, kept)
+    assert store.fetch("kept", dest)
+
+
+def test_gc_keeps_objects_within_budget(tmp_path):
+    store = MediaStore(str(tmp_path / "store"), budget_bytes=100)
+    path = write(tmp_path / "run" / "a.png", b"a" * 10)
+    store.save("a", path)
+    os.remove(path)
+    assert store.gc()["removed"] == 0
+    assert store.gc(budget_bytes=0)["removed"] == 1
+
+
+def test_get_media_store(tmp_path):
+    assert get_media_store(RunConfig(media_store_dir="")) is None
+    assert get_media_store(RunConfig(media_store_dir=str(tmp_path), provider=PROVIDER_LOCAL)) is None
+    config = RunConfig(media_store_dir=str(tmp_path))
+    assert get_media_store(config) is get_media_store(config)
@@ -0,0 +1,43 @@
+from app.config import RunConfig
+from app.core.clip_planner import FIT_STRETCH, plan_scene_clips
+from app.core.scene_video import prepare_clip, prepare_scene_video, scene_frames, scene_video_result
+
+CONFIG = RunConfig(video_frame_rate=24, video_min_frames=141, video_max_frames=241, video_min_stretch_ratio=0.6, stream_mux=False)
+
+SCENE_INFO = {
+    "scene_id": "3",
+    "scene_content": "内容",
+    "image_path_start": "start.jpeg", "image_prompt_start": "起", "image_base64_start": "s64",
+    "image_path_end": "end.jpeg", "image_prompt_end": "止", "image_base64_end": "e64",
+}
+
+
+def test_stretched_single_clip_goes_through_raw_path(tmp_path):
+    scene = prepare_scene_video(SCENE_INFO, str(tmp_path), 5.0, None, CONFIG)
+    assert scene["plan"]["fit"] == FIT_STRETCH
+    assert scene["raw_path"].endswith("3_raw.mp4") and scene["final_path"].endswith("3.mp4")
+
+    frames = scene_frames(SCENE_INFO, [])
+    existing, clip_info, part_path = prepare_clip(scene, SCENE_INFO, frames, scene["plan"]["clips"][0])
+    assert existing is None and part_path == scene["raw_path"]
+    assert clip_info["scene_id"] == "3"
+    assert (clip_info["image_path_start"], clip_info["image_path_end"]) == ("start.jpeg", "end.jpeg")
+
+
+def test_split_clips_use_keyframes_and_skip_existing_parts(tmp_path):
+    plan = plan_scene_clips("3", 20.0, CONFIG)
+    scene = prepare_scene_video(SCENE_INFO, str(tmp_path), 20.0, plan, CONFIG)
+    frames = scene_frames(SCENE_INFO, [{"path": "key1.jpeg", "prompt": "中", "base64": "k64"}])
+    assert [f["path"] for f in frames] == ["start.jpeg", "key1.jpeg", "end.jpeg"]
+
+    (tmp_path / "3_part0.mp4").write_bytes(b"")
+    existing, clip_info, _ = prepare_clip(scene, SCENE_INFO, frames, plan["clips"][0])
+    assert clip_info is None and existing["video_path"] == str(tmp_path / "3_part0.mp4")
+
+    existing, clip_info, part_path = prepare_clip(scene, SCENE_INFO, frames, plan["clips"][1])
+    assert existing is None and part_path == str(tmp_path / "3_part1.mp4")
+    assert clip_info["scene_id"] == "3_part1"
+    assert (clip_info["image_path_start"], clip_info["image_path_end"]) == ("key1.jpeg", "end.jpeg")
+
+    result = scene_video_result(scene, [{"video_url": "a"}, {"video_url": "b"}])
+    assert result["clip_count"] == 2 and result["video_url"] is None and result["video_path"] == scene["final_path"]
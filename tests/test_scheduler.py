@@ -0,0 +1,43 @@
+from app.config import RunConfig
+from app.core.clip_planner import plan_scene_clips
+from app.core.scheduler import estimate_makespan, estimate_scene_cost, order_lpt
+
+CONFIG = RunConfig(
+    video_frame_rate=24, video_min_frames=141, video_max_frames=241,
+    jimeng_queue_seconds=60, jimeng_seconds_per_frame=0.5,
+)
+
+
+def plan(scene_id, audio_duration):
+    return plan_scene_clips(scene_id, audio_duration, CONFIG)
+
+
+def test_scene_cost_critical_path_and_work():
+    cost = estimate_scene_cost(plan("1", 20.0), CONFIG)
+    assert cost == {"work": 2 * (60 + 241 * 0.5), "critical": 60 + 241 * 0.5}
+
+
+def test_order_lpt_longest_critical_path_first_then_most_work():
+    plans = [plan("3", 5.0), plan("1", 20.0), plan("2", 30.0)]
+    # 20s与30s的子片段同为241帧，关键路径相同，总工作量大的30s场景先提交
+    assert [p["scene_id"] for p in order_lpt(plans, CONFIG)] == ["2", "1", "3"]
+
+
+def test_order_lpt_ties_keep_scene_order():
+    plans = [plan("10", 5.0), plan("2", 5.0), plan("1", 5.0)]
+    assert [p["scene_id"] for p in order_lpt(plans, CONFIG)] == ["1", "2", "10"]
+
+
+def test_makespan_list_scheduling():
+    clip = 60 + 141 * 0.5
+    plans = [plan("1", 5.0), plan("2", 5.0), plan("3", 5.0)]
+    assert estimate_makespan(plans, 1, CONFIG) == 3 * clip
+    assert estimate_makespan(plans, 2, CONFIG) == 2 * clip
+    assert estimate_makespan(plans, 3, CONFIG) == clip
+    assert estimate_makespan(plans, 0, CONFIG) == 3 * clip
+    assert estimate_makespan([], 2, CONFIG) == 0.0
+
+
+def test_lpt_order_does_not_lengthen_makespan():
+    plans = [plan("1", 5.0), plan("2", 5.0), plan("3", 30.0)]
+    assert estimate_makespan(order_lpt(plans, CONFIG), 2, CONFIG) <= estimate_makespan(plans, 2, CONFIG)
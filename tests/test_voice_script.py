@@ -0,0 +1,60 @@
+import json
+import pytest
+from app.config import RunConfig
+from app.services.llm import draft_segment_counts, merge_voice_drafts, renumber_voice_script, voice_script_chunks
+from app.utils.file_ops import split_chapter
+
+
+def test_split_chapter_on_paragraph_boundaries():
+    chapter = "\n".join(["甲" * 30, "", "乙" * 30, "丙" * 50, "丁" * 10])
+    chunks = split_chapter(chapter, 60)
+    assert chunks == ["甲" * 30 + "\n" + "乙" * 30, "丙" * 50 + "\n" + "丁" * 10]
+
+
+def test_split_chapter_splits_long_paragraph_by_sentence():
+    paragraph = "一二三四五。" * 10 + "六七八！"
+    chunks = split_chapter(paragraph, 14)
+    assert "".join(c.replace("\n", "") for c in chunks) == paragraph
+    assert all(len(c.replace("\n", "")) <= 14 for c in chunks)
+
+
+@pytest.mark.parametrize("max_chars", [1, 7, 100, 10000])
+def test_split_chapter_keeps_text_in_order(max_chars):
+    paragraphs = [f"第{i}段。" * (i % 5 + 1) for i in range(40)]
+    chunks = split_chapter("\n\n".join(paragraphs), max_chars)
+    assert "".join(c.replace("\n", "") for c in chunks) == "".join(paragraphs)
+
+
+def test_voice_script_chunks_only_when_enabled_and_long():
+    config = RunConfig(voice_script_map_reduce=True, voice_script_chunk_chars=10)
+    chapter = "甲" * 8 + "\n" + "乙" * 8
+    assert voice_script_chunks(chapter, config) == ["甲" * 8, "乙" * 8]
+    assert voice_script_chunks(chapter, config.replace(voice_script_map_reduce=False)) == [chapter]
+    assert voice_script_chunks(chapter, config.replace(voice_script_chunk_chars=100)) == [chapter]
+
+
+def test_renumber_voice_script_drops_empty_segments():
+    script = {"3": {"content": "a"}, "x": {"content": ""}, "7": {"content": "b"}, "note": "ignored"}
+    assert renumber_voice_script(script) == {"1": {"content": "a"}, "2": {"content": "b"}}
+
+
+@pytest.mark.parametrize("sizes", [[1], [4000, 4000, 10], [100, 200, 300, 400], [1] * 25, [3000, 0], [0, 0]])
+def test_draft_segment_counts_sum_and_minimum(sizes):
+    chunks = ["字" * size for size in sizes]
+    counts = draft_segment_counts(chunks)
+    assert sum(counts) == max(18, len(chunks))
+    assert all(count >= 1 for count in counts)
+
+
+def test_draft_segment_counts_follow_chunk_length():
+    counts = draft_segment_counts(["字" * 3000, "字" * 1000], 18)
+    assert counts == [13, 5]
+
+
+def test_merge_voice_drafts_groups_segments_in_order():
+    drafts = [
+        {"1": {"content": "a", "character": ["甲"]}, "2": {"content": "b", "character": ["乙"]}},
+        {"1": {"content": "c", "character": ["甲"]}},
+    ]
+    script = json.loads(merge_voice_drafts(drafts, paragraphs=2))
+    assert script == {"1": {"content": "ab", "character": ["甲", "乙"]}, "2": {"content": "c", "character": ["甲"]}}
@@ -0,0 +1,58 @@
+import os
+from app.config import RunConfig
+from app.core.watch import NovelWatcher, CHAPTER_BASELINE, CHAPTER_DONE, CHAPTER_FAILED
+
+
+def write_novel(path, chapters):
+    with open(path, "w", encoding="utf-8") as f:
+        for title, body in chapters:
+            f.write(f"{title}\n\n{body}\n\n")
+
+
+def make_watcher(tmp_path, results):
+    novel = str(tmp_path / "novel.txt")
+    config = RunConfig(novel_file_path=novel, watch_settle_seconds=0)
+    calls = []
+
+    def run_chapter(chapter_config):
+        calls.append(chapter_config.target_chapter)
+        return results.get(chapter_config.target_chapter, {"ok": True})
+
+    return novel, NovelWatcher(str(tmp_path / "watch"), config, run_chapter), calls
+
+
+def test_first_poll_records_baseline(tmp_path):
+    novel, watcher, calls = make_watcher(tmp_path, {})
+    write_novel(novel, [("第1章 开端", "内容一")])
+    assert watcher.poll(force=True) == 0
+    assert calls == []
+    assert watcher.index["chapters"]["第1章 开端"]["status"] == CHAPTER_BASELINE
+    assert os.path.exists(watcher.index_path)
+
+
+def test_new_chapter_processed_and_failed_retried(tmp_path):
+    novel, watcher, calls = make_watcher(tmp_path, {"第2章 发展": None})
+    write_novel(novel, [("第1章 开端", "内容一")])
+    watcher.poll(force=True)
+
+    write_novel(novel, [("第1章 开端", "内容一"), ("第2章 发展", "内容二")])
+    assert watcher.poll() == 1
+    assert calls == ["第2章 发展"]
+    assert watcher.index["chapters"]["第2章 发展"]["status"] == CHAPTER_FAILED
+
+    # 文件未变化时不重新索引；强制检查时重试失败章节
+    assert watcher.poll() == 0
+    watcher.run_chapter = lambda config: calls.append(config.target_chapter) or {"ok": True}
+    assert watcher.poll(force=True) == 1
+    assert watcher.index["chapters"]["第2章 发展"]["status"] == CHAPTER_DONE
+
+
+def test_waits_for_settle_seconds(tmp_path):
+    novel, watcher, calls = make_watcher(tmp_path, {})
+    watcher.base_config = watcher.base_config.replace(watch_settle_seconds=3600)
+    write_novel(novel, [("第1章 开端", "内容一")])
+    watcher.poll(force=True)
+
+    write_novel(novel, [("第1章 开端", "内容一"), ("第2章 发展", "内容二")])
+    assert watcher.poll() == 0
+    assert calls == []